@@ -1,6 +1,11 @@
 import os
+import sys
+import heapq
 from collections import defaultdict
 
+from word_sketch import TopKSketch
+from url_log import UrlLog
+
 '''
 This class is meant to help manage data for the analytics,
 and then print the analytics after crawling is finished
@@ -9,17 +14,29 @@ and then print the analytics after crawling is finished
 class Analytics_Data:
 
     ANALYTICS_FILE_NAME = os.path.join(".", "analytics.txt")
+    #Downloaded URLs and traps are streamed to these logs as they are found instead of being kept in memory
+    URLS_DOWNLOADED_FILE_NAME = os.path.join(".", "analytics", "urls_downloaded.log")
+    TRAPS_FILE_NAME = os.path.join(".", "analytics", "traps.log")
+    TOP_WORDS_COUNT = 50
+    #Ways of counting word frequencies: "exact" keeps a count for every word ever seen,
+    #"sketch" uses a fixed amount of memory and reports the top words with an error bound (see word_sketch.py)
+    WORD_COUNTER_MODES = ("exact", "sketch")
     # set of stop words, since set has a O(1) time complexity when indexing
     STOP_WORDS = {"a", "able", "about", "above", "abst", "accordance", "according", "accordingly", "across", "act", "actually", "added", "adj", "affected", "affecting", "affects", "after", "afterwards", "again", "against", "ah", "all", "almost", "alone", "along", "already", "also", "although", "always", "am", "among", "amongst", "an", "and", "announce", "another", "any", "anybody", "anyhow", "anymore", "anyone", "anything", "anyway", "anyways", "anywhere", "apparently", "approximately", "are", "aren", "arent", "arise", "around", "as", "aside", "ask", "asking", "at", "auth", "available", "away", "awfully", "b", "back", "be", "became", "because", "become", "becomes", "becoming", "been", "before", "beforehand", "begin", "beginning", "beginnings", "begins", "behind", "being", "believe", "below", "beside", "besides", "between", "beyond", "biol", "both", "brief", "briefly", "but", "by", "c", "ca", "came", "can", "cannot", "can't", "cause", "causes", "certain", "certainly", "co", "com", "come", "comes", "contain", "containing", "contains", "could", "couldnt", "d", "date", "did", "didn't", "different", "do", "does", "doesn't", "doing", "done", "don't", "down", "downwards", "due", "during", "e", "each", "ed", "edu", "effect", "eg", "eight", "eighty", "either", "else", "elsewhere", "end", "ending", "enough", "especially", "et", "et-al", "etc", "even", "ever", "every", "everybody", "everyone", "everything", "everywhere", "ex", "except", "f", "far", "few", "ff", "fifth", "first", "five", "fix", "followed", "following", "follows", "for", "former", "formerly", "forth", "found", "four", "from", "further", "furthermore", "g", "gave", "get", "gets", "getting", "give", "given", "gives", "giving", "go", "goes", "gone", "got", "gotten", "h", "had", "happens", "hardly", "has", "hasn't", "have", "haven't", "having", "he", "hed", "hence", "her", "here", "hereafter", "hereby", "herein", "heres", "hereupon", "hers", "herself", "hes", "hi", "hid", "him", "himself", "his", "hither", "home", "how", "howbeit", "however", "hundred", "i", "id", "ie", "if", "i'll", "im", "immediate", "immediately", "importance", "important", "in", "inc", "indeed", "index", "information", "instead", "into", "invention", "inward", "is", "isn't", "it", "itd", "it'll", "its", "itself", "i've", "j", "just", "k", "keep", "keeps", "kept", "kg", "km", "know", "known", "knows", "l", "largely", "last", "lately", "later", "latter", "latterly", "least", "less", "lest", "let", "lets", "like", "liked", "likely", "line", "little", "'ll", "look", "looking", "looks", "ltd", "m", "made", "mainly", "make", "makes", "many", "may", "maybe", "me", "mean", "means", "meantime", "meanwhile", "merely", "mg", "might", "million", "miss", "ml", "more", "moreover", "most", "mostly", "mr", "mrs", "much", "mug", "must", "my", "myself", "n", "na", "name", "namely", "nay", "nd", "near", "nearly", "necessarily", "necessary", "need", "needs", "neither", "never", "nevertheless", "new", "next", "nine", "ninety", "no", "nobody", "non", "none", "nonetheless", "noone", "nor", "normally", "nos", "not", "noted", "nothing", "now", "nowhere", "o", "obtain", "obtained", "obviously", "of", "off", "often", "oh", "ok", "okay", "old", "omitted", "on", "once", "one", "ones", "only", "onto", "or", "ord", "other", "others", "otherwise", "ought", "our", "ours", "ourselves", "out", "outside", "over", "overall", "owing", "own", "p", "page", "pages", "part", "particular", "particularly", "past", "per", "perhaps", "placed", "please", "plus", "poorly", "possible", "possibly", "potentially", "pp", "predominantly", "present", "previously", "primarily", "probably", "promptly", "proud", "provides", "put", "q", "que", "quickly", "quite", "qv", "r", "ran", "rather", "rd", "re", "readily", "really", "recent", "recently", "ref", "refs", "regarding", "regardless", "regards", "related", "relatively", "research", "respectively", "resulted", "resulting", "results", "right", "run", "s", "said", "same", "saw", "say", "saying", "says", "sec", "section", "see", "seeing", "seem", "seemed", "seeming", "seems", "seen", "self", "selves", "sent", "seven", "several", "shall", "she", "shed", "she'll", "shes", "should", "shouldn't", "show", "showed", "shown", "showns", "shows", "significant", "significantly", "similar", "similarly", "since", "six", "slightly", "so", "some", "somebody", "somehow", "someone", "somethan", "something", "sometime", "sometimes", "somewhat", "somewhere", "soon", "sorry", "specifically", "specified", "specify", "specifying", "still", "stop", "strongly", "sub", "substantially", "successfully", "such", "sufficiently", "suggest", "sup", "sure", "t", "take", "taken", "taking", "tell", "tends", "th", "than", "thank", "thanks", "thanx", "that", "that'll", "thats", "that've", "the", "their", "theirs", "them", "themselves", "then", "thence", "there", "thereafter", "thereby", "thered", "therefore", "therein", "there'll", "thereof", "therere", "theres", "thereto", "thereupon", "there've", "these", "they", "theyd", "they'll", "theyre", "they've", "think", "this", "those", "thou", "though", "thoughh", "thousand", "throug", "through", "throughout", "thru", "thus", "til", "tip", "to", "together", "too", "took", "toward", "towards", "tried", "tries", "truly", "try", "trying", "ts", "twice", "two", "u", "un", "under", "unfortunately", "unless", "unlike", "unlikely", "until", "unto", "up", "upon", "ups", "us", "use", "used", "useful", "usefully", "usefulness", "uses", "using", "usually", "v", "value", "various", "'ve", "very", "via", "viz", "vol", "vols", "vs", "w", "want", "wants", "was", "wasnt", "way", "we", "wed", "welcome", "we'll", "went", "were", "werent", "we've", "what", "whatever", "what'll", "whats", "when", "whence", "whenever", "where", "whereafter", "whereas", "whereby", "wherein", "wheres", "whereupon", "wherever", "whether", "which", "while", "whim", "whither", "who", "whod", "whoever", "whole", "who'll", "whom", "whomever", "whos", "whose", "why", "widely", "willing", "wish", "with", "within", "without", "wont", "words", "world", "would", "wouldnt", "www", "x", "y", "yes", "yet", "you", "youd", "you'll", "your", "youre", "yours", "yourself", "yourselves", "you've", "z", "zero"}
 
-    def __init__(self):
+    def __init__(self, word_counter_mode="exact"):
+        if(word_counter_mode not in self.WORD_COUNTER_MODES):
+            raise ValueError("Unknown word counter mode: {}".format(word_counter_mode))
         self.subdomain_url_count = defaultdict(int)
         self.most_valid_outlinks_url = "unknwown"
         self.most_valid_outlinks_count = 0
-        self.urls_downloaded = set()
+        self.urls_downloaded = UrlLog(self.URLS_DOWNLOADED_FILE_NAME)
+        self.traps = UrlLog(self.TRAPS_FILE_NAME)
         self.longest_page_url = "unknown"
         self.longest_page_length = 0
+        self.word_counter_mode = word_counter_mode
         self.word_frequencies = defaultdict(int)
+        self.word_sketch = TopKSketch(self.TOP_WORDS_COUNT) if word_counter_mode == "sketch" else None
 
     '''
     Update the number of URLs processed for a given subdomain
@@ -47,7 +64,7 @@ class Analytics_Data:
     Register the URL of a newly-identified trap
     '''
     def update_traps(self, trap_url):
-        self.traps.append(trap_url)
+        self.traps.add(trap_url)
 
     '''
     Take the URL of a page, and that page's word count.
@@ -65,10 +82,81 @@ class Analytics_Data:
     ## words still tend to represent crawler traps i.e numbers, months, etc.
     def update_word_frequency(self, word, amount=1):
         if(word not in self.STOP_WORDS): #  will not add if word is a stop word
-            self.word_frequencies[word] += amount
+            if(self.word_sketch is not None):
+                self.word_sketch.add(word, amount)
+            else:
+                self.word_frequencies[word] += amount
+
+    '''
+    Update the word frequencies with all of a page's words at once
+    (takes a dictionary mapping each word to the number of times it appears in the page)
+    '''
+    def update_word_frequencies(self, page_word_counts):
+        stop_words = self.STOP_WORDS
+        #The words are visited in the page's order: the sketch's top words depend on the order they are added in,
+        #and a set's order changes from run to run (with PYTHONHASHSEED)
+        if(self.word_sketch is not None):
+            word_sketch = self.word_sketch
+            for word, amount in page_word_counts.items():
+                if(word not in stop_words):
+                    word_sketch.add(word, amount)
+        else:
+            word_frequencies = self.word_frequencies
+            for word, amount in page_word_counts.items():
+                if(word not in stop_words):
+                    word_frequencies[word] += amount
+
+    '''
+    Return the most common words as (word, count) pairs, most frequent first (ties broken alphabetically)
+    '''
+    def get_most_common_words(self, count):
+        if(self.word_sketch is not None):
+            return self.word_sketch.most_common()[:count]
+        return heapq.nsmallest(count, self.word_frequencies.items(), key=lambda item: (-item[1], item[0]))
+
+    '''
+    Add the analytics of another part of the same crawl (e.g. another shard, see sharded_crawl.py) to these ones
+    '''
+    def merge(self, other):
+        if(other.word_counter_mode != self.word_counter_mode):
+            raise ValueError("Cannot merge {} word counts into {} ones".format(other.word_counter_mode, self.word_counter_mode))
+        for subdomain, count in other.subdomain_url_count.items():
+            self.subdomain_url_count[subdomain] += count
+        self.update_most_valid_outlinks(other.most_valid_outlinks_url, other.most_valid_outlinks_count)
+        self.update_longest_page(other.longest_page_url, other.longest_page_length)
+        for url in other.urls_downloaded:
+            self.new_url_downloaded(url)
+        for trap in other.traps:
+            self.update_traps(trap)
+        if(self.word_sketch is not None):
+            self.word_sketch.merge(other.word_sketch)
+        else:
+            word_frequencies = self.word_frequencies
+            for word, count in other.word_frequencies.items():
+                word_frequencies[word] += count
+
+    '''
+    Return the sizes of the analytics data, for the crawl stats (see crawl_stats.py)
+    (the word counts' size is the table's, not counting the words themselves)
+    '''
+    def get_stats(self):
+        if(self.word_sketch is not None):
+            words, word_counts_bytes = len(self.word_sketch.candidates), self.word_sketch.nbytes()
+        else:
+            words, word_counts_bytes = len(self.word_frequencies), sys.getsizeof(self.word_frequencies)
+        return {
+            "urls_downloaded": len(self.urls_downloaded),
+            "traps": len(self.traps),
+            "subdomains": len(self.subdomain_url_count),
+            "words": words,
+            "word_counts_bytes": word_counts_bytes
+        }
 
     #Output analytics data to a .txt file
-    def log_analytics(self, fetched, traps):
+    #The downloaded URLs and the traps are streamed from their logs (traps can also be given as any other iterable)
+    def log_analytics(self, fetched, traps=None):
+        if(traps is None):
+            traps = self.traps
 
         output_file = open(self.ANALYTICS_FILE_NAME, 'w')
     
@@ -114,13 +202,12 @@ class Analytics_Data:
         #and print out the list
         #(Reused code from Assignment 1A)
         #As before, the idea to use tuples for tie-breaking came from this resource: https://stackoverflow.com/a/54396160
-        words = list(self.word_frequencies.keys())
-        sort_key = lambda x: (-self.word_frequencies[x], x)
-        words.sort(key=sort_key)
-        words = words[:50]
+        #Only the top words are selected (with a heap), rather than sorting the whole vocabulary
         output_file.write("\nFifty most common words:")
-        for word in words:
-            output_file.write("\n\t{0:20}{1}".format(word + ':', self.word_frequencies[word]))
+        if(self.word_sketch is not None):
+            output_file.write(" (estimated; each count may be too high by up to {})".format(self.word_sketch.error_bound()))
+        for word, frequency in self.get_most_common_words(self.TOP_WORDS_COUNT):
+            output_file.write("\n\t{0:20}{1}".format(word + ':', frequency))
 
         output_file.close()
         
@@ -0,0 +1,176 @@
+import marshal
+import os
+import sqlite3
+import zlib
+from array import array
+from hashlib import blake2b
+from urllib.request import pathname2url
+
+'''
+Persistent cache of what page_analyzer.analyze_page derives from each page (outlinks, token counts, word count,
+fingerprints), so a re-crawl of the same corpus doesn't have to parse, tokenize and fingerprint every page again.
+
+A page's artifacts are keyed by a digest of its corpus file (the raw bytes, before any decoding), the url it was
+fetched under (relative links are resolved against it) and the extractor. Pages that could not be used are cached too,
+so they are not retried with every parser on the next run.
+The results are stored in SQLite as zlib-compressed marshal data, with the fingerprints as a packed array of 64-bit
+integers.
+
+Invalidation: the cache records the VERSION it was written with and empties itself when opened with another one, so
+bump VERSION whenever a change to the extractors, the tokenizer or the fingerprints changes analyze_page's results.
+It can also be cleared explicitly (see clear). Once the cache grows past max_bytes, the oldest entries are evicted.
+'''
+
+class ArtifactCache:
+
+    FILE_NAME = os.path.join(".", "corpus_state", "artifacts.sqlite")
+    VERSION = 1
+    MAX_BYTES = 1024 * 1024 * 1024
+    #Once over max_bytes, the oldest entries are evicted until the cache is down to this fraction of it
+    EVICTION_TARGET = 0.9
+    COMMIT_INTERVAL = 100 #Number of new entries between commits
+    COMPRESSION_LEVEL = 1
+
+    '''
+    Open (or create) the cache in file_name.
+    A read-only cache (as used by worker processes, while the crawler's process writes) never creates, clears or
+    evicts anything, and only sees what was committed before it looked.
+    '''
+    def __init__(self, file_name=FILE_NAME, max_bytes=MAX_BYTES, read_only=False):
+        self.file_name = file_name
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.pending = 0 #New entries since the last commit
+        if(read_only):
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(pathname2url(os.path.abspath(file_name))), uri=True)
+            self.count = self.total_bytes = None
+            return
+
+        directory = os.path.dirname(file_name)
+        if(directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(file_name)
+        #Lets the workers read while this process writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS artifacts (key BLOB PRIMARY KEY, payload BLOB NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)")
+        version = self.connection.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        if(version is None or version[0] != self.VERSION):
+            self.clear()
+        self.count, self.total_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM artifacts").fetchone()
+
+    '''
+    Return the cache key of a page fetched through Corpus.fetch_url, or None if the page can't be cached
+    (it isn't in the corpus, or has no Content-Type, so analyze_page has nothing to do anyway)
+    '''
+    @staticmethod
+    def get_key(url_data, extractor):
+        record = getattr(url_data, "record", None)
+        if(record is None or url_data["content_type"] is None):
+            return None
+        digest = blake2b(digest_size=16)
+        digest.update(extractor.encode("ascii"))
+        digest.update(b"\0")
+        digest.update(url_data["url"].encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+        digest.update(record.buffer)
+        return digest.digest()
+
+    @staticmethod
+    def encode(page_result):
+        if(page_result is None):
+            return b""
+        fingerprints = array('Q', sorted(page_result["fingerprints"])).tobytes()
+        return zlib.compress(marshal.dumps((page_result["url"], page_result["links"], page_result["tokens"],
+                                            page_result["word_count"], fingerprints, page_result["parser"])),
+                             ArtifactCache.COMPRESSION_LEVEL)
+
+    '''
+    Rebuild analyze_page's result from its encoded form (no time was spent on it, so its timings are empty)
+    '''
+    @staticmethod
+    def decode(payload):
+        if(not payload):
+            return None
+        url, links, tokens, word_count, packed_fingerprints, parser = marshal.loads(zlib.decompress(payload))
+        fingerprints = array('Q')
+        fingerprints.frombytes(packed_fingerprints)
+        return {
+            "url": url,
+            "fingerprints": set(fingerprints),
+            "tokens": tokens,
+            "word_count": word_count,
+            "links": links,
+            "parser": parser,
+            "timings": {}
+        }
+
+    '''
+    Return (found, analyze_page's result) for a key; the result is None both when it isn't cached (found is False) and
+    when the page was cached as unusable
+    '''
+    def get(self, key):
+        row = self.connection.execute("SELECT payload FROM artifacts WHERE key = ?", (key,)).fetchone()
+        if(row is None):
+            return False, None
+        return True, self.decode(row[0])
+
+    def put(self, key, page_result):
+        payload = self.encode(page_result)
+        inserted = self.connection.execute("INSERT OR IGNORE INTO artifacts (key, payload) VALUES (?, ?)",
+                                           (key, payload)).rowcount
+        if(inserted <= 0):
+            return
+        self.count += 1
+        self.total_bytes += len(payload)
+        if(self.total_bytes > self.max_bytes):
+            self.evict()
+        self.pending += 1
+        if(self.pending >= self.COMMIT_INTERVAL):
+            self.flush()
+
+    '''
+    Evict the oldest entries until the cache is down to EVICTION_TARGET of max_bytes
+    '''
+    def evict(self):
+        excess = self.total_bytes - self.max_bytes * self.EVICTION_TARGET
+        evicted = 0
+        evicted_bytes = 0
+        last_rowid = None
+        for rowid, size in self.connection.execute("SELECT rowid, LENGTH(payload) FROM artifacts ORDER BY rowid"):
+            if(evicted_bytes >= excess):
+                break
+            evicted += 1
+            evicted_bytes += size
+            last_rowid = rowid
+        if(last_rowid is not None):
+            self.connection.execute("DELETE FROM artifacts WHERE rowid <= ?", (last_rowid,))
+        self.count -= evicted
+        self.total_bytes -= evicted_bytes
+
+    '''
+    Drop every entry, e.g. after changing how pages are analyzed without bumping VERSION
+    '''
+    def clear(self):
+        self.connection.execute("DELETE FROM artifacts")
+        self.connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)", (self.VERSION,))
+        self.connection.commit()
+        self.count = self.total_bytes = 0
+        self.pending = 0
+
+    def flush(self):
+        if(not self.read_only):
+            self.connection.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def get_stats(self):
+        return {
+            "entries": self.count,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
@@ -0,0 +1,9 @@
+'''
+Benchmarks for the crawler.
+    corpus_generator: writes synthetic corpora in the same format as the real one (see Corpus.fetch_url)
+    run_benchmarks:   times each stage of the crawl and a whole crawl, and writes the results as JSON
+
+Run from the repository root, e.g.:
+    python -m benchmarks.corpus_generator /tmp/bench_corpus --pages 2000
+    python -m benchmarks.run_benchmarks --corpus /tmp/bench_corpus --output results.json
+'''
@@ -0,0 +1,182 @@
+import argparse
+import os
+import random
+
+from cbor import cbor
+
+from corpus import Corpus
+from frontier import Frontier
+
+'''
+Synthetic corpus generator.
+Writes one sha224-named CBOR file per url, in the same format as the real corpus (see Corpus.fetch_url and
+corpus_record.py): a map of {b'type', b'value'} fields holding url, http_code, http_headers, raw_content,
+is_redirected and final_url.
+Besides ordinary pages, the corpus contains the kinds of pages the crawler has to cope with:
+    redirects:          the record of one url holds the content of another, with final_url set
+    malformed pages:    truncated markup, binary garbage and empty documents
+    NUL-laden pages:    pages with runs of NUL bytes in the middle of the markup
+    no content type:    records without http_headers
+    near-duplicates:    boilerplate pages that differ only in a number
+    mirrors:            byte-identical copies of a page under one of its query-string variants
+    a calendar trap:    a chain of day pages on one host, each linking to the next day under the same path
+Outlinks also include relative links, links to files the crawler ignores, external links and links to urls that are
+not in the corpus.
+
+Usage: python -m benchmarks.corpus_generator <output_dir> [--pages N] [--graph random|tree|hub] ...
+'''
+
+HOSTS = ["www.ics.uci.edu", "vision.ics.uci.edu", "fano.ics.uci.edu", "archive.ics.uci.edu", "cml.ics.uci.edu",
+         "mlphysics.ics.uci.edu", "sli.ics.uci.edu", "hombao.ics.uci.edu"]
+SECTIONS = ["people", "research", "courses", "news", "pubs", "projects", "software", "about"]
+CALENDAR_URL = "http://calendar.ics.uci.edu/calendar.php?type=day&date={}"
+IGNORED_LINKS = ["/files/report{}.pdf", "/images/photo{}.jpg", "/slides/lecture{}.pptx", "/data/set{}.zip"]
+EXTERNAL_LINKS = ["https://www.google.com/search?q={}", "http://www.uci.edu/news/{}", "https://github.com/project{}"]
+WORDS = ("the of and to in is for on that with as by this are be from at or an it which data research student "
+         "faculty computer science informatics software systems network learning machine algorithm model graph "
+         "theory course lecture project paper university irvine california donald bren school information "
+         "security database vision language human interaction statistics analysis design engineering "
+         "undergraduate graduate seminar talk workshop conference journal award grant lab group center "
+         "department program office hours homework exam quiz schedule fall winter spring summer 2019 2020 "
+         "café naïve résumé").split()
+GRAPHS = ("random", "tree", "hub")
+
+'''
+Build the CBOR map of a corpus file
+'''
+def make_record(url, content, content_type=b"text/html; charset=utf-8", http_code=200, final_url=None):
+    record = {
+        b'url': {b'type': 'str', b'value': url},
+        b'http_code': {b'type': 'int', b'value': http_code},
+        b'raw_content': {b'type': 'bytes', b'value': content},
+        b'is_redirected': {b'type': 'bool', b'value': final_url is not None}
+    }
+    if(content_type is not None):
+        record[b'http_headers'] = {b'type': 'list', b'value': [
+            {b'k': {b'type': 'bytes', b'value': b'Content-Type'}, b'v': {b'type': 'bytes', b'value': content_type}}
+        ]}
+    if(final_url is not None):
+        record[b'final_url'] = {b'type': 'str', b'value': final_url}
+    return record
+
+def make_page(title, paragraphs, links):
+    body = "".join("<p>{}</p>\n".format(paragraph) for paragraph in paragraphs)
+    anchors = "".join('<li><a href="{}">{}</a></li>\n'.format(link, link.rsplit("/", 1)[-1] or "home") for link in links)
+    return ("<!DOCTYPE html>\n<html><head><title>{}</title><style>body {{ background: url('/bg.png') }}</style></head>\n"
+            "<body><h1>{}</h1>\n{}<ul>\n{}</ul></body></html>\n").format(title, title, body, anchors).encode("utf-8")
+
+def make_paragraphs(rng, word_count):
+    words = [rng.choice(WORDS) for _ in range(word_count)]
+    return [" ".join(words[i:i + 60]) for i in range(0, len(words), 60)]
+
+'''
+Pick the pages that page number index links to, according to the shape of the link graph
+'''
+def pick_targets(rng, graph, index, page_count, links_per_page):
+    if(graph == "tree"):
+        children = range(index * links_per_page + 1, min(page_count, (index + 1) * links_per_page + 1))
+        return list(children) + ([(index - 1) // links_per_page] if index > 0 else [])
+    if(graph == "hub"):
+        #Cubing a uniform number skews the targets towards the first pages, which become hubs
+        return [int(page_count * rng.random() ** 3) for _ in range(links_per_page)]
+    return [rng.randrange(page_count) for _ in range(links_per_page)]
+
+'''
+Write a synthetic corpus to output_dir; return a summary of what was written.
+The first page is the frontier's seed url, so a crawl of the corpus starts at it.
+'''
+def generate_corpus(output_dir, pages=1000, graph="random", links_per_page=12, words_per_page=400, redirect_rate=0.03,
+                    malformed_rate=0.02, nul_rate=0.02, no_content_type_rate=0.01, duplicate_rate=0.05,
+                    calendar_days=120, seed=0, mirror_rate=0.03):
+    if(graph not in GRAPHS):
+        raise ValueError("Unknown link graph shape: {}".format(graph))
+    if(not os.path.exists(output_dir)):
+        os.makedirs(output_dir)
+    rng = random.Random(seed)
+    #Mirrors are picked with their own generator, so the rest of the corpus is the same whatever the mirror rate
+    mirror_rng = random.Random(seed + 1)
+    corpus = Corpus(output_dir, cache_max_bytes=0)
+    summary = {"pages": 0, "redirects": 0, "malformed": 0, "nul": 0, "no_content_type": 0, "duplicates": 0,
+               "mirrors": 0, "calendar_days": 0, "bytes": 0}
+
+    def write(url, record):
+        with open(os.path.join(output_dir, corpus.get_url_digest(url)), "wb") as corpus_file:
+            data = cbor.dumps(record)
+            corpus_file.write(data)
+        summary["bytes"] += len(data)
+
+    urls = [Frontier.SEED_URL] + ["http://{}/{}/{}{}.html".format(rng.choice(HOSTS), rng.choice(SECTIONS),
+                                                                  rng.choice(["page", "item", "~user"]), i)
+                                  for i in range(1, pages)]
+    for index, url in enumerate(urls):
+        links = [urls[target] for target in pick_targets(rng, graph, index, pages, links_per_page)]
+        links.append("/{}/index{}.html".format(rng.choice(SECTIONS), index)) #Relative, and usually not in the corpus
+        links.append(url + "#top")
+        variant_url = url + "?sort=" + rng.choice(["asc", "desc"])
+        links.append(variant_url)
+        links.append(rng.choice(IGNORED_LINKS).format(index))
+        links.append(rng.choice(EXTERNAL_LINKS).format(index))
+        if(index == 0):
+            links.append(CALENDAR_URL.format(0))
+
+        roll = rng.random()
+        content_type = b"text/html; charset=utf-8"
+        final_url = None
+        if(roll < duplicate_rate):
+            content = make_page("Event listing", ["No events are scheduled for listing number {}.".format(index)] +
+                                ["Please check back later for upcoming events at the department."] * 20, links)
+            summary["duplicates"] += 1
+        else:
+            content = make_page("Page {}".format(index), make_paragraphs(rng, rng.randint(words_per_page // 2, words_per_page * 3 // 2)), links)
+            roll -= duplicate_rate
+            if(roll < redirect_rate):
+                final_url = url.replace(".html", "/") if url.endswith(".html") else url + "index.html"
+                summary["redirects"] += 1
+            elif(roll < redirect_rate + malformed_rate):
+                kind = rng.randrange(3)
+                content = content[:len(content) // 3] if kind == 0 else \
+                    bytes(rng.getrandbits(8) for _ in range(512)) if kind == 1 else b""
+                summary["malformed"] += 1
+            elif(roll < redirect_rate + malformed_rate + nul_rate):
+                middle = len(content) // 2
+                content = content[:middle] + b"\x00" * rng.randint(1, 64) + content[middle:]
+                summary["nul"] += 1
+            elif(roll < redirect_rate + malformed_rate + nul_rate + no_content_type_rate):
+                content_type = None
+                summary["no_content_type"] += 1
+        write(url, make_record(url, content, content_type, final_url=final_url))
+        summary["pages"] += 1
+        if(mirror_rng.random() < mirror_rate):
+            write(variant_url, make_record(variant_url, content, content_type))
+            summary["mirrors"] += 1
+
+    #The calendar trap: every day links to the next one, and the pages differ only in their date
+    for day in range(calendar_days):
+        links = [CALENDAR_URL.format(day + 1), CALENDAR_URL.format(max(0, day - 1)), Frontier.SEED_URL]
+        content = make_page("Calendar", ["Events for day {}".format(day)] + ["There are no events on this day."] * 15, links)
+        write(CALENDAR_URL.format(day), make_record(CALENDAR_URL.format(day), content))
+        summary["calendar_days"] += 1
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic corpus")
+    parser.add_argument("output_dir")
+    parser.add_argument("--pages", type=int, default=1000, help="number of ordinary pages")
+    parser.add_argument("--graph", choices=GRAPHS, default="random", help="shape of the link graph")
+    parser.add_argument("--links-per-page", type=int, default=12)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--redirect-rate", type=float, default=0.03)
+    parser.add_argument("--malformed-rate", type=float, default=0.02)
+    parser.add_argument("--nul-rate", type=float, default=0.02)
+    parser.add_argument("--no-content-type-rate", type=float, default=0.01)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--calendar-days", type=int, default=120, help="length of the calendar trap")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mirror-rate", type=float, default=0.03)
+    args = parser.parse_args()
+
+    summary = generate_corpus(args.output_dir, args.pages, args.graph, args.links_per_page, args.words_per_page,
+                              args.redirect_rate, args.malformed_rate, args.nul_rate, args.no_content_type_rate,
+                              args.duplicate_rate, args.calendar_days, args.seed, args.mirror_rate)
+    print(", ".join("{}: {}".format(key, value) for key, value in summary.items()))
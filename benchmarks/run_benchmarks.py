@@ -0,0 +1,283 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cbor import cbor
+
+from benchmarks.corpus_generator import generate_corpus, GRAPHS
+
+'''
+Benchmark suite: per-stage microbenchmarks and an end-to-end crawl of a (synthetic or given) corpus.
+Every stage is run over all the pages of the corpus, repeat times, and the fastest run is reported, together with
+the number of operations, so results from different versions can be compared. The bytes allocated per page, from
+fetching it to analyzing it, are measured separately (see measure_allocations).
+The results are written as JSON; with --compare, they are also compared with an earlier results file.
+
+Usage: python -m benchmarks.run_benchmarks [--corpus DIR | --pages N --graph random|tree|hub] [--output FILE]
+                                           [--repeat R] [--workers W] [--compare OLD_FILE]
+
+The crawl writes its state (frontier_state, analytics, journal, ...) to the current directory, so every stage that
+touches it runs inside a scratch directory.
+'''
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+'''
+Time func(item) over every item, repeat times; return the result of the fastest run.
+If setup is given, it is called before every run (outside the timing) and returns the func to run.
+'''
+def time_stage(func, items, repeat, setup=None):
+    best = None
+    for _ in range(repeat):
+        if(setup is not None):
+            func = setup()
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "operations": len(items),
+        "seconds": best,
+        "operations_per_second": len(items) / best if best > 0 else None,
+        "microseconds_per_operation": best / len(items) * 1e6 if items else None
+    }
+
+def get_version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=REPOSITORY_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+'''
+Return the url of every file in a corpus (Corpus itself never decodes the url field), in file name order.
+A packed corpus (see corpus_pack.py) is read from its pack, and the pack's own files are never taken for corpus files.
+'''
+def read_corpus_urls(corpus_dir):
+    from corpus_pack import CorpusPack, is_corpus_file_name
+
+    urls = []
+    pack = CorpusPack.find(corpus_dir)
+    if(pack is not None):
+        #The index is sorted by digest, which is the order of the (hex digest) file names
+        for _, offset, length in pack.entries():
+            urls.append(cbor.loads(bytes(pack.data[offset:offset + length]))[b'url'][b'value'])
+        pack.close()
+        return urls
+    for name in sorted(os.listdir(corpus_dir)):
+        if(not is_corpus_file_name(name)):
+            continue
+        with open(os.path.join(corpus_dir, name), "rb") as corpus_file:
+            urls.append(cbor.loads(corpus_file.read())[b'url'][b'value'])
+    return urls
+
+'''
+Run every microbenchmark on the corpus in corpus_dir
+'''
+def run_stages(corpus_dir, repeat):
+    from corpus import Corpus
+    from frontier import Frontier
+    from fingerprinter import get_fingerprints
+    from page_analyzer import parse_document, analyze_page, get_content_buffer, PageText
+    from string_tokenizer import tokenize
+    import streaming_extractor
+
+    stages = {}
+    corpus = Corpus(corpus_dir, cache_max_bytes=0)
+    corpus.build_manifest()
+    urls = read_corpus_urls(corpus_dir)
+    missing_urls = ["http://www.ics.uci.edu/missing/page{}.html".format(i) for i in range(len(urls))]
+
+    stages["get_file_name"] = time_stage(corpus.get_file_name, urls, repeat)
+    stages["get_file_name_missing"] = time_stage(corpus.get_file_name, missing_urls, repeat)
+    stages["fetch_url"] = time_stage(lambda url: get_content_buffer(corpus.fetch_url(url)), urls, repeat)
+
+    pages = []
+    for url in urls:
+        url_data = corpus.fetch_url(url)
+        content = url_data["content"]
+        if(url_data["content_type"] is not None and isinstance(content, bytes) and content):
+            pages.append((url, content, dict(url_data)))
+    stages["parse_document"] = time_stage(lambda page: parse_document(page[1]), pages, repeat)
+    stages["extract_streaming"] = time_stage(
+        lambda page: streaming_extractor.extract(page[1], page[0], "html", PageText().add_text), pages, repeat)
+    stages["analyze_page"] = time_stage(lambda page: analyze_page(dict(page[2])), pages, repeat)
+
+    documents = [(page[0], parse_document(page[1])) for page in pages]
+    texts = [doc.text_content() for _, doc in documents if doc is not None]
+    stages["tokenize"] = time_stage(tokenize, texts, repeat)
+    stages["get_fingerprints"] = time_stage(get_fingerprints, texts, repeat)
+
+    #Every run checks all the pages against a fresh frontier
+    prints = [(url, get_fingerprints(doc.text_content())) for url, doc in documents if doc is not None]
+    def new_frontier_check():
+        frontier = Frontier()
+        return lambda page: frontier.is_near_duplicate(*page)
+    stages["is_near_duplicate"] = time_stage(None, prints, repeat, setup=new_frontier_check)
+
+    #save_frontier and load_frontier use paths relative to the current directory
+    frontier = Frontier()
+    for url in urls + missing_urls:
+        frontier.add_url(url)
+    for url, page_prints in prints:
+        frontier.is_near_duplicate(url, page_prints)
+    with scratch_directory():
+        stages["save_frontier"] = time_stage(lambda _: frontier.save_frontier(), [None], repeat)
+        stages["load_frontier"] = time_stage(lambda _: Frontier().load_frontier(), [None], repeat)
+        stages["save_frontier"]["urls"] = stages["load_frontier"]["urls"] = len(frontier.urls_set)
+    return stages
+
+'''
+Fetch and analyze every page of the corpus once, tracing the memory allocated for each one: the most bytes it had
+allocated at once, above what was allocated before it. tracemalloc only sees Python's own allocations (not lxml's),
+so this counts the copies made of a page on its way from the corpus to the parser, and what is extracted from it.
+'''
+def measure_allocations(corpus_dir):
+    from corpus import Corpus
+    from page_analyzer import analyze_page
+
+    corpus = Corpus(corpus_dir, cache_max_bytes=0)
+    corpus.build_manifest()
+    urls = read_corpus_urls(corpus_dir)
+    allocated = []
+    page_bytes = 0
+    tracemalloc.start()
+    try:
+        for url in urls:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            url_data = corpus.fetch_url(url)
+            analyze_page(url_data)
+            allocated.append(tracemalloc.get_traced_memory()[1] - before)
+            page_bytes += url_data["size"]
+            url_data = None
+    finally:
+        tracemalloc.stop()
+    return {
+        "pages": len(allocated),
+        "page_bytes_per_page": page_bytes / len(allocated) if allocated else None,
+        "bytes_per_page": sum(allocated) / len(allocated) if allocated else None,
+        "max_bytes_per_page": max(allocated, default=None),
+        "bytes_per_page_byte": sum(allocated) / page_bytes if page_bytes else None
+    }
+
+'''
+Crawl the whole corpus once (serially, or with workers processes) and measure the pages per second
+'''
+def run_end_to_end(corpus_dir, workers, prefetch_depth):
+    corpus_dir = os.path.abspath(corpus_dir)
+    with scratch_directory():
+        #Importing crawler sets up logging to ./history.log, so it is imported inside the scratch directory
+        from corpus import Corpus
+        from crawler import Crawler
+        from frontier import Frontier
+        frontier = Frontier()
+        frontier.load_frontier()
+        corpus = Corpus(corpus_dir)
+        corpus.load_manifest()
+        crawler = Crawler(frontier, corpus, workers=workers, prefetch_depth=prefetch_depth)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            crawler.start_crawling()
+        elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "prefetch_depth": prefetch_depth,
+        "pages": frontier.fetched,
+        "seconds": elapsed,
+        "pages_per_second": frontier.fetched / elapsed if elapsed > 0 else None
+    }
+
+@contextlib.contextmanager
+def scratch_directory():
+    previous = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="crawler_benchmark_")
+    os.chdir(directory)
+    try:
+        yield directory
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+
+'''
+Print how each stage changed since an earlier results file
+'''
+def compare(results, old_results):
+    print("{:<24} {:>14} {:>14} {:>8}".format("stage", "old us/op", "new us/op", "change"))
+    for name, stage in results["stages"].items():
+        old = old_results.get("stages", {}).get(name)
+        if(old is None or not old.get("microseconds_per_operation") or not stage.get("microseconds_per_operation")):
+            continue
+        change = stage["microseconds_per_operation"] / old["microseconds_per_operation"] - 1
+        print("{:<24} {:>14.1f} {:>14.1f} {:>+7.1%}".format(
+            name, old["microseconds_per_operation"], stage["microseconds_per_operation"], change))
+    old_bytes = old_results.get("allocations", {}).get("bytes_per_page")
+    new_bytes = results["allocations"]["bytes_per_page"]
+    if(old_bytes and new_bytes):
+        print("{:<24} {:>14.0f} {:>14.0f} {:>+7.1%}   (bytes/page)".format("allocations", old_bytes, new_bytes,
+                                                                           new_bytes / old_bytes - 1))
+    old_rate = old_results.get("end_to_end", {}).get("pages_per_second")
+    new_rate = results["end_to_end"]["pages_per_second"]
+    if(old_rate and new_rate):
+        print("{:<24} {:>14.1f} {:>14.1f} {:>+7.1%}   (pages/s)".format("end_to_end", old_rate, new_rate, new_rate / old_rate - 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the crawler")
+    parser.add_argument("--corpus", help="corpus to benchmark on (a synthetic one is generated if not given)")
+    parser.add_argument("--pages", type=int, default=2000, help="size of the generated corpus")
+    parser.add_argument("--graph", choices=GRAPHS, default="random", help="link graph of the generated corpus")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generated corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage; the fastest one is reported")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for the end-to-end crawl")
+    parser.add_argument("--prefetch-depth", type=int, default=8, help="prefetch depth for the end-to-end crawl")
+    parser.add_argument("--output", default="benchmark_results.json", help="file the results are written to")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    args = parser.parse_args()
+
+    results = {
+        "version": get_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform()
+    }
+    generated_dir = None
+    corpus_dir = args.corpus
+    if(corpus_dir is None):
+        generated_dir = corpus_dir = tempfile.mkdtemp(prefix="crawler_benchmark_corpus_")
+        results["corpus"] = dict(generate_corpus(corpus_dir, args.pages, args.graph, seed=args.seed),
+                                 graph=args.graph, seed=args.seed)
+    else:
+        results["corpus"] = {"path": os.path.abspath(corpus_dir), "files": len(os.listdir(corpus_dir))}
+    corpus_dir = os.path.abspath(corpus_dir)
+
+    try:
+        results["stages"] = run_stages(corpus_dir, args.repeat)
+        results["allocations"] = measure_allocations(corpus_dir)
+        results["end_to_end"] = run_end_to_end(corpus_dir, args.workers, args.prefetch_depth)
+    finally:
+        if(generated_dir is not None):
+            shutil.rmtree(generated_dir, ignore_errors=True)
+
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2)
+    for name, stage in results["stages"].items():
+        print("{:<24} {:>8} ops {:>12.1f} us/op".format(name, stage["operations"], stage["microseconds_per_operation"] or 0))
+    print("{:<24} {:>8} pages {:>10.0f} bytes/page".format("allocations", results["allocations"]["pages"],
+                                                            results["allocations"]["bytes_per_page"] or 0))
+    print("{:<24} {:>8} pages {:>10.1f} pages/s".format("end_to_end", results["end_to_end"]["pages"],
+                                                         results["end_to_end"]["pages_per_second"] or 0))
+    if(args.compare):
+        with open(args.compare) as old_file:
+            compare(results, json.load(old_file))
+    print("Results written to {}".format(args.output))
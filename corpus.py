@@ -1,8 +1,10 @@
 import hashlib
 import os
+import pickle
 from urllib.parse import urlparse
 
-from cbor import cbor
+from corpus_pack import CorpusPack
+from corpus_record import CorpusRecord, RecordCache, UrlData
 
 
 class Corpus:
@@ -10,15 +12,28 @@ class Corpus:
     This class is responsible for handling corpus related functionalities like mapping a url to its local file name
     """
 
-    def __init__(self, corpus_base_dir):
-        self.corpus_base_dir = os.path.join(corpus_base_dir, "")
+    # File name to be used when loading and saving the corpus manifest
+    MANIFEST_DIR_NAME = "corpus_state"
+    MANIFEST_FILE_NAME = os.path.join(".", MANIFEST_DIR_NAME, "manifest.pkl")
+    #Length of a sha224 hex digest; file names of this length are stored as raw bytes in the manifest
+    DIGEST_HEX_LENGTH = 56
+    #Total size of the recently decoded records kept in memory; set to 0 to disable the cache
+    RECORD_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
-    def get_file_name(self, url):
+    def __init__(self, corpus_base_dir, cache_max_bytes=RECORD_CACHE_MAX_BYTES):
+        self.corpus_base_dir = os.path.join(corpus_base_dir, "")
+        #Set of every corpus file name (see get_manifest_key).
+        #Stays None until a manifest is loaded, in which case existence checks fall back to the file system
+        self.manifest = None
+        #Recently decoded records, so redirect chains and repeated fetches don't decode the same file twice
+        self.record_cache = RecordCache(cache_max_bytes)
+        #Use the packed corpus (see corpus_pack.py) instead of the per-url files whenever one has been built for them
+        self.pack = CorpusPack.find(self.corpus_base_dir)
+
+    def get_url_digest(self, url):
         """
-        Given a url, this method looks up for a local file in the corpus and, if existed, returns the file address. Otherwise
-        returns None
+        Given a url, returns the name its file would have in the corpus (the sha224 hex digest of the normalized url)
         """
-
         pd = urlparse(url)
         if pd.path:
             path = pd.path[:-1] if pd.path[-1] == "/" else pd.path
@@ -33,11 +48,104 @@ class Corpus:
                 hashed_link = hashlib.sha224(url.encode("utf-8")).hexdigest()
             except UnicodeEncodeError:
                 hashed_link = str(hash(url))
+        return hashed_link
+
+    def get_file_name(self, url):
+        """
+        Given a url, this method looks up for a local file in the corpus and, if existed, returns the file address. Otherwise
+        returns None
+        """
+        return self.find_file(self.get_url_digest(url))
+
+    '''
+    Return the address of the corpus file with the given name (a url digest), or None if the corpus doesn't have it
+    '''
+    def find_file(self, hashed_link):
+        if self.pack is not None:
+            if hashed_link in self.pack:
+                return os.path.join(self.corpus_base_dir, hashed_link)
+            return None
+
+        if self.manifest is not None:
+            if self.get_manifest_key(hashed_link) in self.manifest:
+                return os.path.join(self.corpus_base_dir, hashed_link)
+            return None
 
         if os.path.exists(os.path.join(self.corpus_base_dir, hashed_link)):
             return os.path.join(self.corpus_base_dir, hashed_link)
         return None
 
+    '''
+    Convert a corpus file name to the key used in the manifest.
+    sha224 hex names are packed into 28 raw bytes, which halves the memory used per entry.
+    '''
+    def get_manifest_key(self, file_name):
+        if len(file_name) == self.DIGEST_HEX_LENGTH:
+            try:
+                return bytes.fromhex(file_name)
+            except ValueError:
+                pass
+        return file_name
+
+    '''
+    Scan the corpus directory once and record the name of every file in the manifest (no file is opened)
+    '''
+    def build_manifest(self):
+        manifest = set()
+        with os.scandir(self.corpus_base_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    manifest.add(self.get_manifest_key(entry.name))
+        self.manifest = manifest
+        return manifest
+
+    def save_manifest(self):
+        """
+        saves the current manifest to a file using pickle
+        """
+        if not os.path.exists(self.MANIFEST_DIR_NAME):
+            os.makedirs(self.MANIFEST_DIR_NAME)
+
+        with open(self.MANIFEST_FILE_NAME, "wb") as manifest_file:
+            pickle.dump({"corpus_base_dir": self.corpus_base_dir, "entries": self.manifest}, manifest_file)
+
+    def load_manifest(self):
+        """
+        loads a previously saved manifest into memory if it belongs to this corpus. Otherwise scans the corpus to build a
+        new manifest and saves it for the next run
+        """
+        if os.path.isfile(self.MANIFEST_FILE_NAME):
+            try:
+                with open(self.MANIFEST_FILE_NAME, "rb") as manifest_file:
+                    saved = pickle.load(manifest_file)
+                if saved["corpus_base_dir"] == self.corpus_base_dir:
+                    #Manifests saved by earlier versions map each name to its metadata; only the names are used
+                    self.manifest = set(saved["entries"])
+                    return
+            except Exception:
+                pass
+        self.build_manifest()
+        self.save_manifest()
+
+    '''
+    Read a corpus file, decoding only its header fields
+    '''
+    def read_record(self, file_name):
+        if self.pack is not None:
+            return CorpusRecord(self.pack.read(os.path.basename(file_name)))
+        with open(file_name, "rb") as corpus_file:
+            return CorpusRecord(corpus_file.read())
+
+    '''
+    Return the record for a corpus file, from the record cache if it was decoded recently
+    '''
+    def get_record(self, file_name):
+        record = self.record_cache.get(file_name)
+        if record is None:
+            record = self.read_record(file_name)
+            self.record_cache.put(file_name, record)
+        return record
+
     def fetch_url(self, url):
         """
         This method, using the given url, should find the corresponding file in the corpus and return a dictionary representing
@@ -55,7 +163,8 @@ class Corpus:
         :return: a dictionary containing the http response for the given url
         """
 
-        file_name = self.get_file_name(url)
+        hashed_link = self.get_url_digest(url)
+        file_name = self.find_file(hashed_link)
         if file_name is None:
             url_data = {
                 "url": url,
@@ -68,25 +177,17 @@ class Corpus:
                 "final_url": None
             }
         else:
-            data_dict = cbor.load(open(file_name, "rb"))
-
-            def get_content_type(data):
-                if b'http_headers' not in data: return None
-
-                hlist = data_dict[b"http_headers"][b'value']
-                for header in hlist:
-                    if header[b'k'][b'value'] == b'Content-Type':
-                        return str(header[b'v'][b'value'])
-                return None
-
-            url_data = {
-                "url": url,
-                "content": data_dict[b'raw_content'][b'value'] if b'raw_content' in data_dict and b'value' in data_dict[b'raw_content'] else "",
-                "http_code": int(data_dict[b"http_code"][b'value']),
-                "content_type": get_content_type(data_dict),
-                "size": os.stat(file_name).st_size,
-                "is_redirected": data_dict[b'is_redirected'][b'value'] if b'is_redirected' in data_dict and b'value' in data_dict[b'is_redirected'] else False,
-                "final_url": data_dict[b'final_url'][b'value'] if b'final_url' in data_dict and b'value' in data_dict[b'final_url'] else None
-            }
+            record = self.get_record(file_name)
+
+            #"content" is left out on purpose: UrlData decodes it from the record the first time it is read
+            url_data = UrlData(
+                record,
+                url=url,
+                http_code=record.http_code,
+                content_type=record.content_type,
+                size=len(record.buffer),
+                is_redirected=record.is_redirected,
+                final_url=record.final_url
+            )
 
         return url_data
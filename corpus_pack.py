@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import struct
+from sys import argv
+
+logger = logging.getLogger(__name__)
+
+'''
+Packed corpus format.
+Instead of one CBOR file per URL, the corpus is stored as:
+    corpus.pack      an append-only data file holding every corpus file's bytes back to back
+    corpus.pack.idx  a header followed by fixed-size (digest, offset, length) entries sorted by digest
+Both files are memory-mapped, so looking up a URL is a binary search over the index and reading a page hands out a
+memoryview slice of the data file without copying it.
+The pack is kept in the corpus directory itself. Its header records the directory it was built from and how many
+corpus files that directory held, and a pack that doesn't match its directory any more is not used (see find).
+
+Usage: python corpus_pack.py <corpus_dir>
+'''
+
+PACK_FILE_NAME = "corpus.pack"
+INDEX_FILE_NAME = "corpus.pack.idx"
+
+INDEX_MAGIC = b"CPIDX2\x00\x00"
+INDEX_HEADER = struct.Struct("<8sQQH") #magic, entry count, source file count, source directory length
+INDEX_ENTRY = struct.Struct("<28sQI") #sha224 digest, offset, length
+DIGEST_HEX_LENGTH = 56
+CORPUS_FILE_NAME = re.compile(r'[0-9a-f]{%d}' % DIGEST_HEX_LENGTH)
+
+'''
+Convert a corpus file name to its 28-byte index key.
+Corpus files are named by their sha224 hex digest; the rare names that aren't (see Corpus.get_url_digest) are hashed.
+'''
+def get_pack_key(file_name):
+    if(len(file_name) == DIGEST_HEX_LENGTH):
+        try:
+            return bytes.fromhex(file_name)
+        except ValueError:
+            pass
+    return hashlib.sha224(file_name.encode("utf-8")).digest()
+
+'''
+Whether a file name is that of a corpus file (a sha224 hex digest), as opposed to the pack's own files, their
+temporary files, or anything else left in the directory
+'''
+def is_corpus_file_name(file_name):
+    return CORPUS_FILE_NAME.fullmatch(file_name) is not None
+
+'''
+Return the number of corpus files in a directory
+'''
+def count_corpus_files(corpus_dir):
+    with os.scandir(corpus_dir) as entries:
+        return sum(1 for entry in entries if is_corpus_file_name(entry.name) and entry.is_file())
+
+'''
+The form of a directory name that is recorded in (and compared against) the index header
+'''
+def get_source_dir(corpus_dir):
+    return os.path.realpath(corpus_dir)
+
+
+class CorpusPack:
+    '''
+    Read-only access to a packed corpus
+    '''
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        self.pack_file = open(os.path.join(pack_dir, PACK_FILE_NAME), "rb")
+        self.index_file = open(os.path.join(pack_dir, INDEX_FILE_NAME), "rb")
+        self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.source_file_count, source_dir_length = INDEX_HEADER.unpack_from(self.index, 0)
+        if(magic != INDEX_MAGIC):
+            raise ValueError("{} is not a corpus pack index".format(self.index_file.name))
+        self.source_dir = self.index[INDEX_HEADER.size:INDEX_HEADER.size + source_dir_length].decode("utf-8")
+        self.entries_offset = INDEX_HEADER.size + source_dir_length
+        #mmap refuses to map an empty file
+        if(os.fstat(self.pack_file.fileno()).st_size > 0):
+            self.data = memoryview(mmap.mmap(self.pack_file.fileno(), 0, access=mmap.ACCESS_READ))
+        else:
+            self.data = memoryview(b"")
+
+    '''
+    Return the CorpusPack in corpus_dir, or None if it has none or its pack doesn't match it.
+    A pack only matches if it was built from this directory, and the directory holds the same number of corpus files
+    as it did then (or none at all, when the pack is all that was kept of the corpus).
+    '''
+    @classmethod
+    def find(cls, corpus_dir):
+        if(not os.path.isfile(os.path.join(corpus_dir, PACK_FILE_NAME)) or not os.path.isfile(os.path.join(corpus_dir, INDEX_FILE_NAME))):
+            return None
+        try:
+            pack = cls(corpus_dir)
+        except (ValueError, struct.error) as error:
+            logger.warning("Not using the corpus pack: %s. Rebuild it with corpus_pack.py", error)
+            return None
+        problem = None
+        if(pack.source_dir != get_source_dir(corpus_dir)):
+            problem = "it was built from {}".format(pack.source_dir)
+        else:
+            file_count = count_corpus_files(corpus_dir)
+            if(file_count > 0 and file_count != pack.source_file_count):
+                problem = "it was built from {} corpus files, but {} has {} now".format(pack.source_file_count,
+                                                                                       corpus_dir, file_count)
+        if(problem is not None):
+            logger.warning("Not using the corpus pack in %s: %s. Rebuild it with corpus_pack.py", corpus_dir, problem)
+            pack.close()
+            return None
+        return pack
+
+    '''
+    Binary search the index for a corpus file name.
+    Return its (offset, length) in the data file, or None if the pack doesn't contain it
+    '''
+    def lookup(self, file_name):
+        key = get_pack_key(file_name)
+        low, high = 0, self.count
+        while(low < high):
+            middle = (low + high) // 2
+            entry_key, offset, length = INDEX_ENTRY.unpack_from(self.index, self.entries_offset + middle * INDEX_ENTRY.size)
+            if(entry_key < key):
+                low = middle + 1
+            elif(entry_key > key):
+                high = middle
+            else:
+                return offset, length
+        return None
+
+    def __contains__(self, file_name):
+        return self.lookup(file_name) is not None
+
+    '''
+    Return the bytes of a corpus file as a zero-copy memoryview, or None if the pack doesn't contain it
+    '''
+    def read(self, file_name):
+        entry = self.lookup(file_name)
+        if(entry is None):
+            return None
+        offset, length = entry
+        return self.data[offset:offset + length]
+
+    '''
+    Iterate over (key, offset, length) for every file in the pack, in key order
+    '''
+    def entries(self):
+        for i in range(self.count):
+            yield INDEX_ENTRY.unpack_from(self.index, self.entries_offset + i * INDEX_ENTRY.size)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.data.release()
+        self.index.close()
+        self.pack_file.close()
+        self.index_file.close()
+
+
+'''
+Build (or extend) the packed corpus of a directory of corpus files.
+The data file is only ever appended to: files already in an existing pack are skipped, new ones are added at the end,
+and the index is rewritten (with the directory and its current file count in the header).
+Return the number of files added.
+'''
+def build_pack(corpus_dir):
+    pack_path = os.path.join(corpus_dir, PACK_FILE_NAME)
+    index_path = os.path.join(corpus_dir, INDEX_FILE_NAME)
+
+    #The entries of an existing pack stay valid even if it no longer matches the directory, since they point into the
+    #data file next to it
+    index = {}
+    if(os.path.isfile(pack_path) and os.path.isfile(index_path)):
+        try:
+            existing = CorpusPack(corpus_dir)
+            index = {key: (offset, length) for key, offset, length in existing.entries()}
+            existing.close()
+        except (ValueError, struct.error):
+            #An index in an older format (or a damaged one): start the data file over
+            os.remove(pack_path)
+
+    added = 0
+    file_count = 0
+    with open(pack_path, "ab") as pack_file, os.scandir(corpus_dir) as corpus_entries:
+        offset = pack_file.tell()
+        for entry in corpus_entries:
+            if(not entry.is_file() or not is_corpus_file_name(entry.name)):
+                continue
+            file_count += 1
+            key = get_pack_key(entry.name)
+            if(key in index):
+                continue
+            with open(entry.path, "rb") as corpus_file:
+                content = corpus_file.read()
+            pack_file.write(content)
+            index[key] = (offset, len(content))
+            offset += len(content)
+            added += 1
+
+    #Write the new index next to the old one and swap it in, so a crash never leaves a truncated index behind
+    with open(index_path + ".tmp", "wb") as index_file:
+        source_dir = get_source_dir(corpus_dir).encode("utf-8")
+        index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(index), file_count, len(source_dir)))
+        index_file.write(source_dir)
+        for key in sorted(index):
+            offset, length = index[key]
+            index_file.write(INDEX_ENTRY.pack(key, offset, length))
+    os.replace(index_path + ".tmp", index_path)
+    return added
+
+
+if __name__ == "__main__":
+    corpus_dir = argv[1]
+    added = build_pack(corpus_dir)
+    print("Packed {} new files into {}".format(added, os.path.join(corpus_dir, PACK_FILE_NAME)))
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Background prefetching of corpus records.
+The prefetcher looks ahead in the frontier and starts fetching the next few urls on a small thread pool, so that by the
+time the crawler gets to a url its record is (ideally) already in memory and the crawl loop doesn't wait on the disk.
+'''
+
+class Prefetcher:
+
+    DEFAULT_DEPTH = 8 #Number of urls fetched ahead of the crawler
+    DEFAULT_THREADS = 4
+
+    def __init__(self, corpus, frontier, depth=DEFAULT_DEPTH, threads=DEFAULT_THREADS):
+        self.corpus = corpus
+        self.frontier = frontier
+        self.depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        #Bounded buffer of in-flight or finished fetches, keyed by url
+        self.buffer = {}
+
+        #Stats
+        self.ready = 0 #Record was already loaded when the crawler asked for it
+        self.stalls = 0 #The crawler had to wait for a fetch that was still running
+        self.misses = 0 #The url was never prefetched, so it was fetched synchronously
+        self.evicted = 0 #A prefetched url dropped out of the look-ahead window before the crawler got to it
+
+    '''
+    Start fetching the next urls in the frontier, up to the prefetch depth.
+    The look-ahead is only approximate with a per-host scheduler (newly queued urls can overtake the ones prefetched),
+    so fetches of urls that are no longer among the next ones are dropped first; otherwise they would fill up the
+    buffer and stop the prefetching.
+    '''
+    def fill(self):
+        upcoming = self.frontier.peek_urls(self.depth)
+        if(len(self.buffer) > 0):
+            window = set(upcoming)
+            for url in [url for url in self.buffer if url not in window]:
+                self.buffer.pop(url).cancel()
+                self.evicted += 1
+        for url in upcoming:
+            if(url not in self.buffer):
+                self.buffer[url] = self.executor.submit(self.corpus.fetch_url, url)
+
+    '''
+    Return the url_data for a url (see Corpus.fetch_url), then top up the prefetch buffer
+    '''
+    def fetch_url(self, url):
+        future = self.buffer.pop(url, None)
+        if(future is None):
+            self.misses += 1
+            url_data = self.corpus.fetch_url(url)
+        else:
+            if(future.done()):
+                self.ready += 1
+            else:
+                self.stalls += 1
+            url_data = future.result()
+        self.fill()
+        return url_data
+
+    '''
+    Drop a url that the crawler decided not to fetch after all
+    '''
+    def discard(self, url):
+        future = self.buffer.pop(url, None)
+        if(future is not None):
+            future.cancel()
+
+    def get_stats(self):
+        requests = self.ready + self.stalls + self.misses
+        return {
+            "depth": self.depth,
+            "ready": self.ready,
+            "stalls": self.stalls,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "stall_rate": (self.stalls / requests) if requests > 0 else 0.0
+        }
+
+    def shutdown(self):
+        for future in self.buffer.values():
+            future.cancel()
+        self.buffer.clear()
+        self.executor.shutdown(wait=True)
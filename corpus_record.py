@@ -0,0 +1,312 @@
+import struct
+import threading
+from collections import OrderedDict
+
+from cbor import cbor
+
+'''
+Helpers for reading corpus files lazily.
+Every corpus file is a CBOR map whose values are maps of the form {b'type': ..., b'value': ...}.
+Only the small header fields are decoded when a file is read; raw_content (which is by far the largest field)
+is skipped over and only decoded once somebody actually asks for it.
+'''
+
+#Fields that are decoded up front; everything else in the file is skipped
+HEADER_FIELDS = {b'http_code', b'http_headers', b'is_redirected', b'final_url'}
+CONTENT_FIELD = b'raw_content'
+#The encoded form of the b'value' key inside a field
+VALUE_KEY = cbor.dumps(b'value')
+
+BREAK = 0xff
+
+
+'''
+Read the head of the CBOR item starting at pos.
+Return (major type, argument, position after the head); the argument is None for indefinite-length items
+'''
+def read_head(buffer, pos):
+    initial = buffer[pos]
+    major = initial >> 5
+    info = initial & 0x1f
+    pos += 1
+    if(info < 24):
+        return major, info, pos
+    if(info == 24):
+        return major, buffer[pos], pos + 1
+    if(info == 25):
+        return major, struct.unpack_from(">H", buffer, pos)[0], pos + 2
+    if(info == 26):
+        return major, struct.unpack_from(">I", buffer, pos)[0], pos + 4
+    if(info == 27):
+        return major, struct.unpack_from(">Q", buffer, pos)[0], pos + 8
+    if(info == 31):
+        return major, None, pos
+    raise ValueError("Invalid CBOR head at offset {}".format(pos - 1))
+
+'''
+Return the position just after the CBOR item starting at pos, without decoding it
+'''
+def skip_item(buffer, pos):
+    major, argument, pos = read_head(buffer, pos)
+    if(major in (0, 1, 7)):
+        #Integers, simple values and floats carry everything in their head
+        return pos
+    if(major in (2, 3)):
+        if(argument is not None):
+            return pos + argument
+        #Indefinite-length strings are a series of definite-length chunks terminated by a break
+        while(buffer[pos] != BREAK):
+            pos = skip_item(buffer, pos)
+        return pos + 1
+    if(major == 6):
+        return skip_item(buffer, pos)
+    items = argument * 2 if (major == 5 and argument is not None) else argument
+    if(items is None):
+        while(buffer[pos] != BREAK):
+            pos = skip_item(buffer, pos)
+        return pos + 1
+    for _ in range(items):
+        pos = skip_item(buffer, pos)
+    return pos
+
+
+class CorpusRecord:
+    '''
+    A single corpus file.
+    The header fields are decoded when the record is created, while raw_content is decoded on first access.
+    '''
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.fields = {}
+        self.content_span = None
+        self._content = None
+        self.scan()
+
+    '''
+    Walk the top-level map once, decoding the header fields and remembering where raw_content is
+    '''
+    def scan(self):
+        buffer = self.buffer
+        try:
+            major, pairs, pos = read_head(buffer, 0)
+            if(major != 5):
+                raise ValueError("Corpus file is not a CBOR map")
+            count = 0
+            while((pairs is None and buffer[pos] != BREAK) or (pairs is not None and count < pairs)):
+                key_end = skip_item(buffer, pos)
+                key = cbor.loads(bytes(buffer[pos:key_end]))
+                value_end = skip_item(buffer, key_end)
+                if(key in HEADER_FIELDS):
+                    self.fields[key] = cbor.loads(bytes(buffer[key_end:value_end]))
+                elif(key == CONTENT_FIELD):
+                    self.content_span = (key_end, value_end)
+                pos = value_end
+                count += 1
+        except (ValueError, IndexError, struct.error):
+            #Not something the skimmer understands; fall back to decoding the whole file
+            data_dict = cbor.loads(bytes(buffer))
+            self.fields = {key: value for key, value in data_dict.items() if key in HEADER_FIELDS}
+            self._content = self.get_value(data_dict.get(CONTENT_FIELD), "")
+
+    @staticmethod
+    def get_value(field, default=None):
+        if(field is not None and b'value' in field):
+            return field[b'value']
+        return default
+
+    @property
+    def http_code(self):
+        return int(self.fields[b'http_code'][b'value'])
+
+    @property
+    def is_redirected(self):
+        return self.get_value(self.fields.get(b'is_redirected'), False)
+
+    @property
+    def final_url(self):
+        return self.get_value(self.fields.get(b'final_url'))
+
+    @property
+    def content_type(self):
+        if b'http_headers' not in self.fields: return None
+
+        hlist = self.fields[b"http_headers"][b'value']
+        for header in hlist:
+            if header[b'k'][b'value'] == b'Content-Type':
+                return str(header[b'v'][b'value'])
+        return None
+
+    @property
+    def content(self):
+        if(self._content is None):
+            if(self.content_span is None):
+                self._content = ""
+            else:
+                self._content = self.decode_content()
+        return self._content
+
+    '''
+    Return a ContentBuffer over the value of raw_content.
+    When it is a plain byte or text string (CBOR text is UTF-8 already), the buffer is a view of the record's own bytes
+    (of the mapped pack, if the corpus is packed), so nothing is copied or decoded; otherwise it is decoded as content is.
+    '''
+    def content_buffer(self):
+        if(self._content is None and self.content_span is not None):
+            value = self.find_content_value()
+            if(value is not None):
+                _, start, end = value
+                return ContentBuffer(memoryview(self.buffer)[start:end])
+        return ContentBuffer(self.content)
+
+    '''
+    Decode the value of raw_content.
+    When it is a plain byte string, the bytes are sliced straight out of the buffer instead of going through the decoder.
+    '''
+    def decode_content(self):
+        value = self.find_content_value()
+        if(value is not None and value[0] == 2):
+            _, start, end = value
+            return bytes(self.buffer[start:end])
+        start, end = self.content_span
+        return self.get_value(cbor.loads(bytes(self.buffer[start:end])), "")
+
+    '''
+    Find the b'value' of raw_content, if it is a definite-length byte (major type 2) or text (major type 3) string.
+    Return (major type, start, end) of the string's bytes in the buffer, or None.
+    '''
+    def find_content_value(self):
+        buffer = self.buffer
+        start, end = self.content_span
+        try:
+            major, pairs, pos = read_head(buffer, start)
+            if(major == 5 and pairs is not None):
+                for _ in range(pairs):
+                    key_end = skip_item(buffer, pos)
+                    value_end = skip_item(buffer, key_end)
+                    if(bytes(buffer[pos:key_end]) == VALUE_KEY):
+                        value_major, length, value_start = read_head(buffer, key_end)
+                        if(value_major in (2, 3) and length is not None):
+                            return value_major, value_start, value_start + length
+                        return None
+                    pos = value_end
+        except (ValueError, IndexError, struct.error):
+            pass
+        return None
+
+    '''
+    Approximate number of bytes held by this record, for the record cache
+    '''
+    def nbytes(self):
+        size = len(self.buffer)
+        if(self._content is not None):
+            size += len(self._content)
+        return size
+
+
+class ContentBuffer:
+    '''
+    The content of a page, as bytes, for the parsers to read without copying it first.
+    It wraps a memoryview, usually of the corpus record the page came from (see CorpusRecord.content_buffer), which
+    lxml parses in place (see streaming_extractor.extract), so a page is never copied as a whole unless a consumer
+    needs it in one bytes object (see tobytes), and then only once.
+    str content is encoded to UTF-8 once, when the buffer is created.
+    '''
+
+    def __init__(self, data):
+        if(data is None):
+            data = b""
+        elif(isinstance(data, str)):
+            data = data.encode("utf-8")
+        #A bytes object is already what tobytes returns, so it is kept instead of copied again
+        self._bytes = data if isinstance(data, bytes) else None
+        self.view = memoryview(data)
+
+    def __len__(self):
+        return self.view.nbytes
+
+    '''
+    Return the whole content as one bytes object (copied the first time, for views)
+    '''
+    def tobytes(self):
+        if(self._bytes is None):
+            self._bytes = self.view.tobytes()
+        return self._bytes
+
+    '''
+    Return the content without its NUL bytes, found and removed in a single pass, or None if it has none
+    '''
+    def strip_nul(self):
+        content = self.tobytes()
+        cleaned = content.replace(b'\x00', b'')
+        return cleaned if len(cleaned) < len(content) else None
+
+
+class UrlData(dict):
+    '''
+    The url_data dictionary returned by Corpus.fetch_url.
+    It behaves like a plain dictionary, except that "content" is only decoded from the record when it is first read.
+    The page analyzer never reads it: it parses a view of the record instead (see CorpusRecord.content_buffer).
+    '''
+
+    def __init__(self, record, **fields):
+        super().__init__(**fields)
+        self.record = record
+
+    def __missing__(self, key):
+        if(key == "content"):
+            self["content"] = self.record.content
+            return self["content"]
+        raise KeyError(key)
+
+
+class RecordCache:
+    '''
+    A least-recently-used cache of CorpusRecords, evicted by total size in bytes rather than by entry count.
+    It may be shared by the prefetch threads (see corpus_prefetcher.py), so every operation holds a lock.
+    '''
+
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.records = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            record = self.records.get(key)
+            if(record is None):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.records.move_to_end(key)
+            #The content may have been materialized since the record was cached
+            self.resize(key, record)
+            return record
+
+    def put(self, key, record):
+        if(self.max_bytes <= 0):
+            return
+        with self.lock:
+            if(key in self.records):
+                self.records.move_to_end(key)
+            self.records[key] = record
+            self.resize(key, record)
+
+    def resize(self, key, record):
+        size = record.nbytes()
+        self.total_bytes += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+        while(self.total_bytes > self.max_bytes and len(self.records) > 1):
+            old_key, _ = self.records.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(old_key)
+        if(self.total_bytes > self.max_bytes):
+            #A single record larger than the whole budget is not worth keeping
+            self.records.pop(key)
+            self.total_bytes -= self.sizes.pop(key)
+
+    def __len__(self):
+        return len(self.records)
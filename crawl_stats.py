@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource #Not available on Windows
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+'''
+Instrumentation of the crawl loop: how long each stage takes, how often things happen, and how big the crawl state is.
+    stages:   a StageTimer (count, total, histogram) per stage of the loop, e.g. fetch, analyze, near_duplicate
+    counters: running totals, e.g. near-duplicates, unusable pages, parse failures by parser
+    gauges:   functions read whenever a snapshot is taken, e.g. the queue depth and the memory used by the Frontier
+The stats are written as a JSON snapshot every snapshot_interval seconds (to a temporary file that then replaces the
+old snapshot, so a reader never sees half of one), and can also be served over HTTP on localhost.
+A progress line is printed (and logged) at most every progress_interval seconds, instead of one line per url.
+Everything is updated from the crawl loop's thread only; the HTTP server just hands out the last snapshot taken.
+'''
+
+class StageTimer:
+    '''
+    Durations of one stage of the crawl, with a histogram of power-of-two buckets of microseconds
+    (bucket b holds the durations from 2 ** (b - 1) up to 2 ** b microseconds; bucket 0 holds those under 1).
+    Also a context manager that times its block; not reentrant, so a stage can't be nested in itself.
+    '''
+
+    BUCKETS = 32 #The last bucket holds everything from 2 ** 30 microseconds (about 18 minutes) up
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+        self.start = None
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if(self.min is None or seconds < self.min):
+            self.min = seconds
+        if(seconds > self.max):
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.record(time.perf_counter() - self.start)
+
+    '''
+    Return an upper bound for the given percentile (0 to 100) of the durations: the top of the bucket it falls in
+    '''
+    def percentile(self, percent):
+        target = self.count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if(count and seen >= target):
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def get_stats(self):
+        milliseconds = lambda seconds: round(seconds * 1000, 4)
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "mean_ms": milliseconds(self.total / self.count) if self.count else None,
+            "min_ms": milliseconds(self.min) if self.min is not None else None,
+            "max_ms": milliseconds(self.max),
+            "p50_ms": milliseconds(self.percentile(50)),
+            "p90_ms": milliseconds(self.percentile(90)),
+            "p99_ms": milliseconds(self.percentile(99)),
+            "histogram_us": {"<{}".format(2 ** bucket): count for bucket, count in enumerate(self.buckets) if count}
+        }
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the last snapshot of the server's CrawlStats as JSON, whatever the path
+    '''
+
+    def do_GET(self):
+        body = self.server.crawl_stats.latest_snapshot or b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Stats request: " + format, *args)
+
+
+class CrawlStats:
+
+    STATS_FILE_NAME = os.path.join(".", "analytics", "crawl_stats.json")
+    SNAPSHOT_INTERVAL = 10.0 #Seconds between snapshots
+    PROGRESS_INTERVAL = 5.0 #Seconds between progress lines
+
+    def __init__(self, stats_file=STATS_FILE_NAME, snapshot_interval=SNAPSHOT_INTERVAL,
+                 progress_interval=PROGRESS_INTERVAL, port=None):
+        #If stats_file is None, snapshots are only taken for the HTTP server (if any)
+        self.stats_file = stats_file
+        self.snapshot_interval = snapshot_interval
+        self.progress_interval = progress_interval
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        #The gauges shown on every progress line, in order
+        self.progress_gauges = []
+        self.pages = 0
+        self.start_time = time.time()
+        self.start_clock = time.perf_counter()
+        self.last_progress = (self.start_clock, 0)
+        self.last_snapshot = (self.start_clock, 0)
+        #JSON of the last snapshot, as served over HTTP
+        self.latest_snapshot = None
+        self.server = None
+        if(port is not None):
+            self.serve(port)
+
+    '''
+    Return the timer of a stage, for use as a context manager: with stats.timer("fetch"): ...
+    '''
+    def timer(self, stage):
+        timer = self.stages.get(stage)
+        if(timer is None):
+            timer = self.stages[stage] = StageTimer()
+        return timer
+
+    '''
+    Record the duration of a stage that was timed elsewhere (e.g. in a worker process)
+    '''
+    def record(self, stage, seconds):
+        self.timer(stage).record(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    '''
+    Register a gauge: read is called (with no arguments) whenever a snapshot is taken, and returns a number or a
+    dictionary of them. Gauges with progress=True are also shown on every progress line.
+    '''
+    def add_gauge(self, name, read, progress=False):
+        self.gauges[name] = read
+        if(progress):
+            self.progress_gauges.append(name)
+
+    '''
+    Called once per crawled page: prints a progress line and takes a snapshot when they are due
+    '''
+    def page_done(self):
+        self.pages += 1
+        now = time.perf_counter()
+        if(now - self.last_progress[0] >= self.progress_interval):
+            self.print_progress(now)
+        if(now - self.last_snapshot[0] >= self.snapshot_interval):
+            self.write_snapshot(now)
+
+    '''
+    Pages per second since the given (clock, pages) mark
+    '''
+    def get_rate(self, now, mark):
+        elapsed = now - mark[0]
+        return (self.pages - mark[1]) / elapsed if elapsed > 0 else 0.0
+
+    def print_progress(self, now=None):
+        if(now is None):
+            now = time.perf_counter()
+        line = "Pages: {}, {:.1f} pages/s ({:.1f} overall)".format(
+            self.pages, self.get_rate(now, self.last_progress), self.get_rate(now, (self.start_clock, 0)))
+        for name in self.progress_gauges:
+            line += ", {}: {}".format(name.replace("_", " ").capitalize(), self.gauges[name]())
+        logger.info(line)
+        print(line)
+        self.last_progress = (now, self.pages)
+
+    def snapshot(self, now=None):
+        if(now is None):
+            now = time.perf_counter()
+        gauges = {name: read() for name, read in self.gauges.items()}
+        if(resource is not None):
+            #ru_maxrss is in kilobytes on Linux
+            gauges["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.start_time)),
+            "elapsed_seconds": round(now - self.start_clock, 3),
+            "pages": self.pages,
+            "pages_per_second": round(self.get_rate(now, (self.start_clock, 0)), 3),
+            "recent_pages_per_second": round(self.get_rate(now, self.last_snapshot), 3),
+            "counters": dict(self.counters),
+            "gauges": gauges,
+            "stages": {name: timer.get_stats() for name, timer in self.stages.items()}
+        }
+
+    '''
+    Take a snapshot and write it to the stats file (if any)
+    '''
+    def write_snapshot(self, now=None):
+        if(now is None):
+            now = time.perf_counter()
+        self.latest_snapshot = json.dumps(self.snapshot(now), indent=2).encode("utf-8")
+        self.last_snapshot = (now, self.pages)
+        if(self.stats_file is None):
+            return
+        directory = os.path.dirname(self.stats_file)
+        if(directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        temporary_file_name = self.stats_file + ".tmp"
+        with open(temporary_file_name, "wb") as stats_file:
+            stats_file.write(self.latest_snapshot)
+        os.replace(temporary_file_name, self.stats_file)
+
+    '''
+    Serve the snapshots on http://127.0.0.1:port/ from a background thread (port 0 picks a free port)
+    '''
+    def serve(self, port):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), StatsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.crawl_stats = self
+        threading.Thread(target=self.server.serve_forever, name="crawl-stats-server", daemon=True).start()
+        logger.info("Serving crawl stats on http://127.0.0.1:%s/", self.server.server_address[1])
+
+    '''
+    Print the last progress line and write the final snapshot; the HTTP server (if any) keeps serving it until shutdown
+    '''
+    def finish(self):
+        now = time.perf_counter()
+        self.print_progress(now)
+        self.write_snapshot(now)
+
+    def shutdown(self):
+        if(self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -1,20 +1,18 @@
 import logging
-import re
 from urllib.parse import urlparse, urljoin
 
 #Additional libraries
 import os
-from lxml import etree as etree
-from lxml import html
-from bs4 import BeautifulSoup
-from lxml.html import soupparser
+import multiprocessing
 import pickle
-from collections import defaultdict
+from collections import deque
 
 #Import a couple of custom classes
 from analytics_data import Analytics_Data
-from string_tokenizer import tokenize
-from fingerprinter import get_fingerprints
+from page_analyzer import analyze_page, init_worker, fetch_and_analyze, get_page_url, get_content_digest
+from corpus_prefetcher import Prefetcher
+from link_validator import LinkRecordCache, parse_link, get_subdomains
+from crawl_stats import CrawlStats
 
 # Configures logging and outputting to file
 logging.basicConfig(filename="./history.log", filemode='w', format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
@@ -29,19 +27,39 @@ class Crawler:
     """
 
     URL_SIZE_LIMIT = 300
-    DOMAIN_ACCESS_LIMIT = 200
     #Directory/file name for temporary analytics file
     #It's probably fastest to use a single file for the analytics data, right?
     #(This is not the file where the final analytics data will be written to once the crawl is finished)
     ANALYTICS_DIR_NAME = "analytics"
     ANALYTICS_FILE_NAME = os.path.join(".", ANALYTICS_DIR_NAME, "analytics_data.pkl")
     FETCH_LIMIT = 20 #Will only crawl this many URLs, but ignored if set to zero; can be used for testing
+    DISPATCH_WINDOW_PER_WORKER = 4 #How many urls each worker process may have in flight at once
+    CHECKPOINT_INTERVAL = 100 #Number of pages between journal checkpoints
+    LINK_RECORD_CACHE_SIZE = 100000 #Number of parsed links kept for is_valid (see link_validator.py)
 
-    def __init__(self, frontier, corpus):
+    def __init__(self, frontier, corpus, workers=1, prefetch_depth=0, word_counter_mode="exact", journal=None,
+                 extractor="streaming", stats=None, artifact_cache=None, router=None):
         self.frontier = frontier
         self.corpus = corpus
+        self.workers = workers
+        self.prefetch_depth = prefetch_depth
+        self.word_counter_mode = word_counter_mode
+        #How page_analyzer extracts the text and links of each page (see page_analyzer.EXTRACTORS)
+        self.extractor = extractor
         self.counter_links_crawled = 0
-        self.counter_domain = defaultdict(int)
+        #Write-ahead journal of the crawl state (see journal.py); if None, the state is only pickled at exit
+        self.journal = journal
+        self.pages_since_checkpoint = 0
+        #(url, result) of the urls handed out to the workers whose results haven't been applied yet
+        self.pending = deque()
+        self.link_records = LinkRecordCache(self.LINK_RECORD_CACHE_SIZE)
+        #Stage timers, counters and gauges of the crawl loop, with rate-limited progress lines (see crawl_stats.py)
+        self.stats = stats if stats is not None else CrawlStats()
+        #Optional cache of the results of analyze_page from earlier runs, so they don't have to be parsed again
+        #(see artifact_cache.py)
+        self.artifact_cache = artifact_cache
+        #In a sharded crawl, hands the outlinks on other shards' hosts to their shards (see sharded_crawl.py)
+        self.router = router
 
 
     '''
@@ -67,7 +85,9 @@ class Crawler:
             logger.info("Loaded previous analytics data into memory.")
         else:
             logger.info("No previous analytics data found. Recording new data ...")
-            self.analytics_data = Analytics_Data()
+            self.analytics_data = Analytics_Data(self.word_counter_mode)
+        #Traps are logged (and reported) through the analytics data as soon as they are found
+        self.frontier.trap_log = self.analytics_data.traps
 
     def start_crawling(self):
         """
@@ -75,51 +95,159 @@ class Crawler:
         the scraped links to the frontier
         """
 
-        #Load analytics data
-        self.load_analytics_data()
-
-        #while self.frontier.has_next_url() and ((self.FETCH_LIMIT <= 0) or (self.frontier.fetched < self.FETCH_LIMIT)):
-        while self.frontier.has_next_url():
-            url = self.frontier.get_next_url()
+        #Load analytics data (together with the frontier, when recovering from the journal)
+        if(self.journal is not None):
+            self.recover()
+        else:
+            self.load_analytics_data()
+        self.add_gauges()
+        if(self.router is not None):
+            self.router.start(self.frontier)
 
-            #added code to check validity before fetching
-            if not self.is_valid(url):
-                continue
+        if(self.workers > 1):
+            self.crawl_parallel()
+        else:
+            #Records are read through the prefetcher (if enabled) so that disk reads overlap with parsing
+            fetcher = self.corpus
+            if(self.prefetch_depth > 0):
+                fetcher = Prefetcher(self.corpus, self.frontier, depth=self.prefetch_depth)
+
+            #while self.frontier.has_next_url() and ((self.FETCH_LIMIT <= 0) or (self.frontier.fetched < self.FETCH_LIMIT)):
+            if(fetcher is not self.corpus):
+                self.stats.add_gauge("prefetcher", fetcher.get_stats)
+            stats = self.stats
+            while self.frontier.has_next_url() or self.wait_for_urls():
+                self.begin_page()
+                url = self.frontier.get_next_url()
+
+                #added code to check validity before fetching
+                with stats.timer("validate"):
+                    valid = self.is_valid(url)
+                if not valid:
+                    stats.count("invalid_urls")
+                    if(fetcher is not self.corpus):
+                        fetcher.discard(url)
+                    self.end_page(url)
+                    continue
+
+                logger.debug("Fetching URL %s", url)
+                with stats.timer("fetch"):
+                    url_data = fetcher.fetch_url(url)
+
+                self.add_outlinks(self.extract_next_links(url_data))
+                self.end_page(url)
+                self.checkpoint()
+                stats.page_done()
+                if(self.router is not None):
+                    self.router.page_done(self.frontier)
+
+            if(fetcher is not self.corpus):
+                fetcher.shutdown()
+                logger.info("Prefetch stats: %s", fetcher.get_stats())
+
+        if(self.artifact_cache is not None):
+            self.artifact_cache.flush()
+        self.stats.finish()
+        print("Crawling complete.\nWriting analytics file...")
+        self.analytics_data.log_analytics(self.frontier.fetched)
 
-            logger.info("Fetching URL %s ... Fetched: %s, Queue size: %s", url, self.frontier.fetched, len(self.frontier))
-            print("Fetching URL {} ... Fetched: {}, Queue size: {}".format(url, self.frontier.fetched, len(self.frontier)))
-            url_data = self.corpus.fetch_url(url)
+    '''
+    Crawl with a pool of worker processes.
+    The workers fetch and analyze pages (see page_analyzer.py) while this process owns the Frontier and the
+    Analytics_Data. Urls are handed out from the head of the queue and their results are applied strictly in
+    the same order, including the validity check that the serial loop does before fetching, so the analytics end up
+    the same as in a serial crawl. A worker's result is simply dropped if its url turns out to be invalid by then.
+    (This holds for the FIFO frontier; with a per-host scheduler, urls handed out early are picked before the results
+    still in flight have been queued, so the crawl order can differ from a serial one.)
+    '''
+    def crawl_parallel(self):
+        window = self.workers * self.DISPATCH_WINDOW_PER_WORKER
+        pending = self.pending
+        stats = self.stats
+        artifact_cache_file = self.artifact_cache.file_name if self.artifact_cache is not None else None
+        with multiprocessing.Pool(self.workers, initializer=init_worker,
+                                  initargs=(self.corpus.corpus_base_dir, self.extractor, artifact_cache_file)) as pool:
+            while True:
+                while(len(pending) < window and self.frontier.has_next_url()):
+                    url = self.frontier.get_next_url()
+                    pending.append((url, pool.apply_async(fetch_and_analyze, (url,))))
+                if(not pending):
+                    if(self.wait_for_urls()):
+                        continue
+                    break
+
+                url, worker_result = pending.popleft()
+                self.begin_page()
+                with stats.timer("validate"):
+                    valid = self.is_valid(url)
+                if not valid:
+                    stats.count("invalid_urls")
+                    self.end_page(url)
+                    continue
+
+                logger.debug("Fetching URL %s", url)
+                #Fetching and analyzing happen in the workers; this is the time spent waiting for them
+                with stats.timer("wait_for_worker"):
+                    page_result, failed_parsers, artifact_key, source, page_url, content_digest = worker_result.get()
+                if(source == "artifact_cache"):
+                    stats.count("artifact_cache_hits")
+                elif(source == "analyzed"):
+                    self.record_parse_stats(page_result, failed_parsers)
+                    self.store_artifacts(artifact_key, page_result)
+                #A worker only knows the copies of the pages it analyzed itself, so every page is checked here too
+                with stats.timer("exact_duplicate"):
+                    exact_duplicate = self.check_exact_duplicate(page_url, content_digest)
+                if(exact_duplicate):
+                    outlinks = []
+                elif(source == "exact_duplicate"):
+                    #The worker skipped a copy of a page that was never applied here (its url turned out to be invalid
+                    #by then), so this one is analyzed after all
+                    with stats.timer("fetch"):
+                        url_data = self.corpus.fetch_url(url)
+                    outlinks = self.analyze_and_apply(url_data, content_digest)
+                else:
+                    outlinks = self.apply_page_result(page_result, content_digest)
+                self.add_outlinks(outlinks)
+                self.end_page(url)
+                self.checkpoint()
+                stats.page_done()
+                if(self.router is not None):
+                    self.router.page_done(self.frontier)
 
-            for next_link in self.extract_next_links(url_data):
-                if self.is_valid(next_link):
-                    if self.corpus.get_file_name(next_link) is not None:
-                        self.frontier.add_url(next_link)
+    '''
+    The journal records of a page are written as one batch that ends with a "page_done" record, so that recovery
+    sees either all of a page or none of it, and can tell which handed out urls were never crawled (see recover)
+    '''
+    def begin_page(self):
+        if(self.journal is not None):
+            self.journal.begin_batch()
 
-        print("Crawling complete.\nWriting analytics file...")
-        self.analytics_data.log_analytics(self.frontier.fetched, self.frontier.get_traps())
+    def end_page(self, url):
+        if(self.journal is not None):
+            self.journal.record("page_done", url)
+            self.journal.end_batch()
 
-    """
-    Parse a document's bytes from url_data["content], then return
-    the parsed lxml object
+    '''
+    Called when the queue is empty. In a sharded crawl, waits for urls from the other shards (see sharded_crawl.py) and
+    returns whether there are urls to crawl again; an ordinary crawl is simply over.
+    '''
+    def wait_for_urls(self):
+        return self.router is not None and self.router.wait_for_urls(self.frontier)
 
-    If it cannot be parsed, return None
-    """
-    def parse_document(self, content):
-        try:
-            doc = html.fromstring(content)
-            return doc
-        except:
-            pass
-        try:
-            doc = etree.fromstring(content)
-            return doc
-        except:
-            pass
-        try:
-            doc = soupparser.fromstring(content)
-            return doc
-        except:
-            return None
+    '''
+    Add the outlinks of a page to the frontier, as long as they are valid and exist in the corpus
+    (in a sharded crawl, the ones on other shards' hosts are sent to those shards instead, once each)
+    '''
+    def add_outlinks(self, outlinks):
+        router = self.router
+        with self.stats.timer("add_outlinks"):
+            for next_link, valid in zip(outlinks, self.is_valid_batch(outlinks)):
+                if valid:
+                    if self.corpus.get_file_name(next_link) is not None:
+                        if router is None or router.is_local(next_link):
+                            self.frontier.add_url(next_link)
+                        elif self.frontier.mark_seen(next_link):
+                            router.send(next_link)
 
     def extract_next_links(self, url_data):
         """
@@ -132,129 +260,260 @@ class Crawler:
 
         Suggested library: lxml
         """
-        outputLinks = []
-
-        if(url_data["content_type"] == None):
+        stats = self.stats
+        #A byte-identical copy of a page indexed before is rejected before it is parsed, or even decoded
+        with stats.timer("exact_duplicate"):
+            content_digest = get_content_digest(url_data)
+            exact_duplicate = self.check_exact_duplicate(get_page_url(url_data), content_digest)
+        if(exact_duplicate):
             return []
+        return self.analyze_and_apply(url_data, content_digest)
 
-        #Determine the whether the page is an HTML or XML document.
-        #Due to a presumed error in converting from bytes to str, content_type is usually prefixed by "b'" so we need to remove this.
-        content_type = url_data["content_type"].removeprefix("b\'") #https://docs.python.org/3.9/library/stdtypes.html?highlight=removeprefix#str.removeprefix
-        file_type = content_type.split(';')[0] #usually content_type has both a filetype and an encoding, but sometimes the encoding is absent...
-
-        #For some URLs from the fano subdomain, url_data["content"] is a str object rather than a bytes object.
-        #In this case, we must convert the object to bytes.
-        #(Note: the professor said on Piazza that we can assume all documents are encoded in UTF-8)
-        if(not isinstance(url_data["content"], bytes)):
-            url_data["content"] = bytes(url_data["content"], 'UTF-8')
-
-        #Try to parse the document content using lxml.
-        #If that does not work, try BeautifulSoup instead.
-        doc = None
-
-        doc = self.parse_document(url_data["content"])
-        if(doc == None):
-            try:
-                #Check if the bytes contain excessive null terminators.
-                #If so, eliminate them.
-                if(url_data["content"].count(b'\x00') > 0):
-                    logger.info("Excess null terminators found. Eliminating now.")
-                    content_cleaned = url_data["content"].replace(b'\x00', b'')
-                    doc = self.parse_document(content_cleaned)
-            except:
-                logger.info("Failed to parse the document.")
-                return []
-        if(doc == None):
-            logger.info("Failed to parse the document.")
-            return []
+    '''
+    The rest of extract_next_links, once the page is known not to be an exact duplicate: take the page's result from
+    the artifact cache or analyze it, apply it, and return its outlinks
+    '''
+    def analyze_and_apply(self, url_data, content_digest):
+        stats = self.stats
+        artifact_key = None
+        if(self.artifact_cache is not None):
+            #A page analyzed in an earlier run isn't even decoded (see corpus_record.UrlData)
+            with stats.timer("artifact_lookup"):
+                artifact_key = self.artifact_cache.get_key(url_data, self.extractor)
+                found, page_result = self.artifact_cache.get(artifact_key) if artifact_key is not None else (False, None)
+            if(found):
+                stats.count("artifact_cache_hits")
+                return self.apply_page_result(page_result, content_digest)
+
+        failed_parsers = []
+        with stats.timer("analyze"):
+            page_result = analyze_page(url_data, self.extractor, failed_parsers)
+        self.record_parse_stats(page_result, failed_parsers)
+        self.store_artifacts(artifact_key, page_result)
+        return self.apply_page_result(page_result, content_digest)
 
-        # try:
-        #     #Try the HTML and XML parsers
-        #     if(file_type == 'text/html'):
-        #         doc = html.fromstring(url_data["content"])
-        #     elif(file_type == 'text/xml'):
-        #         doc = etree.fromstring(url_data["content"])
-        #     else:
-        #         doc = soupparser.fromstring(url_data["content"])
-        # except:
-        #     try:
-        #         #If the other parsers failed, then try the Beautiful Soup parser.
-        #         doc = soupparser.fromstring(url_data["content"]) 
-        #     except:
-        #         try:
-        #             #Check if the bytes contain excessive null terminators.
-        #             #If so, eliminate them.
-        #             if(url_data["content"].count(b'\x00') > 0):
-        #                 logger.info("Excess null terminators found. Eliminating now.")
-        #                 content_cleaned = url_data["content"].replace(b'\x00', b'')
-        #                 doc = html.fromstring(content_cleaned)
-        #         except:
-        #             logger.info("Failed to parse the document.")
-        #             return []
-            
-        # if(doc == None):
-        #     logger.info("Failed to parse the document.")
-        #     return outputLinks
-
-        #Use the final URL, if applicable
-        url = (url_data["final_url"] if (url_data["final_url"] != None) else url_data["url"])
+    '''
+    Check a fetched page against the frontier's exact-duplicate table (see Frontier.is_exact_duplicate).
+    A copy is counted as downloaded and as a near-duplicate, just as apply_page_result would once it had been analyzed.
+    '''
+    def check_exact_duplicate(self, url, content_digest):
+        if(content_digest is None):
+            return False
+        stats = self.stats
+        stats.count("exact_duplicate_checks")
+        if(not self.frontier.is_exact_duplicate(url, content_digest)):
+            return False
+        stats.count("exact_duplicates")
+        self.record_download(url)
+        return True
 
-        #Update analytics data
-        self.analytics_data.new_url_downloaded(url)
-        subdomains = self.extract_subdomains(url)
-        for subdomain in subdomains:
-            self.analytics_data.update_subdomain_url_count(subdomain)
+    '''
+    Store the result of analyze_page in the artifact cache (if the crawler has one and the page could be cached)
+    '''
+    def store_artifacts(self, artifact_key, page_result):
+        if(artifact_key is None or self.artifact_cache is None):
+            return
+        self.stats.count("artifact_cache_misses")
+        with self.stats.timer("artifact_store"):
+            self.artifact_cache.put(artifact_key, page_result)
 
-        doc.make_links_absolute(url)
+    '''
+    Count the parser that extracted a page and the ones that failed on it, and record how long the page took to parse,
+    tokenize and fingerprint (measured by analyze_page, possibly in a worker process)
+    '''
+    def record_parse_stats(self, page_result, failed_parsers):
+        stats = self.stats
+        for parser in failed_parsers:
+            stats.count("parse_failures." + parser)
+        if(page_result is None):
+            stats.count("unusable_pages")
+            return
+        stats.count("pages_parsed." + page_result["parser"])
+        for stage, seconds in page_result["timings"].items():
+            stats.record(stage, seconds)
+
+    '''
+    Apply the result of page_analyzer.analyze_page to the frontier and the analytics data,
+    then return the page's valid outlinks (the page's content digest, if given, is recorded for the exact-duplicate check)
+    '''
+    def apply_page_result(self, page_result, content_digest=None):
+        if(page_result == None):
+            return []
 
-        text_no_markup = doc.text_content() #returns object of type lxml.etree._ElementUnicodeResult
-        #text_no_markup = str(html.tostring(doc)) #Uncomment this line to include HTML markup is in the analytics, for testing
+        url = page_result["url"]
+        stats = self.stats
+
+        #Update analytics data
+        with stats.timer("record_download"):
+            self.record_download(url)
 
         # Check if this page is a near-duplicate of a previously-examined page.
         # If so, DO NOT assume that it is a trap,
         # but don't return any of its outlinks or count it in the analytics
-        fingerprints = get_fingerprints(text_no_markup)
-        logger.info("\tchecking duplication for {}".format(url))
-        if(self.frontier.is_near_duplicate(url, fingerprints)):
+        with stats.timer("near_duplicate"):
+            near_duplicate = self.frontier.is_near_duplicate(url, page_result["fingerprints"], content_digest)
+        if(near_duplicate):
+            stats.count("near_duplicates")
             return []
 
-        #Determine the frequency of each word in the page, as well as the overall word count.
-        #Update analytics data accordingly.
-        page_token_dict = tokenize(text_no_markup)
-        word_count = 0
-        for token in page_token_dict.keys():
-            token_instances = page_token_dict[token]
-            word_count += token_instances
-            self.analytics_data.update_word_frequency(token, token_instances)
+        #Find any and all valid outlinks within the page.
+        links = page_result["links"]
+        self.counter_links_crawled += len(links)
+        with stats.timer("validate_links"):
+            outputLinks = [link_url for link_url, valid in zip(links, self.is_valid_batch(links)) if valid]
+        valid_links = len(outputLinks) #For the analytics
+        stats.count("links_found", len(links))
+        stats.count("links_valid", valid_links)
+
+        with stats.timer("record_page_stats"):
+            self.record_page_stats(url, page_result["tokens"], page_result["word_count"], valid_links)
+
+        return outputLinks
+
+    '''
+    Count a downloaded page in the analytics (near-duplicates included)
+    '''
+    def record_download(self, url):
+        self.analytics_data.new_url_downloaded(url)
+        subdomains = self.extract_subdomains(url)
+        for subdomain in subdomains:
+            self.analytics_data.update_subdomain_url_count(subdomain)
+        if(self.journal is not None):
+            self.journal.record("downloaded", url)
+
+    '''
+    Count the words and outlinks of a page that is not a near-duplicate in the analytics
+    '''
+    def record_page_stats(self, url, tokens, word_count, valid_links):
+        #Update the word frequencies with this page's tokens
+        self.analytics_data.update_word_frequencies(tokens)
         #Check if this page breaks the record for highest word count
         self.analytics_data.update_longest_page(url, word_count)
-        
-        #Find any and all valid outlinks within the page.
-        valid_links = 0 #For the analytics
-        for link in doc.iterlinks(): #Link is a tuple of form (element, attribute, link, pos)
-            link_url = link[2] 
-            if(link != None):
-                self.counter_links_crawled += 1
-                if(self.is_valid(link_url)):
-                    outputLinks.append(link_url)
-                    valid_links += 1
         #Check if this page breaks the record for most valid outlinks
         self.analytics_data.update_most_valid_outlinks(url, valid_links) #If this page doesn't break the record, then nothing will change
+        if(self.journal is not None):
+            self.journal.record("page_stats", url, tokens, word_count, valid_links)
 
-        return outputLinks
+    '''
+    Recover the frontier and the analytics data from the journal: load the last snapshot, then replay every
+    change journaled after it. Starts from the seed URL if there is nothing to recover.
+    Urls that were taken from the frontier but not crawled yet (the ones in flight to the workers of a parallel crawl)
+    are put back at the head of the queue.
+    '''
+    def recover(self):
+        journal = self.journal
+        state, records = journal.recover()
+        if(state is not None):
+            self.frontier.set_state(state["frontier"])
+            self.analytics_data = state["analytics_data"]
+        else:
+            self.analytics_data = Analytics_Data(self.word_counter_mode)
+            #Replay (or the fresh crawl) starts from an empty frontier
+            self.frontier.urls_queue.clear()
+            self.frontier.urls_set.clear()
+        self.frontier.trap_log = self.analytics_data.traps
+
+        #Detach the journal while replaying, so the replayed changes aren't journaled a second time
+        self.journal = None
+        in_flight = list(state.get("in_flight", [])) if state is not None else []
+        for operation, arguments in records:
+            if(operation == "next_url" and arguments):
+                in_flight.append(arguments[0])
+            elif(operation == "page_done"):
+                in_flight.remove(arguments[0])
+            if(not self.frontier.replay(operation, arguments)):
+                self.replay(operation, arguments)
+        self.journal = journal
+        self.frontier.journal = journal
+        if(in_flight):
+            logger.info("Putting %s urls that were not crawled yet back in the queue", len(in_flight))
+            self.frontier.requeue(in_flight)
+
+        if(state is None and not records):
+            logger.info("Nothing to recover. Starting from the seed URL ...")
+            #In a sharded crawl, only the shard that owns the seed URL starts from it
+            self.frontier.start_fresh(self.router is None or self.router.is_local(self.frontier.SEED_URL))
+        else:
+            logger.info("Recovered crawl state. Fetched: %s, Queue size: %s", self.frontier.fetched, len(self.frontier))
+
+    '''
+    Apply a journal record written by this class
+    '''
+    def replay(self, operation, arguments):
+        if(operation == "downloaded"):
+            self.record_download(*arguments)
+        elif(operation == "page_stats"):
+            self.record_page_stats(*arguments)
+        elif(operation == "page_done"):
+            pass
+        else:
+            logger.info("Skipping unknown journal record %s", operation)
+
+    '''
+    Called after every crawled page: makes the journal durable every CHECKPOINT_INTERVAL pages,
+    and compacts it into a snapshot once it has grown large enough
+    '''
+    def checkpoint(self):
+        if(self.journal is None):
+            return
+        self.pages_since_checkpoint += 1
+        if(self.pages_since_checkpoint < self.CHECKPOINT_INTERVAL):
+            return
+        self.pages_since_checkpoint = 0
+        #Urls for other shards are sent before the pages they came from are made durable
+        if(self.router is not None):
+            self.router.flush()
+        if(self.journal.needs_snapshot()):
+            with self.stats.timer("journal_snapshot"):
+                self.journal.snapshot({
+                    "frontier": self.frontier.get_state(),
+                    "analytics_data": self.analytics_data,
+                    "in_flight": [url for url, _ in self.pending]
+                })
+        else:
+            with self.stats.timer("journal_checkpoint"):
+                self.journal.checkpoint()
+        if(self.router is not None):
+            self.router.checkpoint()
+
+    '''
+    Return how many pages were checked against the exact-duplicate table, and the fraction of them that were copies
+    '''
+    def get_exact_duplicate_stats(self):
+        checks = self.stats.counters["exact_duplicate_checks"]
+        hits = self.stats.counters["exact_duplicates"]
+        return {
+            "digests": len(self.frontier.content_digests),
+            "checks": checks,
+            "hits": hits,
+            "hit_rate": round(hits / checks, 4) if checks else 0.0
+        }
+
+    '''
+    Register the crawl stats' gauges; the frontier and the analytics data are looked up on every read, since
+    recovering from the journal replaces them
+    '''
+    def add_gauges(self):
+        stats = self.stats
+        stats.add_gauge("fetched", lambda: self.frontier.fetched, progress=True)
+        stats.add_gauge("queue_depth", lambda: len(self.frontier), progress=True)
+        stats.add_gauge("traps", lambda: len(self.frontier.traps), progress=True)
+        stats.add_gauge("frontier", lambda: self.frontier.get_stats())
+        stats.add_gauge("analytics_data", lambda: self.analytics_data.get_stats())
+        stats.add_gauge("link_records", lambda: {
+            "entries": len(self.link_records),
+            "hits": self.link_records.hits,
+            "misses": self.link_records.misses
+        })
+        stats.add_gauge("exact_duplicates", self.get_exact_duplicate_stats)
+        if(self.artifact_cache is not None):
+            stats.add_gauge("artifact_cache", self.artifact_cache.get_stats)
 
     '''
     Helper function to return list of subdomains in a given URL
     '''
     def extract_subdomains(self, url):
-        parsed = urlparse(url)
-        netloc = parsed.netloc
-        domain = netloc.replace('www.','')
-        domain_split = domain.split('.')
-        subdomains = []
-        for i in range(len(domain_split) - 2): # exlude the 2 root domains: uci.edu and edu
-            subdomains.append('.'.join(domain_split[i:]))
-        return subdomains
+        return get_subdomains(urlparse(url).netloc)
 
     def is_valid(self, url):
         """
@@ -262,43 +521,50 @@ class Crawler:
         filter out crawler traps. Duplicated urls will be taken care of by frontier. You don't need to check for duplication
         in this method
         """
-        if(len(url) > self.URL_SIZE_LIMIT):
-            self.frontier.traps.add(url)
+        return self.check_link(self.get_link_record(url))
+
+    '''
+    Validate all the links of a page at once; returns a list with is_valid's verdict for each link, in order
+    (the links are checked one after another, so the traps and access counts end up as if is_valid was called on each)
+    '''
+    def is_valid_batch(self, urls):
+        get_link_record = self.get_link_record
+        check_link = self.check_link
+        return [check_link(get_link_record(url)) for url in urls]
+
+    '''
+    Return the LinkRecord of a url (see link_validator.py), parsing it only if it isn't cached yet
+    '''
+    def get_link_record(self, url):
+        record = self.link_records.get(url)
+        if(record is None):
+            record = parse_link(url, self.URL_SIZE_LIMIT)
+            self.link_records.put(url, record)
+        return record
+
+    '''
+    The part of is_valid that depends on the crawl state: the traps found so far
+    (traps of url templates are found as urls are added to the frontier, see Frontier.count_template)
+    '''
+    def check_link(self, record):
+        frontier = self.frontier
+        if(record.too_long):
+            frontier.add_trap(record.url)
             return False
 
         #Using the frontier to store trap data
-        trimmed = self.frontier.trim_url(url)
-        if(trimmed in self.frontier.traps):
+        #(the lookup is only redone if a trap was added since the last time)
+        if(record.trap_generation != frontier.trap_generation):
+            record.trapped = record.trimmed in frontier.traps or record.template in frontier.traps
+            record.trap_generation = frontier.trap_generation
+        if(record.trapped):
             return False
 
         #Check for repeating subdomains
         #If the exact same subdomain appears 3+ times in the URL, then consider the URL a trap
-        subdomains = self.extract_subdomains(url)
-        for subdomain in subdomains:
-            if(url.count(subdomain) >= 3):
-                self.frontier.traps.add(url)
-                return False
-        
-        parsed = urlparse(url)
-        domain = parsed.netloc + parsed.path
-
-        # to avoid calendar trap, track the access amounts
-        # the arbitrary and intuitive number I put here is DOMAIN_ACCESS_LIMIT
-        self.counter_domain[domain] += 1
-        if self.counter_domain[domain] >= self.DOMAIN_ACCESS_LIMIT:
-            self.frontier.traps.add(domain)
-        
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        try:
-            return ".ics.uci.edu" in parsed.hostname \
-                   and not re.match(".*\.(css|js|bmp|gif|jpe?g|ico" + "|png|tiff?|mid|mp2|mp3|mp4" \
-                                    + "|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf" \
-                                    + "|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|epub|dll|cnf|tgz|sha1" \
-                                    + "|thmx|mso|arff|rtf|jar|csv" \
-                                    + "|rm|smil|wmv|swf|wma|zip|rar|gz|pdf)$", parsed.path.lower())
-
-        except TypeError:
-            logger.info("TypeError for ", parsed)
-            #print("TypeError for ", parsed)
+        if(record.repeated_subdomain):
+            frontier.add_trap(record.url)
             return False
+
+        #Scheme, host and extension checks
+        return record.allowed
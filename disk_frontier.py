@@ -0,0 +1,280 @@
+import math
+import os
+import pickle
+import sqlite3
+from collections import deque
+from hashlib import blake2b
+
+from sys import argv #for the benchmark
+
+'''
+Disk-backed containers for the frontier, for crawls whose queue and seen-set don't fit in memory.
+    SegmentedQueue: a FIFO queue that keeps its head and tail segments in memory and spills everything in between to
+                    segment files on disk
+    UrlSeenSet:     a Bloom filter in front of an exact on-disk set (SQLite), so most lookups of new urls never touch
+                    the disk
+Both offer the subset of the deque/set interface that Frontier uses, so they can replace urls_queue and urls_set.
+
+Benchmark: python disk_frontier.py [url_count] [directory]
+'''
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter, sized for a target number of items and false-positive rate
+    '''
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = blake2b(item.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class UrlSeenSet:
+    '''
+    Exact set of urls stored in SQLite, with a Bloom filter answering most negative lookups from memory.
+    New urls are buffered and written in batches. add doesn't look a url up first (callers check with `in` anyway, as
+    Frontier.add_url does), so adding a url that is already there costs no lookup; the batch insert ignores it and the
+    count is corrected when the batch is written.
+    Every row records the generation it was written in; a generation ends each time the set is pickled. Restoring a
+    pickled set deletes the rows written after it was pickled, which its Bloom filter doesn't know about, so a false
+    positive of the filter can't find them and take a url added since for one seen before.
+    '''
+
+    BATCH_SIZE = 10000
+
+    def __init__(self, file_name, capacity, error_rate):
+        self.file_name = file_name
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.pending = set()
+        self.count = 0 #Urls written to the database
+        self.generation = 0 #Generation of the rows written from now on
+        self.connect()
+
+    def connect(self):
+        directory = os.path.dirname(self.file_name)
+        if(directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(self.file_name)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, generation INTEGER NOT NULL "
+                                "DEFAULT 0) WITHOUT ROWID")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(urls)")]
+        if("generation" not in columns):
+            #Written before rows recorded their generation
+            self.connection.execute("ALTER TABLE urls ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+
+    def add(self, url):
+        self.bloom.add(url)
+        self.pending.add(url)
+        if(len(self.pending) >= self.BATCH_SIZE):
+            self.flush()
+
+    def __contains__(self, url):
+        if(url not in self.bloom):
+            return False
+        if(url in self.pending):
+            return True
+        return self.connection.execute("SELECT 1 FROM urls WHERE url = ?", (self.get_key(url),)).fetchone() is not None
+
+    '''
+    The value a url is stored as: sqlite3 can't bind a string with lone surrogates (which links pulled out of broken
+    pages can contain), so those urls are stored as their bytes instead
+    '''
+    @staticmethod
+    def get_key(url):
+        try:
+            url.encode("utf-8")
+            return url
+        except UnicodeEncodeError:
+            return url.encode("utf-8", "surrogatepass")
+
+    '''
+    Forget every url, including any left in the database by an earlier crawl
+    '''
+    def clear(self):
+        self.bloom = BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+        self.pending.clear()
+        self.count = 0
+        self.connection.execute("DELETE FROM urls")
+        self.connection.commit()
+
+    def flush(self):
+        if(self.pending):
+            cursor = self.connection.executemany("INSERT OR IGNORE INTO urls VALUES (?, ?)",
+                                                 ((self.get_key(url), self.generation) for url in self.pending))
+            self.count += cursor.rowcount
+            self.pending.clear()
+        self.connection.commit()
+
+    def __len__(self):
+        return self.count + len(self.pending)
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        del state["connection"]
+        del state["pending"]
+        #The rows written from now on are newer than this state
+        self.generation += 1
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("generation", 0)
+        self.pending = set()
+        self.connect()
+        self.connection.execute("DELETE FROM urls WHERE generation > ?", (self.generation,))
+        self.connection.commit()
+        self.generation += 1
+
+
+class SegmentedQueue:
+    '''
+    FIFO queue of urls split into segments of segment_size.
+    Urls are appended to an in-memory tail segment; a full tail is written to a segment file. Urls are popped from an
+    in-memory head segment, which is refilled from the oldest segment file (or taken over from the tail).
+    Segment files that were consumed are only deleted once the queue has been pickled twice more, so the previous
+    snapshot of the queue (see journal.py) can still be restored.
+    '''
+
+    SEGMENT_SIZE = 100000
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        if(not os.path.exists(directory)):
+            os.makedirs(directory)
+        self.head = deque()
+        self.tail = []
+        self.segments = deque() #Numbers of the segment files waiting on disk, oldest first
+        self.next_segment = 0
+        self.length = 0
+        self.consumed = [] #Segment files read since the last pickle
+        self.retired = [] #Segment files read before the last pickle
+
+    def get_segment_file_name(self, number):
+        return os.path.join(self.directory, "segment.{}.pkl".format(number))
+
+    def write_segment(self, urls):
+        with open(self.get_segment_file_name(self.next_segment), "wb") as segment_file:
+            pickle.dump(urls, segment_file, pickle.HIGHEST_PROTOCOL)
+        self.segments.append(self.next_segment)
+        self.next_segment += 1
+
+    def read_segment(self, number):
+        with open(self.get_segment_file_name(number), "rb") as segment_file:
+            return pickle.load(segment_file)
+
+    def append(self, url):
+        self.tail.append(url)
+        self.length += 1
+        if(len(self.tail) >= self.segment_size):
+            self.write_segment(self.tail)
+            self.tail = []
+
+    def popleft(self):
+        if(not self.head):
+            if(self.segments):
+                number = self.segments.popleft()
+                self.head = deque(self.read_segment(number))
+                self.consumed.append(number)
+            else:
+                self.head = deque(self.tail)
+                self.tail = []
+        url = self.head.popleft()
+        self.length -= 1
+        return url
+
+    def appendleft(self, url):
+        self.head.appendleft(url)
+        self.length += 1
+
+    '''
+    Remove every url, including the segment files left behind by an earlier crawl
+    '''
+    def clear(self):
+        for file_name in os.listdir(self.directory):
+            if(file_name.startswith("segment.")):
+                os.remove(os.path.join(self.directory, file_name))
+        self.head.clear()
+        self.tail = []
+        self.segments.clear()
+        self.next_segment = 0
+        self.length = 0
+        self.consumed = []
+        self.retired = []
+
+    def __iter__(self):
+        yield from self.head
+        for number in list(self.segments):
+            yield from self.read_segment(number)
+        yield from self.tail
+
+    def __len__(self):
+        return self.length
+
+    def __getstate__(self):
+        for number in self.retired:
+            try:
+                os.remove(self.get_segment_file_name(number))
+            except FileNotFoundError:
+                pass
+        self.retired = self.consumed
+        self.consumed = []
+        return self.__dict__.copy()
+
+
+'''
+Benchmark: add url_count urls to a disk-backed queue and seen-set (checking each for duplicates first, as
+Frontier.add_url does), then drain the queue, printing the peak resident memory along the way.
+'''
+if __name__ == "__main__":
+    import resource
+    import tempfile
+    import time
+
+    url_count = int(argv[1]) if len(argv) > 1 else 10000000
+    directory = argv[2] if len(argv) > 2 else tempfile.mkdtemp(prefix="frontier_benchmark_")
+    report_every = max(1, url_count // 10)
+
+    def peak_memory_mb():
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    queue = SegmentedQueue(os.path.join(directory, "queue"))
+    seen = UrlSeenSet(os.path.join(directory, "seen.sqlite"), capacity=url_count, error_rate=0.01)
+    print("Bloom filter: {:.1f} MB, {} hashes".format(len(seen.bloom.bits) / 2 ** 20, seen.bloom.hash_count))
+
+    start = time.time()
+    for i in range(url_count):
+        url = "http://www.ics.uci.edu/~user{}/page{}.html".format(i % 5000, i)
+        if(url not in seen):
+            seen.add(url)
+            queue.append(url)
+        if((i + 1) % report_every == 0):
+            print("added {:>10}  queue {:>10}  peak RSS {:8.1f} MB  {:6.0f} urls/s".format(
+                i + 1, len(queue), peak_memory_mb(), (i + 1) / (time.time() - start)))
+    seen.flush()
+
+    start = time.time()
+    popped = 0
+    while(len(queue) > 0):
+        queue.popleft()
+        popped += 1
+        if(popped % report_every == 0):
+            print("popped {:>10}  queue {:>10}  peak RSS {:8.1f} MB  {:6.0f} urls/s".format(
+                popped, len(queue), peak_memory_mb(), popped / (time.time() - start)))
+    print("Files are in {}".format(directory))
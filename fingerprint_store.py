@@ -0,0 +1,195 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+import fingerprinter
+
+'''
+Binary file holding the signatures, band tables and fingerprints of an LSHIndex (see lsh_index.py), so that a restarted crawl
+memory-maps its near-duplicate history instead of unpickling it: opening a store reads nothing but its header, and
+a lookup only touches the pages of the file it needs.
+
+Layout (native byte order; every section starts on an 8-byte boundary):
+    header:     MAGIC, then the number of documents, the signature size and the number of bands (uint64 each)
+    signatures: the signature of every document, back to back (uint64)
+    keys:       for each band, the band key of every document, sorted (uint64)
+    ids:        for each band, the id of the document each of its keys belongs to, in the same order (uint32)
+    offsets:    where the fingerprints of every document start in the prints section, plus where the last one ends
+                (uint64, one more than the number of documents)
+    prints:     the sorted fingerprints of every document, back to back (uint64)
+The keys and ids of a band form its offset table: the documents sharing a band key are the ids between the first and
+the last position of that key, found by binary search.
+
+Documents are only ever appended, and a rewritten store keeps the ids of the documents it already held, so a store can
+be opened as of an earlier count (e.g. by an older journal snapshot), ignoring whatever was added after it.
+'''
+
+class FingerprintStore:
+
+    MAGIC = b"LSHSTOR3" #Version 1 stores had band keys from the built-in hash(), version 2 had no fingerprints
+    HEADER_BYTES = len(MAGIC) + 3 * 8
+
+    '''
+    Map the store in file_name, as of its first count documents (all of them if count is None)
+    '''
+    def __init__(self, file_name, count=None):
+        self.file_name = file_name
+        with open(file_name, "rb") as store_file:
+            self.map = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if(view[:len(self.MAGIC)] != self.MAGIC):
+            raise ValueError("{} is not a fingerprint store".format(file_name))
+        stored, signature_size, self.bands = view[len(self.MAGIC):self.HEADER_BYTES].cast('Q')
+        if(signature_size != fingerprinter.SIGNATURE_SIZE):
+            raise ValueError("{} holds signatures of size {}, not {}".format(file_name, signature_size,
+                                                                            fingerprinter.SIGNATURE_SIZE))
+        if(count is None):
+            count = stored
+        elif(count > stored):
+            raise ValueError("{} holds {} signatures, fewer than the {} expected".format(file_name, stored, count))
+        self.count = count
+        self.stored = stored
+
+        offset = self.HEADER_BYTES
+        size = stored * signature_size * 8
+        self.signatures = view[offset:offset + size].cast('Q')
+        offset += size
+        self.keys = []
+        for _ in range(self.bands):
+            self.keys.append(view[offset:offset + stored * 8].cast('Q'))
+            offset += stored * 8
+        self.ids = []
+        for _ in range(self.bands):
+            self.ids.append(view[offset:offset + stored * 4].cast('I'))
+            offset += stored * 4
+        self.offsets = view[offset:offset + (stored + 1) * 8].cast('Q')
+        offset += (stored + 1) * 8
+        self.prints = view[offset:offset + self.offsets[stored] * 8].cast('Q')
+
+    def __len__(self):
+        return self.count
+
+    def nbytes(self):
+        return len(self.map)
+
+    def get_signature(self, doc_id):
+        start = doc_id * fingerprinter.SIGNATURE_SIZE
+        return self.signatures[start:start + fingerprinter.SIGNATURE_SIZE]
+
+    def get_prints(self, doc_id):
+        return self.prints[self.offsets[doc_id]:self.offsets[doc_id + 1]]
+
+    '''
+    Return the ids (in ascending order) of the documents whose band has the given key
+    '''
+    def lookup(self, band, key):
+        keys = self.keys[band]
+        start = bisect_left(keys, key)
+        if(start == len(keys) or keys[start] != key):
+            return ()
+        #Most keys are only shared by a few documents, so the end of the run is found by scanning
+        end = start + 1
+        while(end < len(keys) and keys[end] == key):
+            end += 1
+        ids = self.ids[band][start:end]
+        if(self.count < self.stored):
+            return [doc_id for doc_id in ids if doc_id < self.count]
+        return ids
+
+    '''
+    Return the sorted keys and ids of a band, leaving out the documents past count
+    '''
+    def get_band(self, band):
+        if(self.count == self.stored):
+            return self.keys[band], self.ids[band]
+        keys = array('Q')
+        ids = array('I')
+        for key, doc_id in zip(self.keys[band], self.ids[band]):
+            if(doc_id < self.count):
+                keys.append(key)
+                ids.append(doc_id)
+        return keys, ids
+
+    '''
+    Write a new store to file_name: the documents of base (an open FingerprintStore, or None) followed by the ones in
+    signatures, whose band keys are in tables (a dict per band, mapping a key to an id or a list of ids, as in LSHIndex)
+    and whose fingerprints are in prints, each one ending at the matching position in print_ends.
+    The bands are written by merging the new keys, sorted, into the base's sorted keys.
+    The store is written to a temporary file that then replaces the old one, so it is never seen half-written, and
+    base (even if it was mapped from file_name) stays readable.
+    '''
+    @staticmethod
+    def write(file_name, base, signatures, tables, print_ends, prints):
+        base_count = len(base) if base is not None else 0
+        count = base_count + len(signatures) // fingerprinter.SIGNATURE_SIZE
+        directory = os.path.dirname(file_name)
+        if(directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+
+        bands = []
+        for band, table in enumerate(tables):
+            new_entries = sorted((key, doc_id) for key, bucket in table.items()
+                                 for doc_id in ((bucket,) if isinstance(bucket, int) else bucket))
+            if(base is not None):
+                base_keys, base_ids = base.get_band(band)
+            else:
+                base_keys, base_ids = array('Q'), array('I')
+            bands.append(FingerprintStore.merge_band(base_keys, base_ids, new_entries))
+
+        if(base is not None):
+            base_prints = base.offsets[base_count]
+            offsets = array('Q', base.offsets[:base_count + 1])
+        else:
+            base_prints = 0
+            offsets = array('Q', [0])
+        offsets.extend(base_prints + end for end in print_ends)
+
+        temporary_file_name = file_name + ".tmp"
+        with open(temporary_file_name, "wb") as store_file:
+            store_file.write(FingerprintStore.MAGIC)
+            store_file.write(array('Q', [count, fingerprinter.SIGNATURE_SIZE, len(tables)]))
+            if(base is not None):
+                store_file.write(base.signatures[:base_count * fingerprinter.SIGNATURE_SIZE])
+            store_file.write(signatures)
+            for keys, _ in bands:
+                store_file.write(keys)
+            for _, ids in bands:
+                store_file.write(ids)
+            store_file.write(offsets)
+            if(base is not None):
+                store_file.write(base.prints[:base_prints])
+            store_file.write(prints)
+            store_file.flush()
+            os.fsync(store_file.fileno())
+        os.replace(temporary_file_name, file_name)
+
+    '''
+    Merge sorted (key, id) entries into a band's sorted keys and ids; every new id is greater than the base's ids, so
+    a new entry goes after the base entries with the same key. The base runs between two new entries are copied
+    as a whole, so merging a few new documents into a large store doesn't loop over the store.
+    '''
+    @staticmethod
+    def merge_band(base_keys, base_ids, new_entries):
+        keys = array('Q')
+        ids = array('I')
+        start = 0
+        base_count = len(base_keys)
+        for index, (key, doc_id) in enumerate(new_entries):
+            end = bisect_right(base_keys, key, start)
+            if(end == base_count):
+                #Past the end of the base: the remaining entries are simply appended
+                keys.frombytes(memoryview(base_keys[start:]).cast('B'))
+                ids.frombytes(memoryview(base_ids[start:]).cast('B'))
+                keys.extend([key for key, _ in new_entries[index:]])
+                ids.extend([doc_id for _, doc_id in new_entries[index:]])
+                return keys, ids
+            if(end > start):
+                keys.frombytes(memoryview(base_keys[start:end]).cast('B'))
+                ids.frombytes(memoryview(base_ids[start:end]).cast('B'))
+            keys.append(key)
+            ids.append(doc_id)
+            start = end
+        keys.frombytes(memoryview(base_keys[start:]).cast('B'))
+        ids.frombytes(memoryview(base_ids[start:]).cast('B'))
+        return keys, ids
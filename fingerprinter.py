@@ -1,57 +1,135 @@
-from collections import defaultdict, deque
+from array import array
+from collections import deque
+from hashlib import blake2b
+
+from string_tokenizer import find_tokens
 
 from sys import argv #for testing
 
 N = 3 #n value for the n-grams
-X = 1 #x value for 0 mod x; set to 1 to include all prints
+W = 8 #winnowing window: one fingerprint is kept out of every W consecutive n-grams (about 2 / (W + 1) of them overall)
+SEED = 0 #seed for the token hash; fingerprints only compare equal when computed with the same seed
+ROLLING_BASE = 0x100000001b3 #multiplier for the rolling n-gram hash
+SIGNATURE_SIZE = 128 #Number of slots in a MinHash signature; must be a power of two
+SIGNATURE_BITS = SIGNATURE_SIZE.bit_length() - 1
+MASK64 = (1 << 64) - 1
 
 '''
-Find n-grams
-Repurposed from the tokenizer from Assignment 1
+Hash a token to a 64-bit integer.
+Unlike the built-in hash(), this gives the same value in every process and every run, so fingerprints can be saved
+and compared across restarts.
 '''
-def find_grams(text: str) -> defaultdict:
-    ngrams = []
-    window = deque(maxlen=N)
-    token = ''  #Current token being read
+def hash_token(token: str, seed=SEED) -> int:
+    key = seed.to_bytes(8, "little")
+    return int.from_bytes(blake2b(token.encode("ascii"), digest_size=8, key=key).digest(), "little")
+
+class FingerprintStream:
+    '''
+    Fingerprints a document whose tokens arrive a batch at a time (see add_tokens), carrying the last n-gram and the
+    winnowing window over from one batch to the next, so the result is the same as fingerprinting all the tokens at once.
+    Only the current n-gram and window are kept, not the tokens themselves.
+    '''
+
+    #Weight of the token that is about to leave the n-gram
+    LEAVING_WEIGHT = pow(ROLLING_BASE, N - 1, 1 << 64)
+
+    def __init__(self, seed=SEED, w=W):
+        self.seed = seed
+        self.w = w
+        self.token_hashes = {} #Each distinct token is hashed only once per document
+        self.gram_tokens = deque(maxlen=N) #Hashes of the tokens in the current n-gram
+        self.gram_hash = 0
+        self.window = deque() #(position, hash) pairs with increasing hashes; the front is the current minimum
+        self.position = 0 #Position of the next n-gram hash
+        self.last_selected = -1
+        self.fingerprints = set()
+
+    '''
+    Generate the hash of every n-gram in a stream of tokens.
+    The n-gram hashes are combined with a rolling polynomial hash instead of joining the tokens into strings.
+    '''
+    def gram_hashes(self, tokens):
+        token_hashes = self.token_hashes
+        gram_tokens = self.gram_tokens
+        gram_hash = self.gram_hash
+        leaving_weight = self.LEAVING_WEIGHT
+        try:
+            for token in tokens:
+                h = token_hashes.get(token)
+                if(h is None):
+                    h = token_hashes[token] = hash_token(token, self.seed)
+                if(len(gram_tokens) == N):
+                    gram_hash = (gram_hash - gram_tokens[0] * leaving_weight) & MASK64
+                gram_tokens.append(h)
+                gram_hash = (gram_hash * ROLLING_BASE + h) & MASK64
+                if(len(gram_tokens) == N):
+                    yield gram_hash
+        finally:
+            self.gram_hash = gram_hash
 
-    for char in text:
-        if(not char.isascii()):
-            #Ignore non-ASCII characters
-            continue
-        if(char.isalnum()):
-            token += char.lower()
-        #a non-alphanumeric character denotes the end of a token
-        elif (token != ''):
-            window.append(token)
-            token = ''
-            if(len(window) >= N):
-                ngrams.append(" ".join(window))
+    '''
+    Select fingerprints from a stream of n-gram hashes by winnowing:
+    keep the minimum hash of every window of W consecutive hashes (the rightmost one on ties), recording each selected
+    position once. Any run of W n-grams shared by two documents is guaranteed to share a fingerprint.
+    '''
+    def winnow(self, gram_hashes):
+        window = self.window
+        w = self.w
+        position = self.position
+        last_selected = self.last_selected
+        fingerprints = self.fingerprints
+        for h in gram_hashes:
+            while(window and window[-1][1] >= h):
+                window.pop()
+            window.append((position, h))
+            if(window[0][0] <= position - w):
+                window.popleft()
+            if(position >= w - 1 and window[0][0] != last_selected):
+                last_selected = window[0][0]
+                fingerprints.add(window[0][1])
+            position += 1
+        self.position = position
+        self.last_selected = last_selected
 
-    #Be sure to process any tokens at the very end of the string
-    if (token != ''):
-        window.append(token)
-        if(len(window) >= N):
-            ngrams.append(" ".join(window))
+    def add_tokens(self, tokens):
+        self.winnow(self.gram_hashes(tokens))
+
+    '''
+    Return the fingerprints of every token added so far
+    '''
+    def get_fingerprints(self) -> set:
+        #A document shorter than one window still gets its minimum
+        if(self.last_selected < 0 and self.window):
+            return self.fingerprints | {self.window[0][1]}
+        return self.fingerprints
+
+'''
+Generate the hash of every n-gram in a stream of tokens (see FingerprintStream.gram_hashes)
+'''
+def get_gram_hashes(tokens, seed=SEED):
+    return FingerprintStream(seed).gram_hashes(tokens)
 
-    return ngrams
+'''
+Select fingerprints from a stream of n-gram hashes by winnowing (see FingerprintStream.winnow)
+'''
+def winnow(gram_hashes, w=W) -> set:
+    stream = FingerprintStream(w=w)
+    stream.winnow(gram_hashes)
+    return stream.get_fingerprints()
 
 '''
-Generate fingerprints from a list of N-grams
+Generate fingerprints from the tokens of a document (see string_tokenizer.find_tokens)
 '''
-def get_prints_from_ngrams(ngrams: list) -> set:
-    fingerprints = set()
-    for gram in ngrams:
-        f = hash(gram)
-        if(f % X == 0):
-            fingerprints.add(f)
-    return fingerprints
+def get_fingerprints_from_tokens(tokens, seed=SEED) -> set:
+    stream = FingerprintStream(seed)
+    stream.add_tokens(tokens)
+    return stream.get_fingerprints()
 
 '''
 Generate fingerprints from (document) text
 '''
-def get_fingerprints(text: str) -> set:
-    grams = find_grams(text)
-    return get_prints_from_ngrams(grams)
+def get_fingerprints(text: str, seed=SEED) -> set:
+    return get_fingerprints_from_tokens(find_tokens(text), seed)
 
 '''
 Compare two sets of fingerprints, and see if the ratio of shared
@@ -65,21 +143,57 @@ def compare_prints(prints1: set, prints2: set, threshold=1.0) -> bool:
     if len(all_prints) <= 0: return False #Prevent division by zero
     return len(shared_prints) / len(all_prints) > threshold
 
+'''
+Scramble a 64-bit integer (the splitmix64 finalizer), so that fingerprints are spread evenly over the hash space
+'''
+def mix64(x: int) -> int:
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & MASK64
+    return x ^ (x >> 31)
+
+'''
+Compute a MinHash signature for a set of fingerprints, using one-permutation hashing:
+every fingerprint is hashed once, the top bits of the hash pick a slot and each slot keeps its smallest value.
+Slots that no fingerprint landed in borrow the value of the next non-empty slot, so that the fraction of matching
+slots between two signatures estimates the Jaccard similarity of the two fingerprint sets.
+Return None if there are no fingerprints.
+'''
+def get_signature(prints: set):
+    if(len(prints) == 0):
+        return None
+    shift = 64 - SIGNATURE_BITS
+    low_mask = (1 << shift) - 1
+    slots = [None] * SIGNATURE_SIZE
+    for f in prints:
+        h = mix64(f & MASK64)
+        slot = h >> shift
+        value = h & low_mask
+        if(slots[slot] is None or value < slots[slot]):
+            slots[slot] = value
+
+    #Densify: fill every empty slot from the next non-empty slot to its right (wrapping around),
+    #tagged with the distance so that borrowed values don't collide with real ones
+    signature = array('Q', bytes(8 * SIGNATURE_SIZE))
+    for slot in range(SIGNATURE_SIZE):
+        distance = 0
+        while(slots[(slot + distance) % SIGNATURE_SIZE] is None):
+            distance += 1
+        signature[slot] = slots[(slot + distance) % SIGNATURE_SIZE] | (distance << shift)
+    return signature
+
 '''
 For testing
 '''
 if __name__ == "__main__":
     input_str = argv[1]
-    grams = find_grams(input_str)
-    print(grams)
-    fingerprints1 = get_fingerprints(grams)
+    print(find_tokens(input_str))
+    fingerprints1 = get_fingerprints(input_str)
     print(fingerprints1)
 
     if(len(argv) > 2):
         input_str = argv[2]
-        grams = find_grams(input_str)
-        print(grams)
-        fingerprints2 = get_fingerprints(grams)
+        print(find_tokens(input_str))
+        fingerprints2 = get_fingerprints(input_str)
         print(fingerprints2)
         print(compare_prints(fingerprints1, fingerprints2))
 
@@ -1,9 +1,15 @@
 import logging
 import os
-from collections import deque
+from array import array
+from itertools import islice
 import pickle
 
 import fingerprinter #Custom line
+from lsh_index import LSHIndex
+from disk_frontier import SegmentedQueue, UrlSeenSet
+from host_scheduler import HostScheduler
+from trap_detector import TrapDetector
+from url_table import UrlTable, InternedQueue, InternedSet
 from collections import defaultdict #Custom line (Why is it always defaultdict?)
 from urllib.parse import urlparse
 
@@ -28,21 +34,62 @@ class Frontier:
     FETCHED_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "fetched.pkl")
 
     FINGERPRINT_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "fingerprints.pkl") #Custom line
+    #Binary store the fingerprint index is saved to, whenever it is pickled (see fingerprint_store.py)
+    FINGERPRINT_STORE_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "fingerprints.bin")
+    URL_TABLE_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_table.pkl")
+    CONTENT_DIGEST_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "content_digests.pkl")
     FINGERPRINT_OVERLAP_THRESHOLD = 0.99 #Custom line
     MAX_DUPES_ALLOWED = 50 #Number of near-duplicates permitted before a URL is deemed a trap
+    SEED_URL = "http://www.ics.uci.edu/"
 
+    #Storage for urls_queue and urls_set: "memory" keeps them in memory as url ids (see url_table.py), while "disk"
+    #spills the queue to segment files and keeps the seen-set on disk behind a Bloom filter (see disk_frontier.py)
+    BACKENDS = ("memory", "disk")
+    DISK_QUEUE_DIR_NAME = os.path.join(".", FRONTIER_DIR_NAME, "queue_segments")
+    DISK_URL_SET_FILE_NAME = os.path.join(".", FRONTIER_DIR_NAME, "url_set.sqlite")
+    EXPECTED_URLS = 10000000 #Number of urls the Bloom filter is sized for
+    FALSE_POSITIVE_RATE = 0.01 #Bloom filter false-positive rate at EXPECTED_URLS (a false positive only costs a disk lookup)
+    #Order in which queued urls are fetched: "fifo" is a single queue, the others schedule per host (see host_scheduler.py)
+    SCHEDULERS = ("fifo",) + HostScheduler.POLICIES
 
-    def __init__(self):
-        self.urls_queue = deque()
-        self.urls_set = set()
+
+    def __init__(self, backend="memory", expected_urls=EXPECTED_URLS, false_positive_rate=FALSE_POSITIVE_RATE, scheduler="fifo"):
+        if(backend not in self.BACKENDS):
+            raise ValueError("Unknown frontier backend: {}".format(backend))
+        if(scheduler not in self.SCHEDULERS):
+            raise ValueError("Unknown frontier scheduler: {}".format(scheduler))
+        #Every url (and trimmed url) kept in memory is stored once here, and referred to by its id everywhere else
+        self.url_table = UrlTable()
+        if(backend == "disk"):
+            self.urls_queue = SegmentedQueue(self.DISK_QUEUE_DIR_NAME)
+            self.urls_set = UrlSeenSet(self.DISK_URL_SET_FILE_NAME, expected_urls, false_positive_rate)
+        else:
+            self.urls_queue = InternedQueue(self.url_table)
+            self.urls_set = InternedSet(self.url_table)
+        if(scheduler != "fifo"):
+            #The per-host queues are kept in memory, even with the disk backend
+            self.urls_queue = HostScheduler(scheduler)
         self.fetched = 0
 
-        #Record the fingerprints for each crawled page, for each trimmed URL
-        self.fingerprint_list = defaultdict(list)
-        #Track the number of near-duplicates found for a given, trimmed URL
+        #Record a MinHash signature of the fingerprints of each crawled page, indexed for near-duplicate lookups
+        self.fingerprint_index = LSHIndex(self.FINGERPRINT_STORE_FILE_NAME)
+        #Digests of the raw content of every page indexed above (see page_analyzer.get_content_digest), so that
+        #byte-identical copies are caught before they are even parsed (see is_exact_duplicate)
+        self.content_digests = set()
+        #Track the number of near-duplicates found for a given, trimmed URL (keyed by its id in url_table)
         self.near_dupes = defaultdict(int)
-        #Keep a set of traps (stored as URLs without a query or fragment ID)
-        self.traps = set()
+        #Keep a set of traps (stored as URLs without a query or fragment ID, or as url templates)
+        self.traps = InternedSet(self.url_table)
+        #Counts the urls added under each url template, to find families of generated pages (see trap_detector.py)
+        self.trap_detector = TrapDetector()
+        #Bumped whenever a trap is added, so that cached trap checks (see link_validator.py) know to redo them
+        self.trap_generation = 0
+        #Optional log that every new trap is also written to (see Analytics_Data.traps)
+        self.trap_log = None
+        #Optional write-ahead journal that every change to the frontier is recorded in (see journal.py)
+        self.journal = None
+        #Set while journal records are being replayed (see replay)
+        self.replaying = False
 
     def add_url(self, url):
         """
@@ -52,10 +99,48 @@ class Frontier:
         if not self.is_duplicate(url):
             self.urls_queue.append(url)
             self.urls_set.add(url)
+            if self.journal is not None:
+                self.journal.record("add_url", url)
+            self.count_template(url)
 
     def is_duplicate(self, url):
         return url in self.urls_set
-    
+
+    '''
+    Add a url to the seen-set without queueing it, e.g. a url handed to another shard (see sharded_crawl.py);
+    return whether it was new
+    '''
+    def mark_seen(self, url):
+        if self.is_duplicate(url):
+            return False
+        self.urls_set.add(url)
+        self.count_template(url)
+        return True
+
+    '''
+    Custom function to count a new url under its template, and register the template as a trap once it has too many
+    urls (the urls added after a snapshot are counted again as their add_url records are replayed)
+    '''
+    def count_template(self, url):
+        template = self.trap_detector.count(url)
+        if(template is not None and template not in self.traps):
+            self.add_trap(template)
+            #A replayed trap was reported when it was first detected
+            if(not self.replaying):
+                logger.info("Trap detected in %s; too many urls of the same template", template)
+
+    '''
+    Custom method to register a trap, so that any url under it is rejected
+    '''
+    def add_trap(self, trap):
+        if(trap not in self.traps):
+            self.traps.add(trap)
+            self.trap_generation += 1
+            if(self.trap_log is not None):
+                self.trap_log.add(trap)
+            if(self.journal is not None):
+                self.journal.record("trap", trap)
+
     '''
     Custom getter method returns set of traps
     '''
@@ -71,30 +156,71 @@ class Frontier:
         return trimmed.geturl()
 
     '''
-    Custom function to check whether a given set of fingerprints was already found in a different page
+    Custom function to check whether a given set of fingerprints was already found in a different page.
+    Candidates come from the LSH index, so this looks at every previously crawled page (not only the ones with the same
+    trimmed URL) in roughly constant time, and each candidate's fingerprints are verified against the overlap threshold.
+    The page's content digest (if given) is recorded too, so that its byte-identical copies are caught by
+    is_exact_duplicate instead.
+    '''
+    def is_near_duplicate(self, url, prints: set, content_digest=None):
+        signature = fingerprinter.get_signature(prints)
+        if(signature is None):
+            #A page without any fingerprints can't be compared to anything
+            return False
+        band_keys = self.fingerprint_index.band_keys(signature)
+        duplicate = self.fingerprint_index.find_near_duplicate(signature, prints, self.FINGERPRINT_OVERLAP_THRESHOLD,
+                                                               band_keys)
+        sorted_prints = LSHIndex.sort_prints(prints)
+        self.fingerprint_index.insert(signature, sorted_prints, band_keys)
+        if(self.journal is not None):
+            self.journal.record("signature", signature, sorted_prints)
+        if(content_digest is not None):
+            self.add_content_digest(content_digest)
+        if(duplicate is None):
+            return False
+
+        self.add_near_duplicate(url)
+        return True
+
+    '''
+    Custom function to check whether a page's raw content is byte-identical to a page indexed by is_near_duplicate.
+    Such a copy would be found to be a near-duplicate of it, so it is counted as one right away, without being parsed
+    or fingerprinted.
+    '''
+    def is_exact_duplicate(self, url, content_digest):
+        if(content_digest not in self.content_digests):
+            return False
+        self.add_near_duplicate(url)
+        return True
+
+    def add_content_digest(self, content_digest):
+        if(content_digest not in self.content_digests):
+            self.content_digests.add(content_digest)
+            if(self.journal is not None):
+                self.journal.record("content_digest", content_digest)
+
+    '''
+    Custom function to count a near-duplicate page, and register its trimmed URL as a trap once it has too many
     '''
-    def is_near_duplicate(self, url, prints: set):
-        #This is definitely inefficient, but for early testing it should suffice, right...?
-        #Maybe have it be one list of fingerprint sets per trimmed URL
+    def add_near_duplicate(self, url):
         trimmed = self.trim_url(url)
-        for saved_prints in self.fingerprint_list[trimmed]:
-            if(fingerprinter.compare_prints(prints, saved_prints, self.FINGERPRINT_OVERLAP_THRESHOLD)):
-                self.near_dupes[trimmed] += 1
-                if(self.near_dupes[trimmed] > self.MAX_DUPES_ALLOWED):
-                    #If it has too many near-duplicate pages, then consider it a trap
-                    self.traps.add(trimmed)
-                    print("Trap detected in {}; too many near-duplicates".format(trimmed))
-                self.register_fingerprints(url, prints)
-                return True
-        self.register_fingerprints(url, prints)
-        return False
+        if(self.count_near_duplicate(trimmed) > self.MAX_DUPES_ALLOWED and trimmed not in self.traps):
+            #If it has too many near-duplicate pages, then consider it a trap
+            self.add_trap(trimmed)
+            logger.info("Trap detected in %s; too many near-duplicates", trimmed)
 
     '''
-    Custom function to register a new set of fingerprints (from an individual document/web page)
+    Custom function to count a near-duplicate page under its trimmed URL (and its host, for the per-host scheduler);
+    returns the number of near-duplicates counted for the trimmed URL so far
     '''
-    def register_fingerprints(self, new_url, new_prints: set):
-        trimmed = self.trim_url(new_url)
-        self.fingerprint_list[trimmed].append(new_prints)
+    def count_near_duplicate(self, trimmed):
+        trimmed_id = self.url_table.intern(trimmed)
+        self.near_dupes[trimmed_id] += 1
+        if(isinstance(self.urls_queue, HostScheduler)):
+            self.urls_queue.record_duplicate(HostScheduler.get_host(trimmed))
+        if(self.journal is not None):
+            self.journal.record("near_dupe", trimmed)
+        return self.near_dupes[trimmed_id]
 
     def get_next_url(self):
         """
@@ -102,7 +228,25 @@ class Frontier:
         """
         if self.has_next_url():
             self.fetched += 1
-            return self.urls_queue.popleft()
+            url = self.urls_queue.popleft()
+            #The url itself is only needed to tell which handed out urls never made it back (see Crawler.recover)
+            if self.journal is not None:
+                self.journal.record("next_url", url)
+            return url
+
+    def requeue(self, urls):
+        """
+        Puts urls that were handed out by get_next_url but never crawled back at the head of the queue, in order
+        """
+        for url in reversed(urls):
+            self.urls_queue.appendleft(url)
+            self.fetched -= 1
+
+    def peek_urls(self, count):
+        """
+        Returns (without removing them) the next count urls that get_next_url would return
+        """
+        return list(islice(self.urls_queue, count))
 
     def has_next_url(self):
         """
@@ -121,14 +265,22 @@ class Frontier:
         url_set_file = open(self.URL_SET_FILE_NAME, "wb")
         fetched_file = open(self.FETCHED_FILE_NAME, "wb")
         fingerprint_file = open(self.FINGERPRINT_FILE_NAME, "wb") #Custom line
+        url_table_file = open(self.URL_TABLE_FILE_NAME, "wb")
+        content_digest_file = open(self.CONTENT_DIGEST_FILE_NAME, "wb")
+        pickle.dump(self.url_table, url_table_file)
+        #Pickled as a packed array rather than as a set of Python ints
+        pickle.dump(array('Q', self.content_digests), content_digest_file)
         pickle.dump(self.urls_queue, url_queue_file)
         pickle.dump(self.urls_set, url_set_file)
         pickle.dump(self.fetched, fetched_file)
-        pickle.dump(self.fingerprint_list, fingerprint_file) #Custom line
+        #Writes the fingerprint store first, so the pickle only has to refer to it
+        self.fingerprint_index.save()
+        pickle.dump(self.fingerprint_index, fingerprint_file) #Custom line
 
-    def load_frontier(self):
+    def load_frontier(self, with_seed=True):
         """
         loads the previous state of the frontier into memory, if exists
+        (otherwise starts fresh, from the seed URL if with_seed is set)
         """
         if os.path.isfile(self.URL_QUEUE_FILE_NAME) and os.path.isfile(self.URL_SET_FILE_NAME) and\
                 os.path.isfile(self.FETCHED_FILE_NAME):
@@ -136,14 +288,114 @@ class Frontier:
                 self.urls_queue = pickle.load(open(self.URL_QUEUE_FILE_NAME, "rb"))
                 self.urls_set = pickle.load(open(self.URL_SET_FILE_NAME, "rb"))
                 self.fetched = pickle.load(open(self.FETCHED_FILE_NAME, "rb"))
-                self.fingerprint_list = pickle.load(open(self.FINGERPRINT_FILE_NAME, "rb")) #Custom line
+                self.fingerprint_index = pickle.load(open(self.FINGERPRINT_FILE_NAME, "rb")) #Custom line
+                if os.path.isfile(self.URL_TABLE_FILE_NAME):
+                    self.url_table = pickle.load(open(self.URL_TABLE_FILE_NAME, "rb"))
+                if os.path.isfile(self.CONTENT_DIGEST_FILE_NAME):
+                    self.content_digests = set(pickle.load(open(self.CONTENT_DIGEST_FILE_NAME, "rb")))
+                self.attach_url_table()
                 logger.info("Loaded previous frontier state into memory. Fetched: %s, Queue size: %s", self.fetched,
                             len(self.urls_queue))
             except:
                 pass
         else:
             logger.info("No previous frontier state found. Starting from the seed URL ...")
-            self.add_url("http://www.ics.uci.edu/")
+            self.start_fresh(with_seed)
+
+    '''
+    Empty the queue and the seen-set (dropping whatever an earlier crawl left in the disk backend),
+    then add the seed URL (unless with_seed is False, e.g. for a shard that doesn't own the seed's host)
+    '''
+    def start_fresh(self, with_seed=True):
+        self.urls_queue.clear()
+        self.urls_set.clear()
+        if with_seed:
+            self.add_url(self.SEED_URL)
+
+    '''
+    Point the containers that store url ids back at url_table (they are pickled without it, see url_table.py)
+    '''
+    def attach_url_table(self):
+        for container in (self.urls_queue, self.urls_set, self.traps):
+            if(isinstance(container, (InternedQueue, InternedSet))):
+                container.table = self.url_table
+
+    '''
+    Return the full state of the frontier, for a journal snapshot
+    (the fingerprint store is saved first, so the snapshot only has to refer to it)
+    '''
+    def get_state(self):
+        self.fingerprint_index.save()
+        return {
+            "url_table": self.url_table,
+            "urls_queue": self.urls_queue,
+            "urls_set": self.urls_set,
+            "fetched": self.fetched,
+            "fingerprint_index": self.fingerprint_index,
+            "content_digests": self.content_digests,
+            "near_dupes": self.near_dupes,
+            "traps": self.traps,
+            "trap_detector": self.trap_detector
+        }
+
+    '''
+    Restore the frontier from a journal snapshot
+    '''
+    def set_state(self, state):
+        self.urls_queue = state["urls_queue"]
+        self.urls_set = state["urls_set"]
+        self.fetched = state["fetched"]
+        self.fingerprint_index = state["fingerprint_index"]
+        self.content_digests = state["content_digests"]
+        self.near_dupes = state["near_dupes"]
+        self.traps = state["traps"]
+        self.trap_detector = state["trap_detector"]
+        self.url_table = state["url_table"]
+        self.attach_url_table()
+        self.trap_generation += 1
+
+    '''
+    Apply a journal record written by this class; return False if the record belongs to someone else
+    (nothing is journaled again while replaying, since the journal is only attached afterwards)
+    '''
+    def replay(self, operation, arguments):
+        if(operation == "add_url"):
+            self.replaying = True
+            try:
+                self.add_url(*arguments)
+            finally:
+                self.replaying = False
+        elif(operation == "next_url"):
+            self.get_next_url()
+        elif(operation == "trap"):
+            self.add_trap(*arguments)
+        elif(operation == "signature"):
+            self.fingerprint_index.insert(*arguments)
+        elif(operation == "content_digest"):
+            self.add_content_digest(*arguments)
+        elif(operation == "near_dupe"):
+            self.count_near_duplicate(*arguments)
+        else:
+            return False
+        return True
+
+    '''
+    Return the sizes of the frontier's state, for the crawl stats (see crawl_stats.py)
+    '''
+    def get_stats(self):
+        return {
+            "queue_depth": len(self.urls_queue),
+            "seen_urls": len(self.urls_set),
+            "indexed_pages": len(self.fingerprint_index),
+            "content_digests": len(self.content_digests),
+            "near_duplicate_urls": len(self.near_dupes),
+            "traps": len(self.traps),
+            "trap_detector": self.trap_detector.get_stats(),
+            "interned_urls": len(self.url_table),
+            "url_table_bytes": self.url_table.nbytes(),
+            "fingerprint_index_bytes": self.fingerprint_index.nbytes(),
+            "fingerprint_store_bytes": self.fingerprint_index.stored_nbytes()
+        }
 
     def __len__(self):
         return len(self.urls_queue)
@@ -0,0 +1,125 @@
+import heapq
+import re
+from collections import deque, defaultdict
+from urllib.parse import urlparse
+
+'''
+Per-host scheduling for the frontier queue.
+Instead of one FIFO, every host (subdomain) gets its own queue, and each call to popleft picks a host first and then
+a url from that host. This keeps a single deep subdomain from flooding the crawl, and the per-host queues are natural
+units of work to hand out to parallel workers.
+
+Hosts are picked by stride scheduling: each host has a weight, and the host that has received the least service
+relative to its weight goes next. The policy decides the weights and the order of urls within a host:
+    round_robin: every host has the same weight, and urls within a host are taken in FIFO order
+    priority:    hosts are down-weighted by their near-duplicate rate (see Frontier.near_dupes), and urls within a
+                 host are taken shallowest path first, preferring path templates that have been queued less often
+'''
+
+#Collapse digit runs so that e.g. /events/2019/05/ and /events/2020/11/ share a template
+DIGITS = re.compile(r'\d+')
+
+class HostScheduler:
+
+    POLICIES = ("round_robin", "priority")
+    DUPLICATE_PENALTY = 4.0 #A host whose pages are all near-duplicates is picked 1 / (1 + DUPLICATE_PENALTY) as often
+
+    def __init__(self, policy="round_robin"):
+        if(policy not in self.POLICIES):
+            raise ValueError("Unknown scheduling policy: {}".format(policy))
+        self.policy = policy
+        self.queues = {} #host -> deque of urls (round_robin) or heap of (depth, template count, sequence, url) (priority)
+        self.active = [] #heap of (pass, sequence, host) for every host with queued urls
+        self.passes = defaultdict(float) #How much service each host has received, scaled by its weight
+        self.current_pass = 0.0
+        self.sequence = 0
+        self.length = 0
+        self.template_counts = defaultdict(int)
+        self.host_fetched = defaultdict(int)
+        self.host_duplicates = defaultdict(int)
+
+    @staticmethod
+    def get_host(url):
+        return urlparse(url).netloc.lower()
+
+    def get_weight(self, host):
+        if(self.policy == "round_robin" or self.host_fetched[host] == 0):
+            return 1.0
+        duplicate_rate = self.host_duplicates[host] / self.host_fetched[host]
+        return 1.0 / (1.0 + self.DUPLICATE_PENALTY * duplicate_rate)
+
+    def get_queue(self, host):
+        queue = self.queues.get(host)
+        if(queue is None):
+            queue = self.queues[host] = deque() if self.policy == "round_robin" else []
+            #A host that (re)joins starts level with the others rather than catching up on the turns it missed
+            self.passes[host] = max(self.passes[host], self.current_pass)
+            heapq.heappush(self.active, (self.passes[host], self.sequence, host))
+        return queue
+
+    def append(self, url):
+        host = self.get_host(url)
+        self.sequence += 1
+        queue = self.get_queue(host)
+        if(self.policy == "round_robin"):
+            queue.append(url)
+        else:
+            parsed = urlparse(url)
+            template = DIGITS.sub("#", host + parsed.path)
+            depth = parsed.path.rstrip("/").count("/")
+            heapq.heappush(queue, (depth, self.template_counts[template], self.sequence, url))
+            self.template_counts[template] += 1
+        self.length += 1
+
+    def popleft(self):
+        if(self.length == 0):
+            raise IndexError("pop from an empty scheduler")
+        host_pass, sequence, host = heapq.heappop(self.active)
+        self.current_pass = host_pass
+        queue = self.queues[host]
+        url = queue.popleft() if self.policy == "round_robin" else heapq.heappop(queue)[3]
+        self.length -= 1
+        self.host_fetched[host] += 1
+
+        self.passes[host] = host_pass + 1.0 / self.get_weight(host)
+        if(queue):
+            heapq.heappush(self.active, (self.passes[host], sequence, host))
+        else:
+            del self.queues[host]
+        return url
+
+    '''
+    Hand back a url that popleft returned but that was never crawled; it goes ahead of the other urls of its host
+    '''
+    def appendleft(self, url):
+        host = self.get_host(url)
+        self.sequence += 1
+        queue = self.get_queue(host)
+        if(self.policy == "round_robin"):
+            queue.appendleft(url)
+        else:
+            #Sorts before every regular entry, and later hand-backs before earlier ones
+            heapq.heappush(queue, (-1, 0, -self.sequence, url))
+        self.length += 1
+        self.host_fetched[host] -= 1
+
+    '''
+    Called by the frontier whenever a page from this host turns out to be a near-duplicate
+    '''
+    def record_duplicate(self, host):
+        self.host_duplicates[host] += 1
+
+    '''
+    Iterate over the next url of each host, in the order the hosts will be picked.
+    This is only an approximation of the order popleft will return urls in, which is good enough for prefetching.
+    '''
+    def __iter__(self):
+        for _, _, host in sorted(self.active):
+            queue = self.queues[host]
+            yield queue[0] if self.policy == "round_robin" else queue[0][3]
+
+    def clear(self):
+        self.__init__(self.policy)
+
+    def __len__(self):
+        return self.length
@@ -0,0 +1,141 @@
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+'''
+Write-ahead journal for the crawl state.
+Every change to the frontier and the analytics data is appended to the journal as a small (operation, arguments)
+record, so a checkpoint only has to flush the records written since the last one. Once the journal grows past a size
+limit the whole state is written to a snapshot and a fresh journal is started.
+Recovery loads the last snapshot and replays the journal that was started with it.
+Records written between begin_batch and end_batch are written as a single ("batch", records) record, so that a crash
+(or a write buffer that fills up halfway) never leaves only part of a crawled page in the journal.
+
+Files (in JOURNAL_DIR_NAME):
+    snapshot.pkl      (generation, state) of the last snapshot, replaced atomically
+    journal.<n>.log   records written since snapshot generation n
+'''
+
+class Journal:
+
+    JOURNAL_DIR_NAME = "journal"
+    SNAPSHOT_FILE_NAME = "snapshot.pkl"
+    BUFFER_SIZE = 1024 * 1024
+    SNAPSHOT_JOURNAL_BYTES = 256 * 1024 * 1024 #Take a new snapshot once the journal grows past this size
+
+    def __init__(self, journal_dir=JOURNAL_DIR_NAME, snapshot_journal_bytes=SNAPSHOT_JOURNAL_BYTES):
+        self.journal_dir = journal_dir
+        self.snapshot_journal_bytes = snapshot_journal_bytes
+        self.generation = 0
+        self.journal_file = None
+        self.entries = 0 #Records written since the last snapshot
+        self.batch = None #Records of the open batch, if any
+        if(not os.path.exists(journal_dir)):
+            os.makedirs(journal_dir)
+
+    def get_journal_file_name(self, generation):
+        return os.path.join(self.journal_dir, "journal.{}.log".format(generation))
+
+    def get_snapshot_file_name(self):
+        return os.path.join(self.journal_dir, self.SNAPSHOT_FILE_NAME)
+
+    '''
+    Load the last snapshot and read back the records journaled after it.
+    Return (state, records): state is None if no snapshot was taken yet, and records is a list of
+    (operation, arguments) tuples in the order they were written.
+    A record cut short by a crash is dropped, and the journal is truncated to the last complete record before new
+    records are appended to it.
+    '''
+    def recover(self):
+        state = None
+        snapshot_file_name = self.get_snapshot_file_name()
+        if(os.path.isfile(snapshot_file_name)):
+            with open(snapshot_file_name, "rb") as snapshot_file:
+                self.generation, state = pickle.load(snapshot_file)
+
+        records = []
+        journal_file_name = self.get_journal_file_name(self.generation)
+        good_offset = 0
+        if(os.path.isfile(journal_file_name)):
+            with open(journal_file_name, "rb") as journal_file:
+                while True:
+                    try:
+                        operation, arguments = pickle.load(journal_file)
+                    except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                        break
+                    if(operation == "batch"):
+                        records.extend(arguments)
+                    else:
+                        records.append((operation, arguments))
+                    good_offset = journal_file.tell()
+            if(good_offset < os.path.getsize(journal_file_name)):
+                logger.info("Dropping an incomplete record at the end of %s", journal_file_name)
+                os.truncate(journal_file_name, good_offset)
+        logger.info("Recovered snapshot generation %s and %s journal records", self.generation, len(records))
+
+        self.entries = len(records)
+        self.journal_file = open(journal_file_name, "ab", buffering=self.BUFFER_SIZE)
+        return state, records
+
+    '''
+    Append a record to the journal (it reaches the disk at the next checkpoint, or when the write buffer fills up)
+    '''
+    def record(self, operation, *arguments):
+        if(self.batch is not None):
+            self.batch.append((operation, arguments))
+        else:
+            pickle.dump((operation, arguments), self.journal_file, pickle.HIGHEST_PROTOCOL)
+        self.entries += 1
+
+    '''
+    Hold back the records that follow until end_batch, and write them all at once
+    '''
+    def begin_batch(self):
+        self.batch = []
+
+    def end_batch(self):
+        batch, self.batch = self.batch, None
+        if(batch):
+            pickle.dump(("batch", batch), self.journal_file, pickle.HIGHEST_PROTOCOL)
+
+    '''
+    Make every record written so far durable
+    '''
+    def checkpoint(self):
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    '''
+    Whether the journal has grown enough that a new snapshot should be taken
+    '''
+    def needs_snapshot(self):
+        return self.journal_file.tell() >= self.snapshot_journal_bytes
+
+    '''
+    Write a snapshot of the full state and start a new, empty journal.
+    The snapshot is written to a temporary file and renamed over the old one, so a crash at any point leaves either
+    the old snapshot with its journal or the new snapshot (with an empty journal) behind.
+    '''
+    def snapshot(self, state):
+        self.checkpoint()
+        new_generation = self.generation + 1
+        snapshot_file_name = self.get_snapshot_file_name()
+        with open(snapshot_file_name + ".tmp", "wb") as snapshot_file:
+            pickle.dump((new_generation, state), snapshot_file, pickle.HIGHEST_PROTOCOL)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(snapshot_file_name + ".tmp", snapshot_file_name)
+
+        self.journal_file.close()
+        os.remove(self.get_journal_file_name(self.generation))
+        self.generation = new_generation
+        self.entries = 0
+        self.journal_file = open(self.get_journal_file_name(self.generation), "ab", buffering=self.BUFFER_SIZE)
+        logger.info("Wrote snapshot generation %s", self.generation)
+
+    def close(self):
+        if(self.journal_file is not None and not self.journal_file.closed):
+            self.checkpoint()
+            self.journal_file.close()
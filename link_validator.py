@@ -0,0 +1,113 @@
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from trap_detector import get_template
+
+'''
+Parsed-link records for Crawler.is_valid.
+A link is usually validated several times (when its page is analyzed, before it is added to the frontier, and again
+when it is dequeued), so everything about it that depends only on the url itself is worked out once, by parse_link,
+and kept in a LinkRecord. Only the part that depends on the crawl state (the traps found so far) is left for
+Crawler.check_link to do on every call.
+LinkRecords are kept in a LinkRecordCache, a least-recently-used cache bounded by the number of entries.
+'''
+
+ALLOWED_SCHEMES = frozenset(["http", "https"])
+ALLOWED_HOST = ".ics.uci.edu"
+#Paths with these extensions are never crawled
+IGNORED_EXTENSIONS = frozenset([
+    "css", "js", "bmp", "gif", "jpg", "jpeg", "ico",
+    "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names", "data", "dat", "exe", "bz2", "tar", "msi",
+    "bin", "7z", "psd", "dmg", "iso", "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz"
+])
+
+class LinkRecord:
+    '''
+    Attributes:
+        url:                the link
+        too_long:           whether the link is longer than the size limit (nothing else is filled in then)
+        trimmed:            the link without its query or fragment (see Frontier.trim_url)
+        repeated_subdomain: whether one of the link's subdomains appears 3+ times in it
+        template:           the link's url template (see trap_detector.py)
+        allowed:            whether the scheme, host and extension of the link are crawlable
+        trap_generation:    the Frontier.trap_generation that trapped was last checked at
+        trapped:            whether trimmed or template was a trap at that point
+    '''
+    __slots__ = ("url", "too_long", "trimmed", "repeated_subdomain", "template", "allowed", "trap_generation",
+                 "trapped")
+
+    def __init__(self, url, too_long):
+        self.url = url
+        self.too_long = too_long
+        self.trimmed = None
+        self.repeated_subdomain = False
+        self.template = None
+        self.allowed = False
+        self.trap_generation = -1
+        self.trapped = False
+
+'''
+Return the subdomains of a netloc, leaving out the 2 root domains (uci.edu and edu)
+'''
+def get_subdomains(netloc):
+    domain_split = netloc.replace('www.', '').split('.')
+    return ['.'.join(domain_split[i:]) for i in range(len(domain_split) - 2)]
+
+'''
+Parse a link once into a LinkRecord
+'''
+def parse_link(url, size_limit):
+    if(len(url) > size_limit):
+        return LinkRecord(url, True)
+
+    record = LinkRecord(url, False)
+    parsed = urlparse(url)
+    record.trimmed = parsed._replace(params="", query="", fragment="").geturl()
+    record.repeated_subdomain = any(url.count(subdomain) >= 3 for subdomain in get_subdomains(parsed.netloc))
+    record.template = get_template(url)
+
+    hostname = parsed.hostname
+    if(parsed.scheme in ALLOWED_SCHEMES and hostname is not None and ALLOWED_HOST in hostname):
+        path = parsed.path.lower()
+        dot = path.rfind(".")
+        record.allowed = dot < 0 or path[dot + 1:] not in IGNORED_EXTENSIONS
+    return record
+
+
+class LinkRecordCache:
+    '''
+    A least-recently-used cache of LinkRecords by url, holding at most max_entries of them
+    '''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url):
+        record = self.records.get(url)
+        if(record is None):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.records.move_to_end(url)
+        return record
+
+    def put(self, url, record):
+        if(self.max_entries <= 0):
+            return
+        self.records[url] = record
+        self.records.move_to_end(url)
+        if(len(self.records) > self.max_entries):
+            self.records.popitem(last=False)
+
+    def clear(self):
+        self.records.clear()
+
+    def __len__(self):
+        return len(self.records)
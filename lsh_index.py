@@ -0,0 +1,196 @@
+import heapq
+import sys
+from array import array
+from hashlib import blake2b
+
+import fingerprinter
+from fingerprint_store import FingerprintStore
+
+'''
+Locality-sensitive hashing index over MinHash signatures (see fingerprinter.get_signature).
+Each signature is split into bands of rows; two pages become candidate near-duplicates when at least one of their bands
+is identical. With BANDS * ROWS = SIGNATURE_SIZE this finds pages above roughly (1 / BANDS) ** (1 / ROWS) similarity,
+which is well below the 0.99 the frontier asks for, so nearly every page above the threshold shares a band with the
+pages it is similar to.
+A signature only estimates the similarity (with 128 slots, a page at 0.98 would pass a 0.99 threshold about a quarter
+of the time), so candidates are verified against the exact Jaccard similarity of their fingerprints instead.
+Signatures and fingerprints are stored back to back in arrays of 64-bit integers instead of as sets of Python ints.
+
+With a file name, save writes the index to a FingerprintStore (see fingerprint_store.py), and a pickle only holds the
+file name, the number of documents in the store and the documents indexed since the last save. Unpickling maps the
+store instead of reading it, so loading takes the same time however many pages were indexed, as long as the index
+was saved right before it was pickled (see Frontier.save_frontier and Frontier.get_state).
+The band keys are saved along with the documents, so they come from a digest of each band rather than from the
+built-in hash(), which may change between Python versions.
+'''
+
+class LSHIndex:
+
+    BANDS = 16
+    ROWS = fingerprinter.SIGNATURE_SIZE // BANDS
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        #The documents saved to file_name (ids 0 to len(store) - 1), or None; the rest are only in memory
+        self.store = None
+        self.signatures = array('Q')
+        #The sorted fingerprints of every document, back to back, and where each document's fingerprints end
+        self.prints = array('Q')
+        self.print_ends = array('Q')
+        #One table per band, mapping the band's hash to the ids of the documents that share it.
+        #A single id is stored as a plain int, since most buckets only ever hold one document.
+        self.tables = [{} for _ in range(self.BANDS)]
+
+    def __len__(self):
+        return self.get_stored_count() + len(self.signatures) // fingerprinter.SIGNATURE_SIZE
+
+    def get_stored_count(self):
+        return len(self.store) if self.store is not None else 0
+
+    '''
+    Approximate number of bytes used by the index: the signatures, the band tables and their multi-document buckets
+    (but not the ints inside them), not counting the store, which is mapped from its file
+    '''
+    def nbytes(self):
+        size = self.signatures.itemsize * (len(self.signatures) + len(self.prints) + len(self.print_ends))
+        for table in self.tables:
+            size += sys.getsizeof(table)
+            size += sum(sys.getsizeof(bucket) for bucket in table.values() if not isinstance(bucket, int))
+        return size
+
+    def stored_nbytes(self):
+        return self.store.nbytes() if self.store is not None else 0
+
+    def band_keys(self, signature):
+        packed = array('Q', signature).tobytes()
+        band_bytes = self.ROWS * 8
+        return [int.from_bytes(blake2b(packed[start:start + band_bytes], digest_size=8).digest(), "little")
+                for start in range(0, self.BANDS * band_bytes, band_bytes)]
+
+    def get_signature(self, doc_id):
+        stored_count = self.get_stored_count()
+        if(doc_id < stored_count):
+            return self.store.get_signature(doc_id)
+        start = (doc_id - stored_count) * fingerprinter.SIGNATURE_SIZE
+        return self.signatures[start:start + fingerprinter.SIGNATURE_SIZE]
+
+    def get_prints(self, doc_id):
+        stored_count = self.get_stored_count()
+        if(doc_id < stored_count):
+            return self.store.get_prints(doc_id)
+        index = doc_id - stored_count
+        start = self.print_ends[index - 1] if index > 0 else 0
+        return self.prints[start:self.print_ends[index]]
+
+    '''
+    Add a document to the index, given its signature and its fingerprints (sorted, see sort_prints), and return its
+    document id
+    '''
+    def insert(self, signature, prints, band_keys=None):
+        doc_id = len(self)
+        self.signatures.extend(signature)
+        self.prints.extend(prints)
+        self.print_ends.append(len(self.prints))
+        if(band_keys is None):
+            band_keys = self.band_keys(signature)
+        for table, key in zip(self.tables, band_keys):
+            bucket = table.get(key)
+            if(bucket is None):
+                table[key] = doc_id
+            elif(isinstance(bucket, int)):
+                table[key] = [bucket, doc_id]
+            else:
+                bucket.append(doc_id)
+        return doc_id
+
+    '''
+    Yield the ids of every indexed document that shares at least one band with the signature, in ascending order.
+    The ids sharing each band (from the store and from memory) are already sorted, so they are merged rather than
+    collected into a set, and nothing past the first match of the caller is looked at.
+    '''
+    def iter_candidates(self, signature, band_keys=None):
+        if(band_keys is None):
+            band_keys = self.band_keys(signature)
+        buckets = []
+        for band, (table, key) in enumerate(zip(self.tables, band_keys)):
+            if(self.store is not None):
+                stored_ids = self.store.lookup(band, key)
+                if(stored_ids):
+                    buckets.append(stored_ids)
+            bucket = table.get(key)
+            if(bucket is not None):
+                buckets.append((bucket,) if isinstance(bucket, int) else bucket)
+        last = None
+        for doc_id in heapq.merge(*buckets):
+            if(doc_id != last):
+                yield doc_id
+                last = doc_id
+
+    '''
+    Return the ids of every indexed document that shares at least one band with the signature
+    '''
+    def query(self, signature, band_keys=None):
+        return list(self.iter_candidates(signature, band_keys))
+
+    '''
+    Return the id of an indexed document whose fingerprints are more similar than threshold to the given set of
+    fingerprints (with signature as its signature), or None
+    '''
+    def find_near_duplicate(self, signature, prints, threshold, band_keys=None):
+        for doc_id in self.iter_candidates(signature, band_keys):
+            candidate_prints = self.get_prints(doc_id)
+            #The similarity can't be higher than the ratio of the two sizes, which rules out most candidates for free
+            smaller, larger = sorted((len(prints), len(candidate_prints)))
+            if(smaller <= threshold * larger):
+                continue
+            shared = len(prints.intersection(candidate_prints))
+            if(shared / (len(prints) + len(candidate_prints) - shared) > threshold):
+                return doc_id
+        return None
+
+    '''
+    Convert a set of fingerprints to the form insert takes
+    '''
+    @staticmethod
+    def sort_prints(prints):
+        return array('Q', sorted(prints))
+
+    '''
+    Merge the documents kept in memory into the store in file_name, and map the new store in their place
+    '''
+    def save(self):
+        if(self.file_name is None):
+            return
+        if(len(self.signatures) == 0 and self.store is not None and self.store.count == self.store.stored):
+            return
+        if(len(self) == 0):
+            return
+        FingerprintStore.write(self.file_name, self.store, self.signatures, self.tables, self.print_ends, self.prints)
+        self.store = FingerprintStore(self.file_name)
+        self.signatures = array('Q')
+        self.prints = array('Q')
+        self.print_ends = array('Q')
+        self.tables = [{} for _ in range(self.BANDS)]
+
+    '''
+    The store is pickled by reference (its file name and how many of its documents are part of this index); only the
+    documents indexed since the last save are pickled as they are
+    '''
+    def __getstate__(self):
+        if(self.file_name is None):
+            return dict(self.__dict__)
+        return {"file_name": self.file_name, "count": self.get_stored_count(), "signatures": self.signatures,
+                "prints": self.prints, "print_ends": self.print_ends, "tables": self.tables}
+
+    def __setstate__(self, state):
+        if("count" not in state):
+            self.__dict__.update(state)
+            return
+        self.__init__(state["file_name"])
+        if(state["count"] > 0):
+            self.store = FingerprintStore(self.file_name, state["count"])
+        if("signatures" in state):
+            self.signatures = state["signatures"]
+            self.prints = state["prints"]
+            self.print_ends = state["print_ends"]
+            self.tables = state["tables"]
@@ -1,31 +1,132 @@
+import argparse
 import atexit
 import logging
-
-import sys
+import os
+from functools import partial
 
 from corpus import Corpus
 from crawler import Crawler
+from crawl_stats import CrawlStats
+from artifact_cache import ArtifactCache
 from frontier import Frontier
+from journal import Journal
+from page_analyzer import EXTRACTORS
+from sharded_crawl import SHARD_DIR_NAME, run_shard, crawl_sharded, merge_shards
 
-if __name__ == "__main__":
-    # Configures basic logging
-    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
-                        level=logging.INFO)
 
+'''
+Crawl the corpus in the current directory with the options in args; return the Crawler once it is done.
+In a sharded crawl (see sharded_crawl.py) this runs one shard, with its router, and the shard does the cleanup that is
+otherwise left to exit handlers.
+'''
+def run_crawl(args, router=None):
     # Instantiates frontier and loads the last state if exists
-    frontier = Frontier()
-    frontier.load_frontier()
+    # (with the journal, the crawler recovers the frontier together with the analytics data instead)
+    frontier = Frontier(backend=args.frontier_backend, expected_urls=args.frontier_capacity,
+                        false_positive_rate=args.frontier_fp_rate, scheduler=args.scheduler)
+    journal = None if args.no_journal else Journal()
+    if journal is None:
+        frontier.load_frontier(with_seed=router is None or router.is_local(Frontier.SEED_URL))
 
     # Instantiates corpus object with the given cmd arg
-    corpus = Corpus(sys.argv[1])
+    corpus = Corpus(args.corpus_dir)
+
+    # Loads the corpus manifest (building it on the first run) so existence checks don't touch the file system
+    corpus.load_manifest()
 
-    # Registers a shutdown hook to save frontier state upon unexpected shutdown
-    atexit.register(frontier.save_frontier)
+    # Instantiates the crawl stats (and their HTTP endpoint, if asked for; each shard serves on the next port)
+    stats_port = args.stats_port
+    if stats_port is not None and router is not None:
+        stats_port += router.shard_id
+    stats = CrawlStats(args.stats_file, snapshot_interval=args.stats_interval,
+                       progress_interval=args.progress_interval, port=stats_port)
+
+    # Opens the cache of what earlier runs extracted from each page
+    artifact_cache = None
+    if not args.no_artifact_cache:
+        artifact_cache = ArtifactCache(args.artifact_cache_file, max_bytes=int(args.artifact_cache_max_mb * 2 ** 20))
+        if args.clear_artifact_cache:
+            artifact_cache.clear()
+        if router is None:
+            atexit.register(artifact_cache.close)
 
     # Instantiates a crawler object and starts crawling
-    crawler = Crawler(frontier, corpus)
+    crawler = Crawler(frontier, corpus, workers=args.workers, prefetch_depth=args.prefetch_depth,
+                      word_counter_mode=args.word_counts, journal=journal, extractor=args.extractor, stats=stats,
+                      artifact_cache=artifact_cache, router=router)
 
-    #Registers a shutdown hook to save analytics data upon an unexpected shutdown
-    atexit.register(crawler.save_analytics_data)
+    if router is None and journal is None:
+        # Registers shutdown hooks to save frontier state and analytics data upon unexpected shutdown
+        atexit.register(frontier.save_frontier)
+        atexit.register(crawler.save_analytics_data)
+    elif router is None:
+        # Only the journal records since the last checkpoint need to be flushed at shutdown
+        atexit.register(journal.close)
 
     crawler.start_crawling()
+    return crawler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus_dir", help="directory containing the corpus")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes used to analyze pages")
+    parser.add_argument("--prefetch-depth", type=int, default=8,
+                        help="number of corpus records read ahead of the crawler in the background (0 disables prefetching)")
+    parser.add_argument("--word-counts", choices=["exact", "sketch"], default="exact",
+                        help="count every word exactly, or estimate the top words in a fixed amount of memory")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="don't journal the crawl state; only pickle it at exit (the old behaviour)")
+    parser.add_argument("--frontier-backend", choices=Frontier.BACKENDS, default="memory",
+                        help="keep the frontier queue and seen-set in memory, or on disk for crawls larger than RAM")
+    parser.add_argument("--frontier-capacity", type=int, default=Frontier.EXPECTED_URLS,
+                        help="number of urls the disk backend's Bloom filter is sized for")
+    parser.add_argument("--frontier-fp-rate", type=float, default=Frontier.FALSE_POSITIVE_RATE,
+                        help="target false-positive rate of the disk backend's Bloom filter")
+    parser.add_argument("--scheduler", choices=Frontier.SCHEDULERS, default="fifo",
+                        help="order in which queued urls are fetched: one FIFO queue, or per-host queues")
+    parser.add_argument("--extractor", choices=EXTRACTORS, default="streaming",
+                        help="extract text and links in one pass without building a tree, or always build the full lxml tree")
+    parser.add_argument("--stats-file", default=CrawlStats.STATS_FILE_NAME,
+                        help="file the crawl stats are periodically written to, as JSON")
+    parser.add_argument("--stats-interval", type=float, default=CrawlStats.SNAPSHOT_INTERVAL,
+                        help="seconds between crawl stats snapshots")
+    parser.add_argument("--progress-interval", type=float, default=CrawlStats.PROGRESS_INTERVAL,
+                        help="seconds between progress lines")
+    parser.add_argument("--stats-port", type=int,
+                        help="also serve the crawl stats as JSON on http://127.0.0.1:<port>/")
+    parser.add_argument("--no-artifact-cache", action="store_true",
+                        help="parse every page again instead of reusing what earlier runs extracted from it")
+    parser.add_argument("--artifact-cache-file", default=ArtifactCache.FILE_NAME,
+                        help="file the extracted outlinks, token counts and fingerprints of each page are cached in")
+    parser.add_argument("--artifact-cache-max-mb", type=float, default=ArtifactCache.MAX_BYTES / 2 ** 20,
+                        help="size past which the oldest cached pages are evicted")
+    parser.add_argument("--clear-artifact-cache", action="store_true",
+                        help="empty the artifact cache before crawling")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the crawl by host into this many shards, each crawled by its own process")
+    parser.add_argument("--shard-id", type=int,
+                        help="only run this shard of a sharded crawl (to spread the shards over several machines)")
+    parser.add_argument("--shard-dir", default=SHARD_DIR_NAME,
+                        help="directory the shards work in and exchange urls through (shared by every machine)")
+    parser.add_argument("--merge-shards", action="store_true",
+                        help="merge the analytics of every finished shard into analytics.txt")
+    args = parser.parse_args()
+
+    # Configures basic logging
+    logging.basicConfig(format='%(asctime)s (%(name)s) %(levelname)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p',
+                        level=logging.INFO)
+
+    if args.merge_shards:
+        merge_shards(args.shard_dir, args.shards, args.word_counts)
+    elif args.shards > 1 or args.shard_id is not None:
+        # Every shard works in its own directory, so the corpus is located before any of them starts
+        args.corpus_dir = os.path.abspath(args.corpus_dir)
+        # Batches of urls from other shards are kept until the journal has made them durable
+        crawl = partial(run_crawl, args)
+        if args.shard_id is not None:
+            run_shard(args.shard_dir, args.shard_id, args.shards, crawl, keep_consumed=not args.no_journal)
+        else:
+            crawl_sharded(args.shard_dir, args.shards, crawl, args.word_counts, keep_consumed=not args.no_journal)
+    else:
+        run_crawl(args)
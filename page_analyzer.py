@@ -0,0 +1,335 @@
+import logging
+import re
+import time
+from collections import Counter
+from hashlib import blake2b
+
+from lxml import etree as etree
+from lxml import html
+from lxml.html import soupparser
+
+from corpus import Corpus
+from corpus_record import ContentBuffer
+from artifact_cache import ArtifactCache
+from string_tokenizer import TokenStream
+from fingerprinter import FingerprintStream
+import streaming_extractor
+
+logger = logging.getLogger(__name__)
+
+'''
+The CPU-heavy, per-page half of Crawler.extract_next_links: parsing, text extraction, fingerprinting, tokenizing and
+link extraction.
+Nothing in here touches the Frontier or the Analytics_Data, so it can run in a separate worker process; the crawler
+applies the (small) result to its own state afterwards (see Crawler.apply_page_result).
+'''
+
+#How the text and links of a page are extracted: "streaming" parses the page once without building a tree (see
+#streaming_extractor.py) and only falls back to "tree" if that fails, while "tree" always builds a full lxml tree
+EXTRACTORS = ("streaming", "tree")
+#Content types that are parsed as XML first
+XML_CONTENT_TYPE = re.compile(r'^(text|application)/([\w.-]+\+)?xml$')
+#Number of characters of page text gathered before they are tokenized and fingerprinted
+TEXT_CHUNK_SIZE = 64 * 1024
+
+#Corpus, extractor and (read-only) artifact cache used by fetch_and_analyze inside a worker process; set by init_worker
+worker_corpus = None
+worker_extractor = "streaming"
+worker_artifact_cache = None
+#Content digests of the pages analyzed (with fingerprints) by this worker process, whose copies it doesn't analyze again
+worker_content_digests = set()
+
+class PageText:
+    '''
+    Tokenizes, counts and fingerprints the text of a page as it is extracted, chunk by chunk (see add_text), so the
+    text of a large page never has to be held in memory all at once: only up to TEXT_CHUNK_SIZE characters of it are
+    kept before they are tokenized, and the tokens themselves are only counted, never kept.
+    The time spent tokenizing (and counting) and fingerprinting is measured separately from the parsing around it.
+    '''
+
+    def __init__(self, chunk_size=TEXT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+        self.tokenizer = TokenStream()
+        self.fingerprints = FingerprintStream()
+        self.token_counts = Counter()
+        self.word_count = 0
+        self.tokenize_seconds = 0.0
+        self.fingerprint_seconds = 0.0
+
+    def add_text(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if(self.pending_size >= self.chunk_size):
+            start = time.perf_counter()
+            self.add_tokens(self.tokenizer.feed("".join(self.pending)), start)
+            self.pending = []
+            self.pending_size = 0
+
+    def add_tokens(self, tokens, start=None):
+        if(start is None):
+            start = time.perf_counter()
+        self.token_counts.update(tokens)
+        self.word_count += len(tokens)
+        counted = time.perf_counter()
+        self.fingerprints.add_tokens(tokens)
+        self.tokenize_seconds += counted - start
+        self.fingerprint_seconds += time.perf_counter() - counted
+
+    '''
+    Process the rest of the text; call once all of it has been added
+    '''
+    def close(self):
+        start = time.perf_counter()
+        self.add_tokens(self.tokenizer.feed("".join(self.pending)) + self.tokenizer.close(), start)
+        self.pending = []
+        self.pending_size = 0
+
+    '''
+    Return the page's fingerprints (the time spent finishing them counts towards fingerprinting)
+    '''
+    def get_fingerprints(self):
+        start = time.perf_counter()
+        fingerprints = self.fingerprints.get_fingerprints()
+        self.fingerprint_seconds += time.perf_counter() - start
+        return fingerprints
+
+"""
+Parse a document's bytes from url_data["content], then return
+the parsed lxml object
+
+If it cannot be parsed, return None
+"""
+def parse_document(content):
+    try:
+        doc = html.fromstring(content)
+        return doc
+    except:
+        pass
+    try:
+        doc = etree.fromstring(content)
+        return doc
+    except:
+        pass
+    try:
+        doc = soupparser.fromstring(content)
+        return doc
+    except:
+        return None
+
+'''
+Parse the page's content (a ContentBuffer) with lxml.html (or one of the fallback parsers) and make its links absolute.
+Return (PageText, links), or None if it cannot be parsed.
+'''
+def extract_with_tree(content, url):
+    #Try to parse the document content using lxml.
+    #If that does not work, try BeautifulSoup instead.
+    #The parsers need the whole page in one bytes object, which every one of them is given (it is only copied once)
+    doc = parse_document(content.tobytes())
+    if(doc == None):
+        try:
+            #Check if the bytes contain excessive null terminators.
+            #If so, eliminate them.
+            content_cleaned = content.strip_nul()
+            if(content_cleaned is not None):
+                logger.info("Excess null terminators found. Eliminating now.")
+                doc = parse_document(content_cleaned)
+        except:
+            logger.info("Failed to parse the document.")
+            return None
+    if(doc == None):
+        logger.info("Failed to parse the document.")
+        return None
+
+    doc.make_links_absolute(url)
+
+    #The same text as doc.text_content(), but one text node at a time
+    page_text = PageText()
+    for text in doc.itertext():
+        page_text.add_text(text)
+    return page_text, [link[2] for link in doc.iterlinks()] #Link is a tuple of form (element, attribute, link, pos)
+
+'''
+Extract (PageText, links, parser name) from the page's content (a ContentBuffer) in a single pass with the streaming
+parsers, picking the parsers (and the order they are tried in) from the page's content type alone, so the result
+never depends on which pages were parsed before. Return None if no streaming parser can handle the page.
+The name of every parser that failed is appended to failed_parsers, if given.
+'''
+def extract_streaming(content, url, file_type, failed_parsers=None):
+    parsers = ["xml", "html"] if XML_CONTENT_TYPE.match(file_type) else ["html"]
+
+    for parser_name in parsers:
+        #A parser that fails partway may have added some text already, so each one starts on a fresh PageText
+        page_text = PageText()
+        try:
+            links = streaming_extractor.extract(content, url, parser_name, page_text.add_text)
+        except Exception as error:
+            logger.info("Streaming %s parser failed on %s: %s", parser_name, url, error)
+            if(failed_parsers is not None):
+                failed_parsers.append(parser_name)
+            continue
+        return page_text, links, parser_name
+    return None
+
+'''
+Analyze a page fetched through Corpus.fetch_url.
+Return None if the page cannot be used (no Content-Type, or it could not be parsed).
+Otherwise return a dictionary with:
+    url: the final url of the page
+    fingerprints: the page's fingerprints, for near-duplicate detection
+    tokens: the frequency of each token in the page
+    word_count: the total number of tokens in the page
+    links: every link in the page, in absolute form and in document order (not validated yet)
+    parser: the parser that extracted the page ("html" or "xml" for the streaming ones, "tree" for the fallback)
+    timings: the seconds spent parsing ("parse"), tokenizing and counting ("tokenize") and fingerprinting
+             ("fingerprint") the page, for the crawl stats (see crawl_stats.py)
+The name of every parser that failed on the page ("tree" if the fallback failed too) is appended to failed_parsers,
+if given.
+'''
+def analyze_page(url_data, extractor="streaming", failed_parsers=None):
+    if(url_data["content_type"] == None):
+        return None
+    start = time.perf_counter()
+
+    #Determine the whether the page is an HTML or XML document.
+    #Due to a presumed error in converting from bytes to str, content_type is usually prefixed by "b'" so we need to remove this.
+    content_type = url_data["content_type"].removeprefix("b\'") #https://docs.python.org/3.9/library/stdtypes.html?highlight=removeprefix#str.removeprefix
+    file_type = content_type.split(';')[0] #usually content_type has both a filetype and an encoding, but sometimes the encoding is absent...
+
+    #For some URLs from the fano subdomain, the content is a str object rather than a bytes object.
+    #The buffer reads those as the UTF-8 they are stored in, so they are not decoded and encoded again.
+    #(Note: the professor said on Piazza that we can assume all documents are encoded in UTF-8)
+    content = get_content_buffer(url_data)
+
+    #Use the final URL, if applicable
+    url = get_page_url(url_data)
+
+    extracted = None
+    if(extractor == "streaming"):
+        extracted = extract_streaming(content, url, file_type.strip().strip("'").lower(), failed_parsers)
+    if(extracted is None):
+        extracted = extract_with_tree(content, url)
+        if(extracted is None):
+            if(failed_parsers is not None):
+                failed_parsers.append("tree")
+            return None
+        extracted += ("tree",)
+    #The text was tokenized once, as it was extracted; the same tokens fed the fingerprints and the word frequencies
+    page_text, links, parser = extracted
+    page_text.close()
+    fingerprints = page_text.get_fingerprints()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "fingerprints": fingerprints,
+        "tokens": dict(page_text.token_counts),
+        "word_count": page_text.word_count,
+        "links": links,
+        "parser": parser,
+        "timings": {
+            "parse": elapsed - page_text.tokenize_seconds - page_text.fingerprint_seconds,
+            "tokenize": page_text.tokenize_seconds,
+            "fingerprint": page_text.fingerprint_seconds
+        }
+    }
+
+'''
+Return the url a page fetched through Corpus.fetch_url is recorded under: its final URL, if applicable
+'''
+def get_page_url(url_data):
+    return url_data["final_url"] if (url_data["final_url"] != None) else url_data["url"]
+
+'''
+Return the content of a page fetched through Corpus.fetch_url as a ContentBuffer: a view of its corpus record, unless
+its content was decoded already (or it isn't a UrlData)
+'''
+def get_content_buffer(url_data):
+    record = getattr(url_data, "record", None)
+    if(record is not None and "content" not in url_data):
+        return record.content_buffer()
+    return ContentBuffer(url_data["content"])
+
+'''
+Return a 64-bit digest of a page's raw content (the raw_content field of its corpus file, as is, without decoding it)
+and its Content-Type, or None if the page has neither. Two pages with the same digest are byte-identical, so they
+are analyzed the same way and one is an exact duplicate of the other (see Frontier.is_exact_duplicate).
+'''
+def get_content_digest(url_data):
+    record = getattr(url_data, "record", None)
+    if(record is None or record.content_span is None or url_data["content_type"] is None):
+        return None
+    start, end = record.content_span
+    digest = blake2b(digest_size=8)
+    digest.update(url_data["content_type"].encode("utf-8", "surrogatepass"))
+    digest.update(b"\0")
+    digest.update(memoryview(record.buffer)[start:end])
+    return int.from_bytes(digest.digest(), "little")
+
+'''
+Pool initializer: give each worker process its own Corpus (and its own read-only connection to the artifact cache, if
+the crawler uses one)
+'''
+def init_worker(corpus_base_dir, extractor="streaming", artifact_cache_file=None):
+    global worker_corpus, worker_extractor, worker_artifact_cache
+    worker_corpus = Corpus(corpus_base_dir)
+    worker_extractor = extractor
+    worker_artifact_cache = ArtifactCache(artifact_cache_file, read_only=True) if artifact_cache_file is not None else None
+
+'''
+Fetch and analyze a url inside a worker process, unless it is a copy of a page this worker analyzed before, or its
+artifacts are cached already.
+Return (analyze_page's result, the parsers that failed on the page, the page's artifact cache key, where the result
+came from, the page's url and its content digest). The result came from one of:
+    "analyzed":        analyze_page; the crawler's process stores it in the artifact cache, under its key
+    "artifact_cache":  the artifact cache
+    "exact_duplicate": nowhere; the page was skipped as a copy, and the result is None
+(see Crawler.crawl_parallel)
+'''
+def fetch_and_analyze(url):
+    url_data = worker_corpus.fetch_url(url)
+    page_url = get_page_url(url_data)
+    content_digest = get_content_digest(url_data)
+    failed_parsers = []
+    if(content_digest is not None and content_digest in worker_content_digests):
+        return None, failed_parsers, None, "exact_duplicate", page_url, content_digest
+    key = None
+    source = "analyzed"
+    page_result = None
+    if(worker_artifact_cache is not None):
+        key = ArtifactCache.get_key(url_data, worker_extractor)
+        if(key is not None):
+            found, page_result = worker_artifact_cache.get(key)
+            if(found):
+                source = "artifact_cache"
+    if(source == "analyzed"):
+        page_result = analyze_page(url_data, worker_extractor, failed_parsers)
+    #Only pages with fingerprints are indexed for near-duplicates, and so only their copies can be skipped
+    if(content_digest is not None and page_result is not None and page_result["fingerprints"]):
+        worker_content_digests.add(content_digest)
+    return page_result, failed_parsers, key, source, page_url, content_digest
+
+'''
+Measurement: python page_analyzer.py [file]
+Analyzes the given page (or a generated 4 MB page) with each extractor and prints the peak memory traced while doing so
+'''
+if __name__ == "__main__":
+    import sys
+    import tracemalloc
+
+    if(len(sys.argv) > 1):
+        with open(sys.argv[1], "rb") as page_file:
+            content = page_file.read()
+    else:
+        paragraph = b"<p>Web crawlers & the U.C.I. domain, ICS-141 <a href='/page%d.html'>link</a></p>\n"
+        content = b"<html><body>" + b"".join(paragraph % i for i in range(50000)) + b"</body></html>"
+
+    for extractor in EXTRACTORS:
+        url_data = {"url": "http://www.ics.uci.edu/", "final_url": None, "content_type": "text/html", "content": content}
+        tracemalloc.start()
+        result = analyze_page(url_data, extractor)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:>9}: {:.1f} MB page, {} tokens, {} links, peak {:.1f} MB".format(
+            extractor, len(content) / 2 ** 20, result["word_count"], len(result["links"]), peak / 2 ** 20))
@@ -0,0 +1,331 @@
+import json
+import logging
+import marshal
+import multiprocessing
+import os
+import pickle
+import time
+import uuid
+from contextlib import contextmanager
+from hashlib import blake2b
+from urllib.parse import urlparse
+
+from analytics_data import Analytics_Data
+from crawler import Crawler
+
+logger = logging.getLogger(__name__)
+
+'''
+Sharded crawl: one crawl split across several processes (possibly on several machines sharing the corpus and the shard
+directory), each owning the hosts that hash to it (see get_shard).
+Each shard runs its own Frontier and Crawler in its own working directory; the outlinks it finds on other shards' hosts
+are handed to their owner through a file-based inbox (see ShardRouter). When every shard has finished, their analytics
+data are merged (see Analytics_Data.merge) into one analytics.txt.
+
+Layout of the shard directory:
+    shard.<i>/                    working directory of shard i (its frontier_state, journal, analytics, ...)
+    inbox/shard.<i>/              batches of urls sent to shard i, one marshal file per batch
+    inbox/shard.<i>/consumed/     batches shard i has queued but not yet made durable in its journal
+    status/shard.<i>.json         whether shard i is idle, and how much it has fetched
+
+Since each shard only sees its own hosts, a few heuristics work per shard rather than over the whole crawl: near-
+duplicates are only detected among pages of the same shard, and links to another shard's hosts are counted by the
+sending shard's trap detector too (the owner still checks every url against its own traps before fetching it).
+'''
+
+SHARD_DIR_NAME = "shards"
+
+'''
+Return the shard that owns a url: a stable hash of its host, so every process (and machine) agrees on it
+'''
+def get_shard(url, shard_count):
+    host = urlparse(url).hostname or ""
+    return int.from_bytes(blake2b(host.encode("utf-8", "surrogatepass"), digest_size=8).digest(), "little") % shard_count
+
+def get_shard_working_dir(shard_dir, shard_id):
+    return os.path.join(shard_dir, "shard.{}".format(shard_id))
+
+def get_status_file_name(shard_dir, shard_id):
+    return os.path.join(shard_dir, "status", "shard.{}.json".format(shard_id))
+
+'''
+Return the last status written by a shard, or None if it hasn't written one yet
+'''
+def read_status(shard_dir, shard_id):
+    try:
+        with open(get_status_file_name(shard_dir, shard_id)) as status_file:
+            return json.load(status_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+@contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
+
+
+class ShardRouter:
+    '''
+    Moves urls between the shards of a crawl.
+    Urls for another shard are buffered and written to its inbox in batches (each batch is written to a temporary file
+    and renamed into place, so a batch is never read half-written). A shard reads its own inbox every POLL_PAGES pages,
+    and whenever its queue runs dry.
+
+    The crawl is over once every shard is idle (its queue is empty and it has sent everything) and no batch is waiting
+    in any inbox. A shard bumps its epoch every time it goes from idle back to busy, and does so before it takes a batch
+    out of its inbox; so if the statuses read before and after finding every inbox empty show the same idle shards at the
+    same epochs, no batch was in flight in between, and none can be sent any more.
+    '''
+
+    BATCH_SIZE = 1000 #Urls buffered for a shard before they are sent
+    POLL_PAGES = 100 #Pages between sending the buffered urls and reading the inbox
+    POLL_SECONDS = 0.1 #Time between two looks at the inbox while idle
+
+    '''
+    keep_consumed: keep the batches read from the inbox until checkpoint is called (when the journal has made the urls
+    durable), so they are read again after a crash; otherwise they are deleted as soon as they are read
+    '''
+    def __init__(self, shard_dir, shard_id, shard_count, keep_consumed=True):
+        self.shard_dir = shard_dir
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.keep_consumed = keep_consumed
+        #Batch files are named after the sender and this run, so they never clash with those of an earlier run
+        self.run_id = uuid.uuid4().hex[:12]
+        self.next_batch = 0
+        self.outboxes = [[] for _ in range(shard_count)]
+        self.consumed = []
+        self.pages = 0
+        self.idle = False
+        self.epoch = 0
+        self.sent = 0
+        self.received = 0
+        #Every shard may be the first to start, so each one creates any directory that is missing
+        for shard in range(shard_count):
+            os.makedirs(os.path.join(self.get_inbox_dir(shard), "consumed"), exist_ok=True)
+        os.makedirs(os.path.dirname(get_status_file_name(shard_dir, shard_id)), exist_ok=True)
+
+    def get_inbox_dir(self, shard):
+        return os.path.join(self.shard_dir, "inbox", "shard.{}".format(shard))
+
+    def is_local(self, url):
+        return get_shard(url, self.shard_count) == self.shard_id
+
+    '''
+    Start (or resume) this shard: urls from batches read before a crash are queued again (the frontier drops the ones it
+    already has), and the shard is marked busy
+    '''
+    def start(self, frontier):
+        consumed_dir = os.path.join(self.get_inbox_dir(self.shard_id), "consumed")
+        for name in sorted(os.listdir(consumed_dir)):
+            self.consumed.append(os.path.join(consumed_dir, name))
+            self.add_batch(frontier, self.consumed[-1])
+        self.write_status()
+
+    def send(self, url):
+        shard = get_shard(url, self.shard_count)
+        outbox = self.outboxes[shard]
+        outbox.append(url)
+        if(len(outbox) >= self.BATCH_SIZE):
+            self.send_batch(shard)
+
+    def send_batch(self, shard):
+        urls = self.outboxes[shard]
+        if(not urls):
+            return
+        name = "{}.{}.{}".format(self.shard_id, self.run_id, self.next_batch)
+        self.next_batch += 1
+        temporary_file_name = os.path.join(self.get_inbox_dir(shard), "." + name + ".tmp")
+        with open(temporary_file_name, "wb") as batch_file:
+            marshal.dump(urls, batch_file)
+        os.replace(temporary_file_name, os.path.join(self.get_inbox_dir(shard), name))
+        self.sent += len(urls)
+        self.outboxes[shard] = []
+
+    '''
+    Send every buffered url
+    '''
+    def flush(self):
+        for shard in range(self.shard_count):
+            self.send_batch(shard)
+
+    def add_batch(self, frontier, file_name):
+        with open(file_name, "rb") as batch_file:
+            urls = marshal.load(batch_file)
+        for url in urls:
+            frontier.add_url(url)
+        self.received += len(urls)
+
+    def get_batches(self, shard):
+        return [name for name in os.listdir(self.get_inbox_dir(shard))
+                if not name.startswith(".") and name != "consumed"]
+
+    '''
+    Queue the urls waiting in this shard's inbox; return whether there were any
+    '''
+    def receive(self, frontier):
+        inbox_dir = self.get_inbox_dir(self.shard_id)
+        batches = sorted(self.get_batches(self.shard_id))
+        if(not batches):
+            return False
+        self.set_idle(False)
+        for name in batches:
+            if(self.keep_consumed):
+                file_name = os.path.join(inbox_dir, "consumed", name)
+                os.replace(os.path.join(inbox_dir, name), file_name)
+                self.consumed.append(file_name)
+            else:
+                file_name = os.path.join(inbox_dir, name)
+            self.add_batch(frontier, file_name)
+            if(not self.keep_consumed):
+                os.remove(file_name)
+        return True
+
+    '''
+    Called after every crawled page: sends the buffered urls and reads the inbox every POLL_PAGES pages
+    '''
+    def page_done(self, frontier):
+        self.pages += 1
+        if(self.pages % self.POLL_PAGES == 0):
+            self.flush()
+            self.receive(frontier)
+
+    '''
+    Called when this shard's queue is empty: send everything, then wait for urls from the other shards.
+    Return True once some have been queued, or False when the whole crawl is over.
+    '''
+    def wait_for_urls(self, frontier):
+        self.flush()
+        while True:
+            if(self.receive(frontier) and frontier.has_next_url()):
+                return True
+            self.set_idle(True)
+            if(self.is_crawl_finished()):
+                return False
+            time.sleep(self.POLL_SECONDS)
+
+    '''
+    Called once the urls of the batches read so far are durable (see Crawler.checkpoint)
+    '''
+    def checkpoint(self):
+        for file_name in self.consumed:
+            os.remove(file_name)
+        self.consumed = []
+
+    def set_idle(self, idle):
+        if(idle == self.idle):
+            return
+        self.idle = idle
+        if(not idle):
+            self.epoch += 1
+        self.write_status()
+
+    def write_status(self, **fields):
+        status = dict(fields, shard=self.shard_id, idle=self.idle, epoch=self.epoch, run_id=self.run_id,
+                      sent=self.sent, received=self.received)
+        file_name = get_status_file_name(self.shard_dir, self.shard_id)
+        with open(file_name + ".tmp", "w") as status_file:
+            json.dump(status, status_file)
+        os.replace(file_name + ".tmp", file_name)
+
+    '''
+    Return the (run, epoch) of every shard if they are all idle, or None
+    '''
+    def read_idle_epochs(self):
+        epochs = []
+        for shard in range(self.shard_count):
+            status = read_status(self.shard_dir, shard)
+            if(status is None or not status["idle"]):
+                return None
+            epochs.append((status["run_id"], status["epoch"]))
+        return epochs
+
+    def is_crawl_finished(self):
+        epochs = self.read_idle_epochs()
+        if(epochs is None):
+            return False
+        if(any(self.get_batches(shard) for shard in range(self.shard_count))):
+            return False
+        return self.read_idle_epochs() == epochs
+
+    '''
+    Record that this shard is done, and how many urls it fetched (for the merged analytics)
+    '''
+    def finish(self, fetched):
+        self.checkpoint()
+        self.write_status(done=True, fetched=fetched)
+
+
+'''
+Run shard shard_id of a crawl in its working directory under shard_dir.
+crawl(router) runs the crawl in the current directory with the given router, and returns the Crawler once it is done
+(see run_crawl in main.py).
+Every shard of a crawl has to be started, each exactly once, with a shard_dir that no earlier crawl left statuses in.
+'''
+def run_shard(shard_dir, shard_id, shard_count, crawl, keep_consumed=True):
+    shard_dir = os.path.abspath(shard_dir)
+    working_dir = get_shard_working_dir(shard_dir, shard_id)
+    if(not os.path.exists(working_dir)):
+        os.makedirs(working_dir)
+    router = ShardRouter(shard_dir, shard_id, shard_count, keep_consumed)
+    with working_directory(working_dir):
+        crawler = crawl(router)
+        #Kept for merge_shards, which reads this shard's analytics data back from its working directory
+        crawler.save_analytics_data()
+        #What main.py leaves to exit handlers, which don't run when a shard's process ends
+        if(crawler.journal is not None):
+            crawler.journal.close()
+        else:
+            crawler.frontier.save_frontier()
+        if(crawler.artifact_cache is not None):
+            crawler.artifact_cache.close()
+    router.finish(crawler.frontier.fetched)
+    logger.info("Shard %s finished. Fetched: %s, sent: %s, received: %s", shard_id, crawler.frontier.fetched,
+                router.sent, router.received)
+
+'''
+Merge the analytics of every shard under shard_dir into analytics.txt in the current directory
+'''
+def merge_shards(shard_dir, shard_count, word_counter_mode="exact"):
+    shard_dir = os.path.abspath(shard_dir)
+    analytics_data = Analytics_Data(word_counter_mode)
+    fetched = 0
+    for shard_id in range(shard_count):
+        status = read_status(shard_dir, shard_id)
+        if(status is None or not status.get("done")):
+            raise RuntimeError("Shard {} has not finished".format(shard_id))
+        fetched += status["fetched"]
+        #The shard's url logs are named relative to its working directory
+        with working_directory(get_shard_working_dir(shard_dir, shard_id)):
+            with open(Crawler.ANALYTICS_FILE_NAME, "rb") as analytics_file:
+                shard_data = pickle.load(analytics_file)
+            analytics_data.merge(shard_data)
+            shard_data.urls_downloaded.close()
+            shard_data.traps.close()
+    analytics_data.log_analytics(fetched)
+    return analytics_data
+
+'''
+Run every shard of a crawl in its own process on this machine, then merge their analytics
+'''
+def crawl_sharded(shard_dir, shard_count, crawl, word_counter_mode="exact", keep_consumed=True):
+    #Statuses left by an earlier run would make a shard that starts late look idle
+    for shard_id in range(shard_count):
+        if(os.path.isfile(get_status_file_name(shard_dir, shard_id))):
+            os.remove(get_status_file_name(shard_dir, shard_id))
+    processes = [multiprocessing.Process(target=run_shard, name="shard-{}".format(shard_id),
+                                         args=(shard_dir, shard_id, shard_count, crawl, keep_consumed))
+                 for shard_id in range(shard_count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if(failed):
+        raise RuntimeError("Shards failed: {}".format(", ".join(failed)))
+    print("All shards finished.\nMerging analytics...")
+    return merge_shards(shard_dir, shard_count, word_counter_mode)
@@ -0,0 +1,164 @@
+import re
+from urllib.parse import urljoin
+
+from lxml import etree
+from lxml.html import defs
+
+from corpus_record import ContentBuffer
+
+'''
+Single-pass extraction of a page's text and links.
+The page is run through an lxml parser with a parser target (see ExtractorTarget), so the parser's events are
+consumed as they come and no tree is ever built. The text is handed on chunk by chunk as it is parsed, and is never
+put together into one string.
+The result is the same as parsing the page with lxml.html.fromstring and calling make_links_absolute, text_content
+and iterlinks on it (which is what page_analyzer falls back to):
+    - text is every text node of the document, in document order
+    - links are found in the same attributes, meta refreshes and stylesheets as iterlinks, in the same order, and are
+      made absolute against the page's <base href> and url the same way make_links_absolute does
+    - links inside <style> elements are replaced by their absolute form in the text too, since make_links_absolute
+      rewrites them before text_content is called (against the <base href> seen so far; HTML only allows <base>
+      before any stylesheet anyway)
+'''
+
+#The same patterns lxml.html uses to find links in stylesheets, object archives and meta refreshes
+CSS_URL = re.compile(r'url\((' + '["][^"]*["]|' + "['][^']*[']|" + r'[^)]*)\)', re.I)
+CSS_IMPORT = re.compile(r'@import "(.*?)"')
+ARCHIVE_URL = re.compile(r'[^ ]+')
+META_REFRESH_URL = re.compile(r'[^;=]*;\s*(?:url\s*=\s*)?(?P<url>.*)$', re.I)
+LINK_ATTRIBUTES = defs.link_attrs
+
+class ExtractionError(Exception):
+    pass
+
+'''
+Strip the quotes around a link found in a stylesheet or a meta refresh; return (link, position of the link)
+'''
+def unquote(link, position=0):
+    if(link[:1] == '"' and link[-1:] == '"' or link[:1] == "'" and link[-1:] == "'"):
+        return link[1:-1], position + 1
+    return link, position
+
+'''
+Return (position, link) of each link in a style attribute or stylesheet, ordered like iterlinks orders them
+(last one first)
+'''
+def get_css_links(css, with_imports):
+    links = [unquote(match.group(1), match.start(1))[::-1] for match in CSS_URL.finditer(css)]
+    if(with_imports):
+        links += [(match.start(1), match.group(1)) for match in CSS_IMPORT.finditer(css)]
+    links.sort(reverse=True)
+    return links
+
+
+class ExtractorTarget:
+    '''
+    lxml parser target that passes text on to add_text and collects (not yet absolute) links as the document is parsed
+    '''
+
+    def __init__(self, url, add_text):
+        self.url = url
+        self.add_text = add_text
+        self.links = []
+        self.elements = 0
+        self.base_href = None
+        self.style_text = None #Text of the <style> element being parsed
+        self.style_links = None #Links in the style attribute of that element, which iterlinks reports after its text
+
+    '''
+    Make a link absolute, the way make_links_absolute does
+    '''
+    def make_absolute(self, link):
+        if(self.base_href):
+            link = urljoin(self.base_href, link.strip())
+        return urljoin(self.url, link.strip())
+
+    def start(self, tag, attrib):
+        self.elements += 1
+        tag = tag.rsplit("}", 1)[-1] #Drop any XML namespace
+        if(tag == "base" and "href" in attrib):
+            #make_links_absolute removes <base href> elements, after resolving every link against the last one
+            self.base_href = attrib["href"]
+            return
+
+        links = self.links
+        if(tag == "object"):
+            #<object> attributes are relative to its codebase
+            codebase = attrib.get("codebase")
+            if(codebase is not None):
+                links.append(codebase)
+            for name in ("classid", "data"):
+                if(name in attrib):
+                    links.append(attrib[name] if codebase is None else urljoin(codebase, attrib[name]))
+            if("archive" in attrib):
+                for match in ARCHIVE_URL.finditer(attrib["archive"]):
+                    links.append(match.group(0) if codebase is None else urljoin(codebase, match.group(0)))
+        else:
+            for name in LINK_ATTRIBUTES:
+                if(name in attrib):
+                    links.append(attrib[name])
+
+        if(tag == "meta"):
+            if(attrib.get("http-equiv", "").lower() == "refresh"):
+                content = attrib.get("content", "")
+                match = META_REFRESH_URL.search(content)
+                url = (match.group("url") if match else content).strip()
+                if(url):
+                    links.append(unquote(url)[0])
+        elif(tag == "param"):
+            if((attrib.get("valuetype") or "").lower() == "ref" and attrib.get("value") is not None):
+                links.append(attrib["value"])
+
+        style_links = [link for _, link in get_css_links(attrib["style"], False)] if "style" in attrib else []
+        if(tag == "style"):
+            self.style_text = []
+            self.style_links = style_links
+        else:
+            links.extend(style_links)
+
+    def end(self, tag):
+        if(self.style_text is not None and tag.rsplit("}", 1)[-1] == "style"):
+            stylesheet = "".join(self.style_text)
+            stylesheet_links = get_css_links(stylesheet, True)
+            #Last link first, so the positions of the others stay valid
+            for position, link in stylesheet_links:
+                stylesheet = stylesheet[:position] + self.make_absolute(link) + stylesheet[position + len(link):]
+            self.add_text(stylesheet)
+            self.links.extend(link for _, link in stylesheet_links)
+            self.links.extend(self.style_links)
+            self.style_text = self.style_links = None
+
+    def data(self, data):
+        #The text of a stylesheet is held back until its links have been made absolute
+        if(self.style_text is not None):
+            self.style_text.append(data)
+        else:
+            self.add_text(data)
+
+    def close(self):
+        return self
+
+'''
+Extract the text and the absolute links of a page in one pass, with the given parser ("html" or "xml").
+content is the page's bytes, or a ContentBuffer (see corpus_record.py), whose view the parser reads in place, so the
+page isn't copied first.
+The text is passed to add_text in chunks, in document order, and the links are returned.
+Raise ExtractionError (or the parser's own error) if the page cannot be parsed.
+'''
+def extract(content, url, parser_name, add_text):
+    #lxml doesn't check the length of a buffer that isn't bytes before reading it
+    if(len(content) == 0):
+        raise ExtractionError("Document is empty")
+    target = ExtractorTarget(url, add_text)
+    if(parser_name == "xml"):
+        parser = etree.XMLParser(target=target, resolve_entities=False, no_network=True)
+    else:
+        parser = etree.HTMLParser(target=target)
+    etree.fromstring(content.view if isinstance(content, ContentBuffer) else content, parser)
+    if(target.elements == 0):
+        raise ExtractionError("Document is empty")
+
+    links = target.links
+    for i, link in enumerate(links):
+        links[i] = target.make_absolute(link)
+    return links
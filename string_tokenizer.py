@@ -1,12 +1,73 @@
-from collections import defaultdict
+import re
+from collections import Counter
+
+from sys import argv #for testing
+from timeit import timeit #for testing
+
+#A token is a run of ASCII letters and digits (the ASCII characters for which str.isalnum() is true)
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+'''
+Split a string into its tokens, in order.
+Non-ASCII characters are dropped before the string is split, so that they are ignored rather than ending a token
+(e.g. "cafés" becomes the single token "cafs"), and every token is lowercased.
+This tokenizes a whole string at once (for tokenize and fingerprinter.get_fingerprints). The crawler's pages are not
+tokenized with it: page_analyzer.PageText feeds their text chunk by chunk through a TokenStream, which splits it the
+same way, and hands each chunk's tokens to both the word counts and the FingerprintStream, so the text is still only
+scanned once.
+'''
+def find_tokens(text) -> list:
+    return TOKEN_PATTERN.findall(text.encode('ascii', 'ignore').decode('ascii').lower())
+
+class TokenStream:
+    '''
+    Splits text that arrives in chunks into tokens, exactly as find_tokens would split the whole text.
+    A token that runs up to the end of a chunk may continue in the next one, so it is held back until the chunk after
+    it (or close) shows where it ends.
+    '''
+
+    def __init__(self):
+        self.carry = ''
+
+    '''
+    Return the tokens that end in this chunk
+    '''
+    def feed(self, chunk) -> list:
+        text = self.carry + chunk.encode('ascii', 'ignore').decode('ascii').lower()
+        tokens = TOKEN_PATTERN.findall(text)
+        if(tokens and text[-1].isalnum()):
+            self.carry = tokens.pop()
+        else:
+            self.carry = ''
+        return tokens
+
+    '''
+    Return the last token, once all the text has been fed
+    '''
+    def close(self) -> list:
+        tokens = [self.carry] if self.carry else []
+        self.carry = ''
+        return tokens
+
+'''
+Count the frequency of each token in a list of tokens
+'''
+def count_tokens(tokens) -> Counter:
+    return Counter(tokens)
 
 '''
 A basic tokenizer function repurposed from Assignment 1
 Take a string and tokenize it
 '''
-def tokenize(text) -> defaultdict:
-    #Use token_dict to store frequency of each token in the input string
-    token_dict = defaultdict(int)
+def tokenize(text) -> Counter:
+    return count_tokens(find_tokens(text))
+
+'''
+The original character-by-character tokenizer from Assignment 1.
+find_tokens must produce exactly the same tokens; this is kept as the reference for the benchmark below.
+'''
+def find_tokens_by_char(text) -> list:
+    tokens = []
     token = ''  #Current token being read
 
     for char in text:
@@ -17,11 +78,29 @@ def tokenize(text) -> defaultdict:
             token += char.lower()
         #a non-alphanumeric character denotes the end of a token
         elif (token != ''):
-            token_dict[token] += 1
+            tokens.append(token)
             token = ''
 
     #Be sure to process any tokens at the very end of the string
     if (token != ''):
-        token_dict[token] += 1
+        tokens.append(token)
+
+    return tokens
+
+'''
+Microbenchmark: python string_tokenizer.py [file]
+Tokenizes the given file (or a generated page) with both tokenizers, checks that they agree, and prints the speedup
+'''
+if __name__ == "__main__":
+    if(len(argv) > 1):
+        with open(argv[1], encoding="utf-8", errors="replace") as input_file:
+            text = input_file.read()
+    else:
+        text = "Café ICS-141, Fall 2020: Web crawlers & the U.C.I. domain... " * 50000
 
-    return token_dict
+    assert find_tokens(text) == find_tokens_by_char(text), "Tokenizers disagree"
+    runs = 3
+    slow = timeit(lambda: find_tokens_by_char(text), number=runs) / runs
+    fast = timeit(lambda: find_tokens(text), number=runs) / runs
+    print("{} characters, {} tokens".format(len(text), len(find_tokens(text))))
+    print("character loop: {:.4f}s  regex: {:.4f}s  speedup: {:.1f}x".format(slow, fast, slow / fast))
@@ -0,0 +1,110 @@
+import re
+from urllib.parse import urlparse, parse_qsl
+
+from word_sketch import CountMinSketch
+
+'''
+Template-aware crawler trap detection.
+A url is collapsed into a template (see get_template): its host and path, with the parts that vary within a family of
+generated pages normalized (numbers, dates, ids and repeated path segments), followed by its query parameters, whose
+values are normalized the same way. Non-numeric values are kept, so a site that routes its pages through a query
+(e.g. doku.php?id=start) has a template per page rather than one for the whole site. Every url that enters the frontier is counted once under its template, in a
+Count-Min sketch of fixed size, so memory doesn't grow with the number of urls or templates crawled.
+Once a template has been counted limit times, it is a trap (see Frontier.count_template): every url with that template
+is rejected from then on, including the ones already queued, so the rest of a calendar or session-id family is never
+fetched.
+
+Usage: python trap_detector.py [url ...] prints the template of each url (or of a few examples)
+'''
+
+#Parts of a path segment that are normalized, in order of precedence: dates (2019-01-05, 2019_01, 20190105),
+#ids (uuids and long runs of letters and digits that contain a digit) and any other run of digits
+VARIABLE_PART = re.compile(r'(?P<date>(?<!\d)(?:\d{4}[-_.]\d{1,2}(?:[-_.]\d{1,2})?|(?:19|20)\d{6})(?!\d))|'
+                           r'(?P<id>[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|'
+                           r'(?<![0-9A-Za-z])(?=[A-Za-z]*\d)[0-9A-Za-z]{16,}(?![0-9A-Za-z]))|'
+                           r'(?P<number>\d+)')
+#Longest block of path segments that is collapsed when it repeats right after itself (e.g. /a/b/a/b/c to /a/b/c)
+MAX_REPEATED_BLOCK = 3
+
+def normalize_part(match):
+    return "<{}>".format(match.lastgroup)
+
+'''
+Collapse consecutive repetitions of a block of segments into a single one
+'''
+def collapse_repeats(segments):
+    for size in range(1, MAX_REPEATED_BLOCK + 1):
+        collapsed = []
+        for segment in segments:
+            collapsed.append(segment)
+            if(len(collapsed) >= 2 * size and collapsed[-size:] == collapsed[-2 * size:-size]):
+                del collapsed[-size:]
+        segments = collapsed
+    return segments
+
+'''
+Return the template of a url, e.g. calendar.ics.uci.edu/events/<date>/day<number>.php?sid=<id>&view=day
+for http://calendar.ics.uci.edu/events/2019-01-05/day3.php?view=day&sid=3f2a...
+'''
+def get_template(url):
+    parsed = urlparse(url)
+    segments = collapse_repeats([VARIABLE_PART.sub(normalize_part, segment) for segment in parsed.path.split("/")])
+    template = parsed.netloc.lower() + "/".join(segments)
+    if(parsed.query):
+        parameters = sorted(set("{}={}".format(VARIABLE_PART.sub(normalize_part, name),
+                                               VARIABLE_PART.sub(normalize_part, value))
+                                for name, value in parse_qsl(parsed.query, keep_blank_values=True)))
+        template += "?" + "&".join(parameters)
+    return template
+
+
+class TrapDetector:
+    '''
+    Counts urls by template, in fixed memory, and reports the templates that reach the limit.
+    The sketch is updated conservatively (see CountMinSketch.add_conservative), so a template is rarely overcounted
+    by the ones that share its counters.
+    '''
+
+    URL_LIMIT = 100 #Number of distinct urls a template may have before it is deemed a trap
+    WIDTH = 2 ** 16
+    DEPTH = 4
+
+    def __init__(self, limit=URL_LIMIT, width=WIDTH, depth=DEPTH):
+        self.limit = limit
+        self.sketch = CountMinSketch(width, depth)
+
+    '''
+    Count a url under its template; return the template if it has reached the limit, otherwise None
+    '''
+    def count(self, url):
+        template = get_template(url)
+        if(self.sketch.add_conservative(template) >= self.limit):
+            return template
+        return None
+
+    def estimate(self, url):
+        return self.sketch.estimate(get_template(url))
+
+    def nbytes(self):
+        return sum(row.itemsize * len(row) for row in self.sketch.rows)
+
+    def get_stats(self):
+        return {
+            "urls_counted": self.sketch.total,
+            "bytes": self.nbytes(),
+            "error_bound": self.sketch.error_bound()
+        }
+
+
+if __name__ == "__main__":
+    import sys
+
+    urls = sys.argv[1:] or [
+        "http://calendar.ics.uci.edu/calendar.php?type=day&date=2019-01-05",
+        "http://www.ics.uci.edu/~user/pubs/paper12.pdf",
+        "http://archive.ics.uci.edu/ml/datasets/Iris?sid=9f86d081884c7d659a2feaa0c55ad015",
+        "http://www.ics.uci.edu/a/b/a/b/a/b/index.html",
+        "http://www.ics.uci.edu/events/20190105/"
+    ]
+    for url in urls:
+        print("{} -> {}".format(url, get_template(url)))
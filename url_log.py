@@ -0,0 +1,85 @@
+import os
+
+from disk_frontier import UrlSeenSet
+
+'''
+An append-only, on-disk set of URLs.
+URLs are written to a text file (one per line, through a write buffer) as soon as they are added. Duplicates are
+skipped with a UrlSeenSet next to the log (see disk_frontier.py): its Bloom filter answers most lookups from a fixed
+amount of memory, and its positives are confirmed on disk, so memory doesn't grow with the number of URLs logged.
+Reading the URLs back streams them from the file.
+Pickling a UrlLog only stores its file name, so the analytics pickle stays small however many URLs were logged.
+'''
+
+class UrlLog:
+
+    BUFFER_SIZE = 1024 * 1024
+    ENCODING = "utf-8"
+    ERRORS = "surrogatepass" #URLs pulled out of broken pages can contain lone surrogates
+    #Size of the seen-set's Bloom filter; past this many URLs it still works, but more lookups go to the disk
+    EXPECTED_URLS = 1000000
+    FALSE_POSITIVE_RATE = 0.01
+
+    def __init__(self, file_name, resume=False):
+        self.file_name = file_name
+        directory = os.path.dirname(file_name)
+        if(directory and not os.path.exists(directory)):
+            os.makedirs(directory)
+        #The seen-set is rebuilt from the log, which is the only record of what was logged
+        self.seen = UrlSeenSet(file_name + ".seen", self.EXPECTED_URLS, self.FALSE_POSITIVE_RATE)
+        self.seen.clear()
+        if(resume and os.path.isfile(file_name)):
+            for url in self.read():
+                if(url not in self.seen):
+                    self.seen.add(url)
+        else:
+            #Start over; anything in an old log belongs to a different crawl
+            open(file_name, "w").close()
+        self.file = open(file_name, "a", encoding=self.ENCODING, errors=self.ERRORS, buffering=self.BUFFER_SIZE)
+
+    '''
+    Log a URL unless it was logged before; return whether it was added
+    '''
+    def add(self, url):
+        #Keep one URL per line even if a broken link contains a line break
+        url = url.replace("\n", "%0A").replace("\r", "%0D")
+        if(url in self.seen):
+            return False
+        self.seen.add(url)
+        self.file.write(url)
+        self.file.write("\n")
+        return True
+
+    def __contains__(self, url):
+        return url.replace("\n", "%0A").replace("\r", "%0D") in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def read(self):
+        with open(self.file_name, encoding=self.ENCODING, errors=self.ERRORS) as log_file:
+            for line in log_file:
+                yield line[:-1]
+
+    '''
+    Stream every logged URL, in the order they were added
+    '''
+    def __iter__(self):
+        self.flush()
+        return self.read()
+
+    def flush(self):
+        self.file.flush()
+        self.seen.flush()
+
+    def close(self):
+        self.file.close()
+        self.seen.flush()
+        self.seen.connection.close()
+
+    def __getstate__(self):
+        self.flush()
+        return {"file_name": self.file_name}
+
+    def __setstate__(self, state):
+        self.__init__(state["file_name"], resume=True)
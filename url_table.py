@@ -0,0 +1,253 @@
+from array import array
+from hashlib import blake2b
+
+from sys import argv #for the measurement
+
+'''
+URL interning.
+The UrlTable assigns every distinct url a small integer id and stores each url only once, as UTF-8 bytes in a single
+growing buffer, with an open-addressing hash table (also made of arrays) mapping urls back to their ids.
+The frontier's queue, seen-set and trap set then only hold ids (see InternedQueue and InternedSet) instead of each
+keeping its own Python str objects. Frontier.near_dupes is keyed by id too, but stays a defaultdict(int): only the
+few urls with near-duplicates are in it, so an array over every id (see IdCounter) would be larger.
+
+Measurement: python url_table.py [url_count]
+This measures a synthetic loop over generated urls (see the end of this file), not a crawl, so the bytes per url it
+reports are those of the structures alone, on urls shaped like the corpus's.
+'''
+
+ENCODING = "utf-8"
+ERRORS = "surrogatepass" #urls pulled out of broken pages can contain lone surrogates
+
+class UrlTable:
+
+    INITIAL_SLOTS = 1024 #Must be a power of two
+    EMPTY = -1
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('Q', [0]) #url i is data[offsets[i]:offsets[i + 1]]
+        self.hashes = array('Q')
+        self.slots = array('i', [self.EMPTY]) * self.INITIAL_SLOTS #Ids of the urls, by hash
+
+    @staticmethod
+    def get_hash(encoded):
+        return int.from_bytes(blake2b(encoded, digest_size=8).digest(), "little")
+
+    '''
+    Return the slot holding the id of the encoded url, or the empty slot where it would go
+    '''
+    def find_slot(self, encoded, h):
+        mask = len(self.slots) - 1
+        slot = h & mask
+        while True:
+            url_id = self.slots[slot]
+            if(url_id == self.EMPTY):
+                return slot
+            if(self.hashes[url_id] == h and self.data[self.offsets[url_id]:self.offsets[url_id + 1]] == encoded):
+                return slot
+            slot = (slot + 1) & mask
+
+    '''
+    Return the id of a url, or None if it was never interned
+    '''
+    def lookup(self, url):
+        encoded = url.encode(ENCODING, ERRORS)
+        url_id = self.slots[self.find_slot(encoded, self.get_hash(encoded))]
+        return None if url_id == self.EMPTY else url_id
+
+    '''
+    Return the id of a url, assigning the next id if it is new
+    '''
+    def intern(self, url):
+        encoded = url.encode(ENCODING, ERRORS)
+        h = self.get_hash(encoded)
+        slot = self.find_slot(encoded, h)
+        url_id = self.slots[slot]
+        if(url_id != self.EMPTY):
+            return url_id
+
+        url_id = len(self.hashes)
+        self.data += encoded
+        self.offsets.append(len(self.data))
+        self.hashes.append(h)
+        self.slots[slot] = url_id
+        #Keep the table at most half full
+        if(2 * len(self.hashes) > len(self.slots)):
+            self.grow()
+        return url_id
+
+    def grow(self):
+        self.slots = array('i', [self.EMPTY]) * (len(self.slots) * 2)
+        mask = len(self.slots) - 1
+        for url_id, h in enumerate(self.hashes):
+            slot = h & mask
+            while(self.slots[slot] != self.EMPTY):
+                slot = (slot + 1) & mask
+            self.slots[slot] = url_id
+
+    def get(self, url_id):
+        return self.data[self.offsets[url_id]:self.offsets[url_id + 1]].decode(ENCODING, ERRORS)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets) + self.hashes.itemsize * len(self.hashes) + \
+               self.slots.itemsize * len(self.slots)
+
+
+class InternedQueue:
+    '''
+    FIFO queue of urls, stored as an array of url ids
+    (the table is not pickled along with the queue; the owner re-attaches it, see Frontier.attach_url_table)
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.ids = array('Q')
+        self.head = 0
+
+    def append(self, url):
+        self.ids.append(self.table.intern(url))
+
+    def popleft(self):
+        if(self.head >= len(self.ids)):
+            raise IndexError("pop from an empty queue")
+        url_id = self.ids[self.head]
+        self.head += 1
+        #Drop the consumed part of the array once it makes up most of it
+        if(self.head >= 4096 and 2 * self.head >= len(self.ids)):
+            del self.ids[:self.head]
+            self.head = 0
+        return self.table.get(url_id)
+
+    def appendleft(self, url):
+        url_id = self.table.intern(url)
+        if(self.head > 0):
+            self.head -= 1
+            self.ids[self.head] = url_id
+        else:
+            self.ids.insert(0, url_id)
+
+    def __iter__(self):
+        for i in range(self.head, len(self.ids)):
+            yield self.table.get(self.ids[i])
+
+    def __len__(self):
+        return len(self.ids) - self.head
+
+    def clear(self):
+        self.ids = array('Q')
+        self.head = 0
+
+    def __getstate__(self):
+        return {"ids": self.ids[self.head:], "head": 0}
+
+
+class InternedSet:
+    '''
+    Set of urls, stored as a bitmap indexed by url id
+    (the table is not pickled along with the set; the owner re-attaches it, see Frontier.attach_url_table)
+    '''
+
+    def __init__(self, table):
+        self.table = table
+        self.bits = bytearray()
+        self.count = 0
+
+    def add(self, url):
+        url_id = self.table.intern(url)
+        if(url_id >> 3 >= len(self.bits)):
+            self.bits.extend(bytes(max((url_id >> 3) + 1 - len(self.bits), len(self.bits))))
+        if(not self.bits[url_id >> 3] & (1 << (url_id & 7))):
+            self.bits[url_id >> 3] |= 1 << (url_id & 7)
+            self.count += 1
+
+    def __contains__(self, url):
+        url_id = self.table.lookup(url)
+        return url_id is not None and url_id >> 3 < len(self.bits) and bool(self.bits[url_id >> 3] & (1 << (url_id & 7)))
+
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            if(byte):
+                for bit in range(8):
+                    if(byte & (1 << bit)):
+                        yield self.table.get((index << 3) | bit)
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def __getstate__(self):
+        return {"bits": self.bits, "count": self.count}
+
+
+class IdCounter:
+    '''
+    Counts keyed by url id, stored in an array indexed by id (a replacement for defaultdict(int) keyed by url, for
+    counters that most urls have); only the measurement below uses it so far
+    '''
+
+    def __init__(self):
+        self.counts = array('L')
+
+    def __getitem__(self, url_id):
+        return self.counts[url_id] if url_id < len(self.counts) else 0
+
+    def __setitem__(self, url_id, count):
+        if(url_id >= len(self.counts)):
+            self.counts.extend(array('L', [0]) * max(url_id + 1 - len(self.counts), len(self.counts)))
+        self.counts[url_id] = count
+
+
+'''
+Measure the memory used per url by the frontier's url structures, with plain strings and with interning, on
+generated urls rather than a crawl.
+Each url is queued, added to the seen-set, and its trimmed form (without the query) is used as a counter key,
+like Frontier.add_url does (the counter is a dense IdCounter here, unlike the sparse Frontier.near_dupes).
+'''
+if __name__ == "__main__":
+    import random
+    import tracemalloc
+    from collections import deque, defaultdict
+
+    url_count = int(argv[1]) if len(argv) > 1 else 200000
+    random.seed(0)
+    hosts = ["www.ics.uci.edu", "vision.ics.uci.edu", "fano.ics.uci.edu", "calendar.ics.uci.edu", "archive.ics.uci.edu"]
+    urls = ["http://{}/~user{}/{}/page{}.html?id={}".format(random.choice(hosts), random.randrange(2000),
+                                                            random.choice(["pubs", "courses", "events/2019"]), i, i % 97)
+            for i in range(url_count)]
+
+    def measure(build):
+        tracemalloc.start()
+        structures = build()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return used / url_count, structures
+
+    def build_plain():
+        queue, seen, counters = deque(), set(), defaultdict(int)
+        for url in urls:
+            url = "".join(url) #A fresh string, as each page's links would be
+            queue.append(url)
+            seen.add(url)
+            counters[url.split("?")[0]] += 1
+        return queue, seen, counters
+
+    def build_interned():
+        table = UrlTable()
+        queue, seen, counters = InternedQueue(table), InternedSet(table), IdCounter()
+        for url in urls:
+            queue.append(url)
+            seen.add(url)
+            counters[table.intern(url.split("?")[0])] += 1
+        return table, queue, seen, counters
+
+    plain, _ = measure(build_plain)
+    interned, _ = measure(build_interned)
+    print("{} urls: {:.0f} bytes/url with strings, {:.0f} bytes/url interned ({:.1f}x smaller)".format(
+        url_count, plain, interned, plain / interned))
@@ -0,0 +1,135 @@
+import heapq
+import math
+import sys
+from array import array
+from hashlib import blake2b
+
+'''
+Fixed-memory word counting for the analytics.
+A Count-Min sketch estimates the frequency of every word ever seen, and a small set of candidate heavy hitters keeps
+track of which words may be in the top K. Memory use depends only on the sketch dimensions and K, not on the size
+of the vocabulary.
+'''
+
+class CountMinSketch:
+    '''
+    Count-Min sketch: depth rows of width counters. Estimates never undercount, and overcount by at most
+    (e / width) * total with probability 1 - e ** -depth.
+    '''
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    '''
+    Column of the word in each row, by double hashing a stable 64-bit hash
+    (Python's hash() of a str changes between runs, and the sketch is pickled along with the analytics data)
+    '''
+    def columns(self, word):
+        h = int.from_bytes(blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    '''
+    Add amount to the count of word and return its new estimate
+    '''
+    def add(self, word, amount=1):
+        self.total += amount
+        estimate = None
+        for row, column in zip(self.rows, self.columns(word)):
+            row[column] += amount
+            if(estimate is None or row[column] < estimate):
+                estimate = row[column]
+        return estimate
+
+    '''
+    Add amount to the count of word with a conservative update: only the counters below the new estimate are raised
+    (to it), which keeps the estimates of the words sharing them lower than add does. Return the new estimate.
+    '''
+    def add_conservative(self, word, amount=1):
+        self.total += amount
+        columns = self.columns(word)
+        estimate = min(row[column] for row, column in zip(self.rows, columns)) + amount
+        for row, column in zip(self.rows, columns):
+            if(row[column] < estimate):
+                row[column] = estimate
+        return estimate
+
+    def estimate(self, word):
+        return min(row[column] for row, column in zip(self.rows, self.columns(word)))
+
+    '''
+    Add the counts of another sketch of the same dimensions to this one
+    '''
+    def merge(self, other):
+        if(other.width != self.width or other.depth != self.depth):
+            raise ValueError("Cannot merge sketches of different dimensions")
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                if(count):
+                    row[column] += count
+        self.total += other.total
+
+    '''
+    Maximum amount by which an estimate may exceed the true count (with probability 1 - e ** -depth)
+    '''
+    def error_bound(self):
+        return math.ceil(math.e / self.width * self.total)
+
+
+class TopKSketch:
+    '''
+    Approximate top-K word frequencies in bounded memory.
+    Every word goes into the Count-Min sketch; a word is kept as a candidate while its estimate could place it among
+    the top. Candidates are pruned back to capacity whenever they grow to twice that.
+    '''
+
+    def __init__(self, top_k=50, width=2 ** 16, depth=4, capacity=None):
+        self.top_k = top_k
+        self.capacity = capacity if capacity is not None else top_k * 4
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        #Smallest estimate that survived the last pruning; a new word needs more than this to become a candidate
+        self.threshold = 0
+
+    def add(self, word, amount=1):
+        estimate = self.sketch.add(word, amount)
+        if(word in self.candidates or estimate > self.threshold or len(self.candidates) < self.capacity):
+            self.candidates[word] = estimate
+            if(len(self.candidates) >= 2 * self.capacity):
+                self.prune()
+
+    def prune(self):
+        kept = heapq.nlargest(self.capacity, self.candidates.items(), key=lambda item: item[1])
+        self.candidates = dict(kept)
+        self.threshold = kept[-1][1]
+
+    '''
+    Add the word counts of another TopKSketch to this one: the sketches are merged, and the candidates of both are kept
+    with their merged estimates
+    '''
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        candidates = set(self.candidates) | set(other.candidates)
+        self.candidates = {word: self.sketch.estimate(word) for word in candidates}
+        if(len(self.candidates) >= 2 * self.capacity):
+            self.prune()
+
+    '''
+    Return the top K words as (word, estimated count) pairs, most frequent first (ties broken alphabetically)
+    '''
+    def most_common(self):
+        estimates = [(word, self.sketch.estimate(word)) for word in self.candidates]
+        return heapq.nsmallest(self.top_k, estimates, key=lambda item: (-item[1], item[0]))
+
+    def error_bound(self):
+        return self.sketch.error_bound()
+
+    '''
+    Approximate number of bytes used: the sketch's counters and the candidates table (but not the words in it)
+    '''
+    def nbytes(self):
+        return sum(row.itemsize * len(row) for row in self.sketch.rows) + sys.getsizeof(self.candidates)